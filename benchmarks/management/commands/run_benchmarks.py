@@ -0,0 +1,93 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from benchmarks.runner import HTTPTransport, InProcessTransport, compare, environment, run_scenario
+from benchmarks.scenarios import SCENARIOS, Context
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the checkout, catalog, order list and webhook hot paths against seeded data "
+        "(see seed_benchmark_data) and report latency percentiles, requests/sec and queries per request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run, from {', '.join(SCENARIOS)} (all by default).")
+        parser.add_argument("--requests", type=int, default=200, help="Measured requests per scenario.")
+        parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests sent first.")
+        parser.add_argument("--concurrency", type=int, default=1, help="Concurrent workers.")
+        parser.add_argument("--url", help="Base URL of a running server; requests are sent in process if not given.")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed for the generated requests.")
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+        parser.add_argument("--compare", help="JSON results of an earlier run to compare against.")
+        parser.add_argument(
+            "--max-regression", type=float,
+            help="Fail if a compared metric got worse by more than this many percent.",
+        )
+
+    def handle(self, *args, **options):
+        unknown = set(options["scenarios"]) - SCENARIOS.keys()
+        if unknown:
+            raise CommandError(f"Unknown scenario(s): {', '.join(sorted(unknown))}.")
+
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"]) as file:
+                baseline = json.load(file)
+
+        try:
+            context = Context()
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options["url"]:
+            make_transport = lambda: HTTPTransport(options["url"])  # noqa: E731
+        else:
+            # Lets the test client's host through ALLOWED_HOSTS and keeps emails in memory
+            setup_test_environment()
+            make_transport = InProcessTransport
+
+        results = {"environment": environment(), "options": {
+            key: options[key] for key in ("requests", "warmup", "concurrency", "url", "seed")
+        }, "scenarios": []}
+        try:
+            for name in options["scenarios"] or SCENARIOS:
+                scenario = run_scenario(
+                    name, SCENARIOS[name], context, make_transport, options["requests"],
+                    concurrency=options["concurrency"], warmup=options["warmup"], random_seed=options["seed"],
+                )
+                results["scenarios"].append(scenario)
+                self.write_scenario(scenario)
+        finally:
+            if not options["url"]:
+                teardown_test_environment()
+
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(results, file, indent=2)
+            self.stdout.write(f"Results written to {options['output']}.")
+
+        if baseline:
+            self.write_comparison(compare(baseline, results), options["max_regression"])
+
+    def write_scenario(self, scenario):
+        latency = scenario["latency_ms"]
+        queries = scenario["queries_per_request"]
+        self.stdout.write(
+            f"{scenario['name']:<16} p50 {latency['p50']:>9.2f} ms  p99 {latency['p99']:>9.2f} ms  "
+            f"{scenario['requests_per_second']:>9.1f} req/s  "
+            f"{'-' if queries is None else queries:>6} queries/req  {scenario['errors']} error(s)"
+        )
+
+    def write_comparison(self, rows, max_regression):
+        regressions = []
+        self.stdout.write("\nChange against baseline:")
+        for name, metric, before, after, change, worse in rows:
+            label = "n/a" if change is None else f"{change:+.1f}%"
+            self.stdout.write(f"{name:<16} {metric:<8} {before!s:>10} -> {after!s:<10} {label}")
+            if worse and max_regression is not None and abs(change) > max_regression:
+                regressions.append(f"{name} {metric} {label}")
+
+        if regressions:
+            raise CommandError(f"Regressed by more than {max_regression}%: {', '.join(regressions)}")
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from benchmarks.seed import SCALES, reset, seed
+
+
+class Command(BaseCommand):
+    help = "Seed a synthetic catalog, customers and order history for run_benchmarks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scale", choices=SCALES, default="small", help="Preset sizes, overridden by the options below.")
+        parser.add_argument("--categories", type=int, help="Number of categories.")
+        parser.add_argument("--products", type=int, help="Number of products.")
+        parser.add_argument("--users", type=int, help="Number of customers.")
+        parser.add_argument("--orders-per-user", type=int, help="Past orders per customer.")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed; the same seed gives the same data.")
+        parser.add_argument("--reset", action="store_true", help="Delete previously seeded benchmark data first.")
+        parser.add_argument("--delete", action="store_true", help="Only delete previously seeded benchmark data.")
+
+    def handle(self, *args, **options):
+        if options["reset"] or options["delete"]:
+            reset()
+            self.stdout.write("Deleted previous benchmark data.")
+            if options["delete"]:
+                return
+
+        sizes = {key: options[key] if options[key] is not None else value for key, value in SCALES[options["scale"]].items()}
+        created = seed(**sizes, random_seed=options["seed"])
+        self.stdout.write(f"Seeded {created['products']} product(s), {created['users']} user(s) and {created['orders']} order(s).")
@@ -0,0 +1,180 @@
+"""
+Benchmark runner.
+
+Drives a scenario with a number of concurrent workers, each sending requests
+through its own transport: in process through Django's test client, which also
+counts the queries of every request, or over HTTP to a running server, where
+query counts are not available. Reports are plain dicts (see report()) so a
+run can be saved as JSON and compared with one from another commit.
+"""
+import json
+import platform
+import random
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+import django
+import httpx
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+
+class InProcessTransport:
+    """Sends requests through the Django test client and counts their queries."""
+
+    def __init__(self):
+        self.client = Client()
+
+    def send(self, method, path, body, headers):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.generic(method, path, data=encode(body), content_type="application/json", headers=headers)
+        return response.status_code, len(ctx.captured_queries)
+
+    def close(self):
+        connections.close_all()
+
+
+class HTTPTransport:
+    """Sends requests to a running server; queries are not counted."""
+
+    def __init__(self, base_url):
+        self.client = httpx.Client(base_url=base_url, timeout=30)
+
+    def send(self, method, path, body, headers):
+        response = self.client.request(method, path, content=encode(body), headers={"Content-Type": "application/json", **headers})
+        return response.status_code, None
+
+    def close(self):
+        self.client.close()
+
+
+def encode(body):
+    if body is None:
+        return ""
+    return body if isinstance(body, str) else json.dumps(body)
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))]
+
+
+def run_scenario(name, build_request, context, make_transport, requests, concurrency=1, warmup=0, random_seed=0):
+    """
+    Send `requests` requests built by `build_request`, split over `concurrency`
+    workers (after `warmup` unmeasured ones), and return the scenario's report.
+
+    With one worker everything runs in the calling thread, which keeps the
+    requests inside the caller's transaction (e.g. in tests).
+    """
+    samples = []  # (seconds, status, queries) per request
+    lock = threading.Lock()
+
+    def work(worker, count, measured):
+        rng = random.Random(f"{random_seed}:{name}:{worker}:{measured}")
+        transport = make_transport()
+        try:
+            for _ in range(count):
+                method, path, body, headers = build_request(context, rng)
+                started = time.perf_counter()
+                try:
+                    status, queries = transport.send(method, path, body, headers)
+                except Exception:
+                    status, queries = "error", None
+                elapsed = time.perf_counter() - started
+                if measured:
+                    with lock:
+                        samples.append((elapsed, status, queries))
+        finally:
+            if concurrency > 1:
+                transport.close()
+
+    def run(total, measured):
+        counts = [total // concurrency + (1 if worker < total % concurrency else 0) for worker in range(concurrency)]
+        if concurrency == 1:
+            work(0, total, measured)
+            return
+        threads = [threading.Thread(target=work, args=(worker, count, measured)) for worker, count in enumerate(counts)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    run(warmup, measured=False)
+    started = time.perf_counter()
+    run(requests, measured=True)
+    return report(name, samples, time.perf_counter() - started, concurrency)
+
+
+def report(name, samples, wall_time, concurrency):
+    latencies = sorted(sample[0] * 1000 for sample in samples)
+    statuses = {}
+    for _, status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    queries = [sample[2] for sample in samples if sample[2] is not None]
+
+    return {
+        "name": name,
+        "requests": len(samples),
+        "concurrency": concurrency,
+        "errors": sum(count for status, count in statuses.items() if not status.isdigit() or int(status) >= 500),
+        "status_codes": statuses,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+            "p50": round(percentile(latencies, 0.50), 3) if latencies else None,
+            "p90": round(percentile(latencies, 0.90), 3) if latencies else None,
+            "p99": round(percentile(latencies, 0.99), 3) if latencies else None,
+            "max": round(latencies[-1], 3) if latencies else None,
+        },
+        "requests_per_second": round(len(samples) / wall_time, 2) if wall_time else None,
+        "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def environment():
+    """What a run was measured on, stored with its results."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "commit": commit,
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+    }
+
+
+# Metric name -> (path in a scenario report, True if higher is better)
+COMPARED_METRICS = {
+    "p50_ms": (("latency_ms", "p50"), False),
+    "p99_ms": (("latency_ms", "p99"), False),
+    "rps": (("requests_per_second",), True),
+    "queries": (("queries_per_request",), False),
+}
+
+
+def compare(baseline, current):
+    """
+    Rows of (scenario, metric, baseline value, current value, change in %,
+    True if the change is for the worse) for the scenarios in both runs.
+    """
+    rows = []
+    baseline_scenarios = {scenario["name"]: scenario for scenario in baseline["scenarios"]}
+    for scenario in current["scenarios"]:
+        old = baseline_scenarios.get(scenario["name"])
+        if old is None:
+            continue
+        for metric, (path, higher_is_better) in COMPARED_METRICS.items():
+            before, after = old, scenario
+            for key in path:
+                before, after = before.get(key), after.get(key)
+            change = round((after - before) / before * 100, 1) if before and after is not None else None
+            worse = change is not None and (change < 0 if higher_is_better else change > 0)
+            rows.append((scenario["name"], metric, before, after, change, worse))
+    return rows
@@ -0,0 +1,93 @@
+"""
+Benchmark scenarios.
+
+A scenario builds one request at a time from the seeded data: a function taking
+the shared Context and a random.Random, returning (method, path, body, headers)
+where the body is None, a JSON-serializable value or an already encoded string.
+Customers authenticate with JWTs minted up front, so every scenario runs the
+same way in process and against a live server.
+"""
+import hashlib
+import hmac
+import json
+import time
+import uuid
+from django.conf import settings
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from payments.models import Payment
+from .seed import WORDS, bench_products, bench_users
+
+# Share of webhook requests that redeliver an event already sent
+WEBHOOK_REPLAY_RATE = 0.3
+
+
+class Context:
+    """Ids and credentials the scenarios draw from, loaded once before a run."""
+
+    def __init__(self, limit=1000):
+        self.product_ids = list(bench_products().order_by("id").values_list("id", flat=True)[:limit])
+        self.tokens = [f"Bearer {RefreshToken.for_user(user).access_token}" for user in bench_users().order_by("id")[:limit]]
+        self.payment_intents = list(
+            Payment.objects.filter(order__user__in=bench_users()).exclude(stripe_payment_intent=None)
+            .order_by("id").values_list("stripe_payment_intent", flat=True)[:limit]
+        )
+        self.sent_events = []
+        if not self.product_ids or not self.tokens:
+            raise ValueError("No benchmark data found; run `manage.py seed_benchmark_data` first.")
+
+
+def auth(context, rng):
+    return {"Authorization": rng.choice(context.tokens)}
+
+
+def catalog_list(context, rng):
+    return "GET", reverse("product-list"), None, {}
+
+
+def product_detail(context, rng):
+    return "GET", reverse("product-detail", args=[rng.choice(context.product_ids)]), None, {}
+
+
+def product_search(context, rng):
+    return "GET", f"{reverse('product-search')}?q={'+'.join(rng.sample(WORDS, 2))}", None, {}
+
+
+def order_list(context, rng):
+    return "GET", reverse("order-list-create"), None, auth(context, rng)
+
+
+def checkout(context, rng):
+    items = [{"product": product_id, "quantity": rng.randint(1, 2)} for product_id in rng.sample(context.product_ids, 3)]
+    return "POST", reverse("checkout"), {"order_items": items}, auth(context, rng)
+
+
+def stripe_signature(payload):
+    """A Stripe-Signature header for `payload`, signed with STRIPE_WEBHOOK_SECRET like Stripe does."""
+    timestamp = int(time.time())
+    secret = settings.STRIPE_WEBHOOK_SECRET
+    signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def stripe_webhook(context, rng):
+    if context.sent_events and rng.random() < WEBHOOK_REPLAY_RATE:
+        event = rng.choice(context.sent_events)
+    else:
+        intent = rng.choice(context.payment_intents) if context.payment_intents else "pi_missing"
+        event = {"id": f"evt_bench_{uuid.uuid4().hex}", "object": "event", "type": "payment_intent.succeeded",
+                 "data": {"object": {"id": intent}}}
+        context.sent_events.append(event)
+    payload = json.dumps(event)
+    return "POST", reverse("stripe-webhook"), payload, {"Stripe-Signature": stripe_signature(payload)}
+
+
+SCENARIOS = {
+    "catalog_list": catalog_list,
+    "product_detail": product_detail,
+    "product_search": product_search,
+    "order_list": order_list,
+    "checkout": checkout,
+    "stripe_webhook": stripe_webhook,
+}
@@ -0,0 +1,110 @@
+"""
+Synthetic data for benchmarks.
+
+Seeds a catalog, customers and their order history at a given scale, all
+recognisable by their prefixes (SKU "BENCH-", category "bench ", email
+"bench...@example.test") so they can be removed again with reset(). The data is
+generated from a fixed random seed, so two runs at the same scale benchmark
+the same database.
+"""
+import random
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from orders.models import Order, OrderItem
+from orders.summaries import rebuild as rebuild_order_summaries
+from payments.models import Payment
+from products.importer import import_products
+from products.models import Category, Product
+
+User = get_user_model()
+
+SKU_PREFIX = "BENCH-"
+CATEGORY_PREFIX = "bench "
+EMAIL_DOMAIN = "@example.test"
+PASSWORD = "bench-pass-123"
+
+SCALES = {
+    "small": {"categories": 10, "products": 500, "users": 20, "orders_per_user": 5},
+    "medium": {"categories": 50, "products": 10000, "users": 200, "orders_per_user": 20},
+    "large": {"categories": 200, "products": 100000, "users": 2000, "orders_per_user": 50},
+}
+WORDS = [
+    "wireless", "phone", "charger", "laptop", "stand", "cable", "speaker", "camera", "lens", "watch",
+    "keyboard", "mouse", "monitor", "headphones", "adapter", "battery", "case", "tripod", "drone", "router",
+]
+
+
+def bench_users():
+    return User.objects.filter(email__startswith="bench", email__endswith=EMAIL_DOMAIN)
+
+
+def bench_products():
+    return Product.objects.filter(sku__startswith=SKU_PREFIX)
+
+
+def reset():
+    """Delete everything a previous seed() created."""
+    with transaction.atomic():
+        Order.objects.filter(user__in=bench_users()).delete()
+        bench_users().delete()
+        bench_products().delete()
+        Category.objects.filter(name__startswith=CATEGORY_PREFIX).delete()
+
+
+def seed(categories, products, users, orders_per_user, items_per_order=3, random_seed=0):
+    """Create the catalog, customers and order history. Returns the number of each created."""
+    rng = random.Random(random_seed)
+
+    def rows():
+        for i in range(products):
+            name = " ".join(rng.sample(WORDS, 3)).title()
+            yield i + 1, {
+                "sku": f"{SKU_PREFIX}{i:07d}",
+                "name": f"{name} {i}",
+                "description": f"**{name}** for everyday use.\n\n- Model {i}\n- {rng.choice(WORDS)} compatible",
+                "category": f"{CATEGORY_PREFIX}{i % categories}",
+                "price": str(Decimal(rng.randrange(199, 99999)) / 100),
+                "stock": 1_000_000,
+            }
+
+    import_products(rows())
+    catalog = list(bench_products().values_list("id", "price"))
+
+    password = make_password(PASSWORD)
+    User.objects.bulk_create(
+        [User(email=f"bench{i}{EMAIL_DOMAIN}", username=f"bench{i}", password=password) for i in range(users)],
+        ignore_conflicts=True,
+    )
+    user_ids = list(bench_users().values_list("id", flat=True))
+
+    orders = 0
+    for user_id in user_ids:
+        orders += _seed_orders(rng, user_id, catalog, orders_per_user, items_per_order)
+    rebuild_order_summaries(user_ids)
+    return {"products": len(catalog), "users": len(user_ids), "orders": orders}
+
+
+def _seed_orders(rng, user_id, catalog, count, items_per_order):
+    """One user's order history: mostly paid orders, with their items and Stripe payments."""
+    with transaction.atomic():
+        orders = Order.objects.bulk_create([
+            Order(user_id=user_id, status="Completed" if rng.random() < 0.8 else "Canceled") for _ in range(count)
+        ])
+        items, payments = [], []
+        for order in orders:
+            order.total_amount = Decimal("0.00")
+            for product_id, price in rng.sample(catalog, min(items_per_order, len(catalog))):
+                quantity = rng.randint(1, 3)
+                items.append(OrderItem(order=order, product_id=product_id, quantity=quantity, total_price=price * quantity))
+                order.total_amount += price * quantity
+            payments.append(Payment(
+                order=order, amount=order.total_amount, stripe_payment_intent=f"pi_bench_{order.id}",
+                status="Completed" if order.status == "Completed" else "Failed",
+            ))
+        Order.objects.bulk_update(orders, ["total_amount"])
+        OrderItem.objects.bulk_create(items)
+        Payment.objects.bulk_create(payments)
+    return len(orders)
@@ -0,0 +1,41 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from orders.models import Order
+from payments.models import WebhookEvent
+from .runner import InProcessTransport, compare, percentile, run_scenario
+from .scenarios import SCENARIOS, Context
+from .seed import bench_products, reset, seed
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seeded = seed(categories=3, products=20, users=3, orders_per_user=2)
+
+    def test_seed_creates_the_requested_scale(self):
+        self.assertEqual(self.seeded, {"products": 20, "users": 3, "orders": 6})
+        self.assertTrue(all(order.items.count() == 3 for order in Order.objects.all()))
+
+        reset()
+        self.assertFalse(bench_products().exists())
+        self.assertFalse(Order.objects.exists())
+
+    def test_every_scenario_runs_without_errors(self):
+        context = Context()
+        for name, build_request in SCENARIOS.items():
+            result = run_scenario(name, build_request, context, InProcessTransport, requests=5, warmup=1)
+
+            self.assertEqual(result["requests"], 5)
+            self.assertTrue(all(status.startswith("2") for status in result["status_codes"]), f"{name}: {result['status_codes']}")
+            self.assertIsNotNone(result["queries_per_request"])  # Cached catalog reads may need none
+            self.assertIsNotNone(result["latency_ms"]["p99"])
+        self.assertTrue(WebhookEvent.objects.exists())
+
+    def test_compare_flags_regressions(self):
+        baseline = {"scenarios": [{"name": "checkout", "latency_ms": {"p50": 10, "p99": 20}, "requests_per_second": 100, "queries_per_request": 9}]}
+        current = {"scenarios": [{"name": "checkout", "latency_ms": {"p50": 12, "p99": 20}, "requests_per_second": 120, "queries_per_request": 9}]}
+
+        rows = {metric: (change, worse) for _, metric, _, _, change, worse in compare(baseline, current)}
+        self.assertEqual(rows, {"p50_ms": (20.0, True), "p99_ms": (0.0, False), "rps": (20.0, False), "queries": (0.0, False)})
+        self.assertEqual(percentile([1, 2, 3, 4], 0.5), 2)
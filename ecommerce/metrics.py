@@ -0,0 +1,130 @@
+"""
+In-process request metrics.
+
+MetricsMiddleware (ecommerce.middleware) records every request here: latency,
+database queries and their time, serializer time and response size, per view
+and method. Values are aggregated into fixed-bucket histograms and running sums
+under one lock, so recording costs a few additions per request, and are exposed
+in the Prometheus text format by metrics_view. Each worker process keeps its
+own metrics; scrape every worker (or sum them) for the whole picture.
+"""
+import hmac
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+# Methods recorded under their own label; any other method a client sends is recorded as "OTHER"
+METHODS = frozenset({"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "TRACE", "CONNECT"})
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one counts values above every bucket
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        """(le, cumulative count) pairs, ending with +Inf."""
+        cumulative = 0
+        for bound, count in zip([*self.buckets, "+Inf"], self.counts):
+            cumulative += count
+            yield bound, cumulative
+
+
+class ViewMetrics:
+    __slots__ = ("latency", "queries", "db_seconds", "serializer_seconds", "response_bytes")
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.response_bytes = 0
+
+
+_lock = threading.Lock()
+_requests = defaultdict(int)  # (view, method, status) -> requests
+_views = defaultdict(ViewMetrics)  # (view, method) -> ViewMetrics
+
+
+def record(view, method, status, seconds, queries, db_seconds, serializer_seconds, response_bytes):
+    with _lock:
+        _requests[view, method, str(status)] += 1
+        metrics = _views[view, method]
+        metrics.latency.observe(seconds)
+        metrics.queries.observe(queries)
+        metrics.db_seconds += db_seconds
+        metrics.serializer_seconds += serializer_seconds
+        metrics.response_bytes += response_bytes
+
+
+def reset():
+    with _lock:
+        _requests.clear()
+        _views.clear()
+
+
+def label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def labels(**values):
+    return "{" + ",".join(f'{name}="{label_value(value)}"' for name, value in values.items()) + "}"
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        requests = sorted(_requests.items())
+        views = sorted((key, metrics) for key, metrics in _views.items())
+        lines = [
+            "# HELP http_requests_total Requests handled, by view, method and status code.",
+            "# TYPE http_requests_total counter",
+            *[f"http_requests_total{labels(view=view, method=method, status=status)} {count}" for (view, method, status), count in requests],
+        ]
+        for name, attribute, help_text in (
+            ("http_request_duration_seconds", "latency", "Time spent handling requests."),
+            ("http_request_db_queries", "queries", "Database queries run per request."),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for (view, method), metrics in views:
+                histogram = getattr(metrics, attribute)
+                for bound, count in histogram.samples():
+                    lines.append(f"{name}_bucket{labels(view=view, method=method, le=bound)} {count}")
+                lines.append(f"{name}_sum{labels(view=view, method=method)} {round(histogram.sum, 6)}")
+                lines.append(f"{name}_count{labels(view=view, method=method)} {histogram.count}")
+        for name, attribute, help_text in (
+            ("http_request_db_seconds_total", "db_seconds", "Time spent in database queries."),
+            ("http_request_serializer_seconds_total", "serializer_seconds", "Time spent building serializer data."),
+            ("http_response_size_bytes_total", "response_bytes", "Bytes of response bodies sent."),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for (view, method), metrics in views:
+                lines.append(f"{name}{labels(view=view, method=method)} {round(getattr(metrics, attribute), 6)}")
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. Readable by staff users, or with
+    `Authorization: Bearer <METRICS_TOKEN>` when a token is configured.
+    """
+    token = settings.METRICS_TOKEN
+    authorized = request.user.is_authenticated and request.user.is_staff
+    if token and hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        authorized = True
+    if not authorized:
+        return HttpResponseForbidden("Metrics are only available to staff or with the metrics token.")
+    return HttpResponse(render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,202 @@
+"""
+Project middleware.
+
+MetricsMiddleware times every request, counts its database queries and their
+time through an execute wrapper installed on every connection, and times DRF
+serializers building their data, then records the totals in ecommerce.metrics.
+The request being measured is found through a context variable, which also
+follows async views' ORM calls into the threads they run in.
+Requests slower than METRICS_SLOW_REQUEST_MS, or running more than
+METRICS_SLOW_REQUEST_QUERIES queries, are logged with their slowest and most
+repeated SQL so N+1 queries and missing indexes can be traced to a view.
+
+ReplicaPinMiddleware keeps clients reading from the primary for a while after
+they write, see ecommerce.replicas.
+
+Both support sync and async requests, so async views keep running on the
+event loop under ASGI.
+"""
+import contextvars
+import logging
+import time
+from collections import Counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.permissions import SAFE_METHODS
+
+from . import metrics, replicas
+
+logger = logging.getLogger("ecommerce.metrics")
+
+# SQL statements listed per slow request, for both the slowest and the most repeated ones
+SLOW_REQUEST_STATEMENTS = 5
+
+_current = contextvars.ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+    """What one request spent, filled in while it runs."""
+
+    __slots__ = ("queries", "db_seconds", "serializer_seconds", "serializing")
+
+    def __init__(self):
+        self.queries = []  # (sql, seconds)
+        self.db_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.serializing = False
+
+
+def record_query(execute, sql, params, many, context):
+    current = _current.get()
+    if current is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        current.queries.append((sql, elapsed))
+        current.db_seconds += elapsed
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_recorder)
+
+
+def time_serializers():
+    """
+    Make BaseSerializer.data add its time to the current request. Only the
+    outermost serializer is timed, nested ones are part of its time.
+    """
+    from rest_framework.serializers import BaseSerializer
+
+    data = BaseSerializer.data.fget
+    if getattr(data, "timed", False):
+        return
+
+    def timed_data(self):
+        current = _current.get()
+        if current is None or current.serializing:
+            return data(self)
+        current.serializing = True
+        started = time.perf_counter()
+        try:
+            return data(self)
+        finally:
+            current.serializer_seconds += time.perf_counter() - started
+            current.serializing = False
+
+    timed_data.timed = True
+    BaseSerializer.data = property(timed_data)
+
+
+def response_size(response):
+    if response.has_header("Content-Length"):
+        return int(response["Content-Length"])
+    return 0 if response.streaming else len(response.content)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        time_serializers()
+        # Connections opened before this module was loaded
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        current = RequestMetrics()
+        token = _current.set(current)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, current, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+
+        current = RequestMetrics()
+        token = _current.set(current)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, current, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, current, elapsed):
+        match = request.resolver_match
+        view = match.view_name if match else "unmatched"
+        method = request.method if request.method in metrics.METHODS else "OTHER"
+        metrics.record(
+            view, method, response.status_code, elapsed, len(current.queries),
+            current.db_seconds, current.serializer_seconds, response_size(response),
+        )
+        if elapsed * 1000 >= settings.METRICS_SLOW_REQUEST_MS or len(current.queries) > settings.METRICS_SLOW_REQUEST_QUERIES:
+            log_slow_request(request, response, view, elapsed, current)
+
+
+def log_slow_request(request, response, view, elapsed, current):
+    slowest = sorted(current.queries, key=lambda query: query[1], reverse=True)[:SLOW_REQUEST_STATEMENTS]
+    repeated = Counter(sql for sql, _ in current.queries).most_common(SLOW_REQUEST_STATEMENTS)
+    lines = [
+        f"Slow request {request.method} {request.path} ({view}) -> {response.status_code}: "
+        f"{elapsed * 1000:.1f} ms, {len(current.queries)} queries in {current.db_seconds * 1000:.1f} ms, "
+        f"serializers {current.serializer_seconds * 1000:.1f} ms",
+        "Slowest queries:",
+        *[f"  {seconds * 1000:.1f} ms: {sql}" for sql, seconds in slowest],
+    ]
+    if repeated and repeated[0][1] > 1:
+        lines += ["Repeated queries:", *[f"  {count}x: {sql}" for sql, count in repeated if count > 1]]
+    logger.warning("\n".join(lines))
+
+
+class ReplicaPinMiddleware:
+    """Pins clients to the primary after a successful write, see ecommerce.replicas."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if self.wrote(request, response):
+            replicas.pin(request, response)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if self.wrote(request, response):
+            # Pinning a user may load it from the session
+            await sync_to_async(replicas.pin)(request, response)
+        return response
+
+    @staticmethod
+    def wrote(request, response):
+        return settings.DATABASE_REPLICAS and request.method not in SAFE_METHODS and response.status_code < 400
@@ -0,0 +1,111 @@
+"""
+Read replica routing.
+
+Views with ReplicaReadMixin read from one of settings.DATABASE_REPLICAS for
+GET/HEAD/OPTIONS requests; everything else (writes, stock reservations,
+payments, anything inside a transaction) stays on the primary. Replicas lag
+behind the primary, so a client that has just written is pinned to the primary
+for DATABASE_REPLICA_PIN_SECONDS: ReplicaPinMiddleware marks it with a cookie,
+and authenticated users also in the cache, which covers token clients that
+don't keep cookies. Without replicas configured all of this is a no-op.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+PIN_COOKIE = "db_pin"
+
+_replica = ContextVar("replica", default=None)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replica = _replica.get()
+        # Reads inside a transaction must see its writes
+        if replica is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return replica
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        return db not in settings.DATABASE_REPLICAS
+
+
+def use_replica():
+    """Route the current context's reads to a random replica. Returns the token to pass to reset()."""
+    replicas = settings.DATABASE_REPLICAS
+    return _replica.set(random.choice(replicas) if replicas else None)
+
+
+def reset(token):
+    _replica.reset(token)
+
+
+@contextmanager
+def replica_reads():
+    token = use_replica()
+    try:
+        yield
+    finally:
+        reset(token)
+
+
+@contextmanager
+def primary_reads():
+    token = _replica.set(None)
+    try:
+        yield
+    finally:
+        reset(token)
+
+
+def user_pin_key(user_id):
+    return f"db_pin:{user_id}"
+
+
+def pin(request, response):
+    """Keep the client that made `request` on the primary until the replicas have its write."""
+    seconds = settings.DATABASE_REPLICA_PIN_SECONDS
+    response.set_cookie(PIN_COOKIE, f"{time.time() + seconds:.3f}", max_age=seconds, httponly=True, samesite="Lax")
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        cache.set(user_pin_key(user.pk), True, seconds)
+
+
+def is_pinned(request):
+    try:
+        if float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time():
+            return True
+    except ValueError:
+        pass
+    user = request.user
+    return user.is_authenticated and cache.get(user_pin_key(user.pk)) is not None
+
+
+class ReplicaReadMixin:
+    """
+    Reads safe-method requests from a replica once the request is authenticated
+    (authentication itself reads the primary), unless the client is pinned.
+    """
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if settings.DATABASE_REPLICAS and request.method in SAFE_METHODS and not is_pinned(request):
+            self._replica_token = use_replica()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, "_replica_token", None)
+        if token is not None:
+            self._replica_token = None
+            reset(token)
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -0,0 +1,178 @@
+from decimal import Decimal
+from unittest import mock
+from asgiref.sync import iscoroutinefunction
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import router, transaction
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+
+from orders.models import Order
+from orders.views import OrderListCreateView
+from products import catalog_cache
+from products.models import Category, Product
+from products.views import ProductListCreateView
+from . import metrics
+from .middleware import MetricsMiddleware, ReplicaPinMiddleware
+from .replicas import PIN_COOKIE, primary_reads, replica_reads
+
+User = get_user_model()
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.customer = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        self.admin = User.objects.create_superuser(email="admin@example.com", username="admin", password="pass12345")
+        category = Category.objects.create(name="Gadgets")
+        Product.objects.create(name="Phone", description="-", category=category, price=Decimal("100.00"), stock=5)
+        Order.objects.create(user=self.customer)
+        self.client = APIClient()
+
+    def test_records_latency_queries_serializer_time_and_size_per_view(self):
+        self.client.force_authenticate(self.customer)
+        response = self.client.get(reverse("order-list-create"))
+        self.client.get(reverse("order-list-create"))
+        self.assertEqual(response.status_code, 200)
+
+        view = metrics._views["order-list-create", "GET"]
+        self.assertEqual(metrics._requests["order-list-create", "GET", "200"], 2)
+        self.assertEqual(view.latency.count, 2)
+        self.assertGreater(view.latency.sum, 0)
+        self.assertGreater(view.queries.sum, 0)
+        self.assertGreater(view.db_seconds, 0)
+        self.assertGreater(view.serializer_seconds, 0)
+        self.assertEqual(view.response_bytes, 2 * len(response.content))
+
+    def test_unmatched_paths_share_one_label(self):
+        self.client.get("/no/such/page/")
+        self.assertEqual(metrics._requests["unmatched", "GET", "404"], 1)
+
+    def test_unknown_methods_share_one_label(self):
+        self.client.generic("PROPFIND", reverse("product-list"))
+        self.client.generic("X-RANDOM-1", reverse("product-list"))
+        self.assertEqual([(method, count) for (_, method, _), count in metrics._requests.items()], [("OTHER", 2)])
+
+    def test_endpoint_requires_staff_or_token(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+
+        self.client.force_login(self.customer)
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+
+        self.client.force_login(self.admin)
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 200)
+
+        self.client.logout()
+        with override_settings(METRICS_TOKEN="scrape-secret"):
+            self.assertEqual(self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+            self.assertEqual(self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer scrape-secret").status_code, 200)
+
+    def test_prometheus_text_format(self):
+        self.client.get(reverse("product-list"))
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse("metrics"))
+
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        body = response.content.decode()
+        self.assertIn("# TYPE http_request_duration_seconds histogram", body)
+        self.assertIn('http_requests_total{view="product-list",method="GET",status="200"} 1', body)
+        self.assertIn('http_request_duration_seconds_bucket{view="product-list",method="GET",le="+Inf"} 1', body)
+        self.assertIn('http_request_duration_seconds_count{view="product-list",method="GET"} 1', body)
+        self.assertIn('http_request_db_queries_bucket{view="product-list",method="GET",le="+Inf"} 1', body)
+        self.assertIn('http_response_size_bytes_total{view="product-list",method="GET"}', body)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram((1, 5))
+        for value in (0, 1, 3, 9):
+            histogram.observe(value)
+        self.assertEqual(list(histogram.samples()), [(1, 2), (5, 3), ("+Inf", 4)])
+        self.assertEqual(metrics.labels(view='a"b\\c'), '{view="a\\"b\\\\c"}')
+
+    @override_settings(METRICS_SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_with_their_sql(self):
+        self.client.force_authenticate(self.customer)
+        with self.assertLogs("ecommerce.metrics", level="WARNING") as logs:
+            self.client.get(reverse("order-list-create"))
+
+        self.assertIn("Slow request GET /api/orders/ (order-list-create) -> 200", logs.output[0])
+        self.assertIn("Slowest queries:", logs.output[0])
+        self.assertIn('FROM "orders_order"', logs.output[0])
+
+    async def test_async_requests_are_measured_without_leaving_the_event_loop(self):
+        async def view(request):
+            return HttpResponse("ok")
+        self.assertTrue(iscoroutinefunction(MetricsMiddleware(view)))
+        self.assertTrue(iscoroutinefunction(ReplicaPinMiddleware(view)))
+
+        callback = {"Body": {"stkCallback": {"CheckoutRequestID": "ws_CO_1", "ResultCode": 1032}}}
+        await self.async_client.post(reverse("mpesa-callback"), callback, content_type="application/json")
+        self.assertEqual(metrics._requests["mpesa-callback", "POST", "200"], 1)
+        self.assertGreater(metrics._views["mpesa-callback", "POST"].queries.sum, 0)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_can_be_disabled(self):
+        self.client.get(reverse("product-list"))
+        self.assertEqual(metrics._requests, {})
+
+
+def read_database(self, request, *args, **kwargs):
+    """Stands in for a view's list(): reports the database its reads would use."""
+    return Response({"database": Product.objects.all().db})
+
+
+@override_settings(DATABASE_REPLICAS=["replica1"])
+class ReplicaRoutingTests(TransactionTestCase):
+    """Routing decisions only; the patched views never query the (unconfigured) replica."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_reads_in_replica_scope_use_a_replica_except_inside_transactions(self):
+        self.assertEqual(Product.objects.all().db, "default")
+        with replica_reads():
+            self.assertEqual(Product.objects.all().db, "replica1")
+            with primary_reads():
+                self.assertEqual(Product.objects.all().db, "default")
+            with transaction.atomic():
+                self.assertEqual(Product.objects.all().db, "default")
+            self.assertEqual(router.db_for_write(Product), "default")
+
+    @mock.patch.object(OrderListCreateView, "create", lambda self, request, *args, **kwargs: Response(status=201))
+    @mock.patch.object(OrderListCreateView, "list", read_database)
+    def test_clients_read_the_primary_after_their_own_writes(self):
+        url = reverse("order-list-create")
+        self.assertEqual(self.client.get(url).data["database"], "replica1")
+
+        response = self.client.post(url, {}, format="json")
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(self.client.get(url).data["database"], "default")
+
+        # Token clients without cookies are pinned by user
+        self.client.cookies.clear()
+        self.assertEqual(self.client.get(url).data["database"], "default")
+
+        other = User.objects.create_user(email="other@example.com", username="other", password="pass12345")
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(url).data["database"], "replica1")
+
+    @mock.patch.object(ProductListCreateView, "list", read_database)
+    def test_catalog_cache_is_filled_from_the_primary_right_after_a_write(self):
+        self.client.force_authenticate(None)
+        catalog_cache.invalidate()
+        self.assertEqual(self.client.get(reverse("product-list")).json()["database"], "default")
+
+        catalog_cache.shared_cache().set(catalog_cache.VERSION_KEY, "0:settled", None)
+        self.assertEqual(self.client.get(reverse("product-list")).json()["database"], "replica1")
+
+    def test_failed_writes_do_not_pin(self):
+        response = self.client.post(reverse("checkout"), {"order_items": []}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn(PIN_COOKIE, response.cookies)
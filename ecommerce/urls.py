@@ -5,6 +5,7 @@ from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from accounts import views
 from django.contrib.auth import views as auth_views
+from .metrics import metrics_view
 
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
@@ -37,6 +38,7 @@ urlpatterns = [
     path("api/", include("products.urls")),
     path("api/", include("orders.urls")),
     path("api/", include("payments.urls")),
+    path("api/", include("reports.urls")),
 
     # token generation url
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
@@ -44,6 +46,9 @@ urlpatterns = [
 
     # Documentaing using drf-yasg
     path('api/swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
+
+    # Prometheus scrape endpoint
+    path("metrics/", metrics_view, name="metrics"),
 ]
 
 from django.conf import settings
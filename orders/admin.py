@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Order, OrderItem, Coupon
+from .models import Order, OrderItem, Coupon, StockReservation, OrderSummary
 
 class OrderItemInline(admin.TabularInline):
     """
@@ -9,13 +9,20 @@ class OrderItemInline(admin.TabularInline):
     extra = 0  # Prevents adding extra empty rows
 
 
+class StockReservationInline(admin.TabularInline):
+    model = StockReservation
+    extra = 0
+    can_delete = False
+    readonly_fields = ("product", "quantity", "status", "expires_at")
+
+
 class OrderAdmin(admin.ModelAdmin):
     list_display = ("id", "user", "total_amount", "status", "created_at")
     search_fields = ("user__email", "status")
     list_filter = ("status", "created_at")
     ordering = ("-created_at",)
     readonly_fields = ("total_amount",)
-    inlines = [OrderItemInline]  # Allows managing order items within an order
+    inlines = [OrderItemInline, StockReservationInline]  # Allows managing order items within an order
 
 
 class OrderItemAdmin(admin.ModelAdmin):
@@ -30,13 +37,29 @@ class OrderItemAdmin(admin.ModelAdmin):
 
 
 class CouponAdmin(admin.ModelAdmin):
-    list_display = ("id", "code", "product", "discount", "valid_from", "valid_to", "active")
+    list_display = ("id", "code", "product", "discount", "valid_from", "valid_to", "active", "times_used", "usage_limit")
     search_fields = ("code", "product__name")
     list_filter = ("active", "valid_from", "valid_to")
     ordering = ("-valid_from",)
 
 
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ("id", "order", "product", "quantity", "status", "expires_at")
+    search_fields = ("order__id", "product__name")
+    list_filter = ("status",)
+    ordering = ("expires_at",)
+
+
+class OrderSummaryAdmin(admin.ModelAdmin):
+    list_display = ("user", "pending_orders", "completed_orders", "canceled_orders", "lifetime_spend", "last_order_at")
+    search_fields = ("user__email", "user__username")
+    ordering = ("-last_order_at",)
+    readonly_fields = ("pending_orders", "completed_orders", "canceled_orders", "lifetime_spend", "last_order_at")
+
+
 # Register models in the Django admin panel
 admin.site.register(Order, OrderAdmin)
 admin.site.register(OrderItem, OrderItemAdmin)
 admin.site.register(Coupon, CouponAdmin)
+admin.site.register(StockReservation, StockReservationAdmin)
+admin.site.register(OrderSummary, OrderSummaryAdmin)
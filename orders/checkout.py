@@ -0,0 +1,103 @@
+from collections import OrderedDict
+from decimal import Decimal
+from django.db import transaction
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+from .models import Order, OrderItem
+from .coupons import redeem, resolve_cart_coupons
+from .reservations import reserve_order_stock
+from products.models import Product
+
+
+class CheckoutItemSerializer(serializers.Serializer):
+    """Validates the shape of a single cart line without touching the database."""
+    product = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1)
+    coupon = serializers.IntegerField(min_value=1, required=False, allow_null=True)
+    coupon_code = serializers.CharField(max_length=50, required=False, allow_blank=True)
+
+
+def merge_cart_lines(lines):
+    """
+    Merge lines for the same product, keeping the first coupon supplied for it.
+    A line's coupon is kept as its id, or as its code if it was given by code.
+    """
+    merged = OrderedDict()
+    for line in lines:
+        product_id = line["product"]
+        coupon = line.get("coupon") or line.get("coupon_code")
+        if product_id in merged:
+            merged[product_id]["quantity"] += line["quantity"]
+            if not merged[product_id]["coupon"]:
+                merged[product_id]["coupon"] = coupon
+        else:
+            merged[product_id] = {"product": product_id, "quantity": line["quantity"], "coupon": coupon}
+    return list(merged.values())
+
+
+def calculate_line_total(product, quantity, coupon=None):
+    """Same pricing rule as OrderItem.calculate_total_price(), rounded to cents."""
+    subtotal = product.price * quantity
+    discount = (coupon.discount / 100) * subtotal if coupon else 0
+    return (subtotal - discount).quantize(Decimal("0.01"))
+
+
+def place_order(user, cart):
+    """
+    Create a pending order for `cart` (a list of {product, quantity, coupon or
+    coupon_code} dicts).
+
+    Products are loaded once, coupons come from the cached coupon map, stock for
+    every line is deducted with a single all-or-nothing UPDATE, coupon uses are
+    counted with another and the order items and their stock reservations are
+    bulk inserted, so the number of queries does not grow with the size of the
+    cart.
+    """
+    serializer = CheckoutItemSerializer(data=cart, many=True)
+    serializer.is_valid(raise_exception=True)
+    lines = merge_cart_lines(serializer.validated_data)
+
+    products = Product.objects.in_bulk([line["product"] for line in lines])
+    missing = [line["product"] for line in lines if line["product"] not in products]
+    if missing:
+        raise ValidationError({"product": f"Invalid product id(s): {', '.join(map(str, missing))}."})
+
+    coupons = resolve_cart_coupons(lines, products)
+
+    items = []
+    quantities = {}
+    shard_counts = {}
+    total_amount = Decimal("0.00")
+    for line in lines:
+        product = products[line["product"]]
+        quantity = line["quantity"]
+
+        # Sharded products only keep an aggregate on Product.stock, their shards decide.
+        if not product.is_sharded and quantity > product.stock:
+            raise ValidationError({"quantity": f"Only {product.stock} items of {product.name} available in stock."})
+
+        coupon = coupons.get(product.id)
+        total_price = calculate_line_total(product, quantity, coupon)
+        total_amount += total_price
+        quantities[product.id] = quantity
+        if product.is_sharded:
+            shard_counts[product.id] = product.stock_shard_count
+        discount = product.price * quantity - total_price
+        items.append(OrderItem(product=product, quantity=quantity, coupon=coupon, total_price=total_price, discount=discount))
+
+    with transaction.atomic():
+        if not Product.objects.deduct_stock(quantities, shard_counts=shard_counts, change_type="Order Placed"):
+            # Stock moved since the products were loaded; nothing has been deducted.
+            raise ValidationError({"detail": "Insufficient stock for one or more products in your cart."})
+        if not redeem(coupon.id for coupon in coupons.values()):
+            # Rolls back the stock deduction above.
+            raise ValidationError({"coupon": "A coupon in your cart has reached its usage limit."})
+
+        order = Order.objects.create(user=user, status="Pending", total_amount=total_amount)
+        for item in items:
+            item.order = order
+        OrderItem.objects.bulk_create(items)
+        reserve_order_stock(order, quantities)
+
+    return order
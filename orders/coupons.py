@@ -0,0 +1,144 @@
+"""
+Coupon resolution.
+
+Checkout looks coupons up in an in-process map of the active, unexpired
+coupons (keyed by code and by id) instead of querying them per cart line. The
+map is tagged with a coupon version kept in the shared cache, which every
+Coupon write replaces once its transaction commits (see orders.signals), and
+is reloaded with a single query when the version changes or after
+COUPON_CACHE_TIMEOUT seconds.
+
+Usage counters are never cached: redeem() counts one use of every coupon of an
+order with a single conditional UPDATE that refuses to take any of them past
+its usage_limit, and release() gives the uses back when the order is canceled
+or its last item using a coupon drops it.
+"""
+import threading
+import time
+import uuid
+from collections import Counter
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Case, F, Q, When
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from products.catalog_cache import shared_cache
+from .models import Coupon, OrderItem
+
+VERSION_KEY = "coupons:version"
+
+_local = {"version": None, "loaded_at": 0.0, "by_code": {}, "by_id": {}}
+_local_lock = threading.Lock()
+
+
+def get_version():
+    """Current coupon version, starting a new one if the shared cache lost it."""
+    version = shared_cache().get(VERSION_KEY)
+    if version is None:
+        shared_cache().add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = shared_cache().get(VERSION_KEY)
+    return version
+
+
+def invalidate():
+    """Start a new coupon version; every process reloads its map on the next lookup."""
+    shared_cache().set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def invalidate_on_commit():
+    transaction.on_commit(invalidate)
+
+
+def active_coupons():
+    """Return (by_code, by_id) dicts of the active coupons that have not expired yet."""
+    version = get_version()
+    with _local_lock:
+        if _local["version"] == version and time.monotonic() - _local["loaded_at"] < settings.COUPON_CACHE_TIMEOUT:
+            return _local["by_code"], _local["by_id"]
+
+    # Sorted here rather than by the query, which would then walk the whole table in id order
+    coupons = sorted(Coupon.objects.select_related("product").filter(active=True, valid_to__gte=timezone.now()), key=lambda coupon: coupon.id)
+    by_code = {coupon.code: coupon for coupon in coupons}
+    by_id = {coupon.id: coupon for coupon in coupons}
+    with _local_lock:
+        _local.update(version=version, loaded_at=time.monotonic(), by_code=by_code, by_id=by_id)
+    return by_code, by_id
+
+
+def validate_coupon(coupon, product, now=None):
+    """Raise a ValidationError unless `coupon` can be used on `product` right now."""
+    now = now or timezone.now()
+    if not coupon.active or not coupon.valid_from <= now <= coupon.valid_to:
+        raise ValidationError({"coupon": f"Coupon {coupon.code} is not valid at this time."})
+    # If the coupon has a product set, ensure it matches the order item product.
+    if coupon.product_id and coupon.product_id != product.id:
+        raise ValidationError({"coupon": f"This coupon is not applicable for the product {product.name}"})
+
+
+def resolve_cart_coupons(lines, products, now=None):
+    """
+    Return {product id: Coupon} for the cart lines that carry a coupon.
+
+    A line's coupon may be given by id or by code. Every coupon is checked to
+    be active, in its validity window and applicable to its line's product;
+    the first problem found is raised as a ValidationError.
+    """
+    lines = [line for line in lines if line.get("coupon")]
+    if not lines:
+        return {}
+
+    now = now or timezone.now()
+    by_code, by_id = active_coupons()
+    resolved = {}
+    for line in lines:
+        reference = line["coupon"]
+        coupon = by_code.get(reference) if isinstance(reference, str) else by_id.get(reference)
+        if coupon is None:
+            raise ValidationError({"coupon": f"Invalid or expired coupon: {reference}."})
+        product = products[line["product"]]
+        validate_coupon(coupon, product, now)
+        resolved[product.id] = coupon
+    return resolved
+
+
+def redeem(coupon_ids):
+    """
+    Count one use of each coupon. Returns False if any of them has reached its
+    usage_limit; call it inside the order's transaction, which must then roll back.
+    """
+    coupon_ids = set(coupon_ids)
+    if not coupon_ids:
+        return True
+
+    redeemed = Coupon.objects.filter(id__in=coupon_ids).filter(
+        Q(usage_limit__isnull=True) | Q(times_used__lt=F("usage_limit"))
+    ).update(times_used=F("times_used") + 1)
+    return redeemed == len(coupon_ids)
+
+
+def release(coupon_ids):
+    """Give back one use of each coupon id in `coupon_ids` (repeated ids give back several)."""
+    uses = Counter(coupon_id for coupon_id in coupon_ids if coupon_id)
+    if not uses:
+        return
+
+    Coupon.objects.filter(id__in=uses.keys()).update(
+        times_used=Case(
+            *[When(id=coupon_id, times_used__gte=count, then=F("times_used") - count) for coupon_id, count in uses.items()],
+            default=0,
+            output_field=models.PositiveIntegerField(),
+        )
+    )
+
+
+def release_orders(order_ids):
+    """Give back the coupon uses counted for the given canceled orders (one per coupon and order)."""
+    uses = OrderItem.objects.filter(order_id__in=order_ids, coupon__isnull=False).values_list("order_id", "coupon_id").distinct()
+    release(coupon_id for _, coupon_id in uses)
+
+
+def release_unused(order, coupon_id):
+    """Give back `order`'s use of `coupon_id` once none of its items uses the coupon any more."""
+    if coupon_id and not OrderItem.objects.filter(order=order, coupon_id=coupon_id).exists():
+        release([coupon_id])
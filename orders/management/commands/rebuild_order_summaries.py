@@ -0,0 +1,26 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from orders.summaries import rebuild
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Recompute every user's order summary from their orders."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Users summarized per batch.")
+
+    def handle(self, *args, **options):
+        ids = User.objects.order_by("id").values_list("id", flat=True)
+        batch, rebuilt = [], 0
+        for user_id in ids.iterator(chunk_size=options["batch_size"]):
+            batch.append(user_id)
+            if len(batch) == options["batch_size"]:
+                rebuild(batch)
+                rebuilt += len(batch)
+                batch = []
+        rebuild(batch)
+        rebuilt += len(batch)
+        self.stdout.write(f"Rebuilt {rebuilt} order summary(ies).")
@@ -0,0 +1,21 @@
+import time
+from django.core.management.base import BaseCommand
+
+from orders.reservations import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = "Give back the stock of expired reservations and cancel the pending orders that held it."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Reservations released per transaction.")
+        parser.add_argument("--interval", type=float, default=0, help="Keep running, sweeping every N seconds.")
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_expired_reservations(batch_size=options["batch_size"])
+            self.stdout.write(f"Released {released} expired reservation(s).")
+
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
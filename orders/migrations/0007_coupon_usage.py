@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 10:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coupon',
+            name='times_used',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='coupon',
+            name='usage_limit',
+            field=models.PositiveIntegerField(blank=True, help_text='Most orders the coupon may be used on (unlimited if empty).', null=True),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.1.6 on 2026-10-18 10:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+
+STATUS_FIELDS = {"Pending": "pending_orders", "Completed": "completed_orders", "Canceled": "canceled_orders"}
+
+
+def create_summaries(apps, schema_editor):
+    """Summarize the orders of every existing user."""
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split("."))
+    Order = apps.get_model("orders", "Order")
+    OrderSummary = apps.get_model("orders", "OrderSummary")
+    db = schema_editor.connection.alias
+
+    summaries = {user_id: OrderSummary(user_id=user_id) for user_id in User.objects.using(db).values_list("id", flat=True)}
+    rows = Order.objects.using(db).values("user_id", "status").annotate(count=Count("id"), total=Sum("total_amount"), last=Max("created_at")).order_by()
+    for row in rows:
+        summary = summaries[row["user_id"]]
+        setattr(summary, STATUS_FIELDS[row["status"]], row["count"])
+        if row["status"] == "Completed":
+            summary.lifetime_spend = row["total"] or 0
+        summary.last_order_at = max(filter(None, [summary.last_order_at, row["last"]]), default=None)
+    OrderSummary.objects.using(db).bulk_create(summaries.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_coupon_usage'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderSummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='order_summary', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('pending_orders', models.PositiveIntegerField(default=0)),
+                ('completed_orders', models.PositiveIntegerField(default=0)),
+                ('canceled_orders', models.PositiveIntegerField(default=0)),
+                ('lifetime_spend', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('last_order_at', models.DateTimeField(blank=True, null=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'order summaries',
+            },
+        ),
+        migrations.RunPython(create_summaries, migrations.RunPython.noop),
+    ]
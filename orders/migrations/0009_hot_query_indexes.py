@@ -0,0 +1,45 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:00
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_items(apps, schema_editor):
+    """Fold order items repeating a product of their order into the first one, so (order, product) can be unique."""
+    OrderItem = apps.get_model("orders", "OrderItem")
+    items = OrderItem.objects.using(schema_editor.connection.alias)
+    duplicates = (
+        items.values("order_id", "product_id")
+        .annotate(count=Count("id"), first_id=Min("id"), quantity=Sum("quantity"), total_price=Sum("total_price"))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    for duplicate in duplicates:
+        items.filter(pk=duplicate["first_id"]).update(quantity=duplicate["quantity"], total_price=duplicate["total_price"])
+        items.filter(order_id=duplicate["order_id"], product_id=duplicate["product_id"]).exclude(pk=duplicate["first_id"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0008_order_summaries'),
+        ('products', '0009_product_sku'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='coupon',
+            index=models.Index(condition=models.Q(('active', True)), fields=['valid_to'], name='idx_coupon_active_window'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='idx_order_user_created'),
+        ),
+        migrations.RunPython(merge_duplicate_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(fields=('order', 'product'), name='unique_order_item_product'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:55
+
+from django.db import migrations, models
+
+
+def backfill_discounts(apps, schema_editor):
+    # Lines priced before this migration only kept their total, so their discount
+    # is estimated from the product's price as it is now.
+    OrderItem = apps.get_model("orders", "OrderItem")
+    items = (
+        OrderItem.objects.using(schema_editor.connection.alias)
+        .filter(coupon__isnull=False).select_related("product").order_by("id")
+    )
+    batch = []
+    for item in items.iterator(chunk_size=1000):
+        item.discount = max(item.product.price * item.quantity - item.total_price, 0)
+        batch.append(item)
+        if len(batch) == 1000:
+            OrderItem.objects.using(schema_editor.connection.alias).bulk_update(batch, ["discount"])
+            batch = []
+    OrderItem.objects.using(schema_editor.connection.alias).bulk_update(batch, ["discount"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0009_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='discount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.RunPython(backfill_discounts, migrations.RunPython.noop),
+    ]
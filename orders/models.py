@@ -1,4 +1,4 @@
-from django.db import models, transaction
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth import get_user_model
 from rest_framework.exceptions import ValidationError
 from django.utils import timezone
@@ -15,6 +15,14 @@ class Coupon(models.Model):
     valid_to = models.DateTimeField()
     active = models.BooleanField(default=True)
     product = models.ForeignKey(Product, on_delete=models.CASCADE, null=True, blank=True)
+    usage_limit = models.PositiveIntegerField(null=True, blank=True, help_text="Most orders the coupon may be used on (unlimited if empty).")
+    times_used = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # Loading the coupon map: active coupons that have not expired yet
+            models.Index(fields=["valid_to"], condition=models.Q(active=True), name="idx_coupon_active_window"),
+        ]
 
     def __str__(self):
         return f"Coupon {self.code} ({self.discount}% Off) for {self.product.name if self.product else 'Any Product'}"
@@ -34,43 +42,72 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "-created_at", "-id"], name="idx_order_user_created"),
+        ]
+
     def save(self, *args, **kwargs):
         """Calculate total amount, validate status, and handle order cancellation stock restoration."""
-        is_new = self.pk is None  # Check if the order is new
-
-        if not is_new:
-            try:
-                old_order = Order.objects.select_for_update().get(pk=self.pk)
-
-                # Prevent modifying a canceled order
-                if old_order.status == "Canceled" and self.status == "Canceled":
-                    raise ValidationError({"detail": "This order has already been canceled and cannot be modified."})
+        from .reservations import release_order_reservations, commit_order_reservations
+        from .coupons import release_orders
+        from .summaries import OrderChange, record_changes
+        from .signals import order_status_changed
 
-                # Prevent restoring a canceled order
-                if old_order.status == "Canceled" and self.status != "Canceled":
-                    raise ValidationError({"detail": "You cannot restore a canceled order. Please create a new order."})
+        is_new = self.pk is None  # Check if the order is new
+        old_status, old_total = None, 0
 
-                # Prevent canceling a completed order
-                if old_order.status == "Completed" and self.status == "Canceled":
-                    raise ValidationError({"detail": "A completed order cannot be canceled."})
+        # The old row stays locked until the new status, stock and summaries are all written.
+        with transaction.atomic():
+            if not is_new:
+                try:
+                    old_order = Order.objects.select_for_update().get(pk=self.pk)
+                    old_status, old_total = old_order.status, old_order.total_amount
+
+                    # Prevent modifying a canceled order
+                    if old_order.status == "Canceled" and self.status == "Canceled":
+                        raise ValidationError({"detail": "This order has already been canceled and cannot be modified."})
+
+                    # Prevent restoring a canceled order
+                    if old_order.status == "Canceled" and self.status != "Canceled":
+                        raise ValidationError({"detail": "You cannot restore a canceled order. Please create a new order."})
+
+                    # Prevent canceling a completed order
+                    if old_order.status == "Completed" and self.status == "Canceled":
+                        raise ValidationError({"detail": "A completed order cannot be canceled."})
+
+                    # Prevent reverting a completed order back to pending
+                    if old_order.status == "Completed" and self.status == "Pending":
+                        raise ValidationError({"detail": "A completed order cannot be reverted to pending."})
+
+                    # When transitioning from a non-canceled status to "Canceled", restore stock
+                    if old_order.status != "Canceled" and self.status == "Canceled":
+                        # Orders placed before stock reservations existed have no holds to release.
+                        if not release_order_reservations(self):
+                            for item in self.items.all():
+                                item.product.restore_stock(item.quantity, change_type="Order Canceled")
+                        release_orders([self.pk])
+                    
+                        self.total_amount = 0
+                    else:
+                        self.total_amount = sum(item.total_price for item in self.items.all())
 
-                # Prevent reverting a completed order back to pending
-                if old_order.status == "Completed" and self.status == "Pending":
-                    raise ValidationError({"detail": "A completed order cannot be reverted to pending."})
+                    # Paid orders keep their stock for good.
+                    if old_order.status == "Pending" and self.status == "Completed":
+                        commit_order_reservations(self)
 
-                # When transitioning from a non-canceled status to "Canceled", restore stock
-                if old_order.status != "Canceled" and self.status == "Canceled":
-                    for item in self.items.all():
-                        item.product.restore_stock(item.quantity)
-                    
-                    self.total_amount = 0
-                else:
-                    self.total_amount = sum(item.total_price for item in self.items.all())
+                except Order.DoesNotExist:
+                    pass  # Ignore if the order does not exist (i.e., new order)
 
-            except Order.DoesNotExist:
-                pass  # Ignore if the order does not exist (i.e., new order)
+            super().save(*args, **kwargs)
 
-        super().save(*args, **kwargs)
+            if old_status != self.status or old_total != self.total_amount:
+                record_changes([OrderChange(
+                    self.user_id, old_status, old_total, self.status, self.total_amount,
+                    placed_at=self.created_at if old_status is None else None,
+                )])
+            if old_status is not None and old_status != self.status:
+                order_status_changed.send(sender=Order, order=self, old_status=old_status)
 
     def __str__(self):
         return f"Order {self.id} | {self.user.id} - {self.user.get_full_name()} | {self.status}"
@@ -82,16 +119,33 @@ class OrderItem(models.Model):
     quantity = models.PositiveIntegerField()
     coupon = models.ForeignKey(Coupon, on_delete=models.SET_NULL, null=True, blank=True)
     total_price = models.DecimalField(max_digits=10, decimal_places=2, editable=False, default=0)
+    # What the coupon took off when the line was priced; Product.price may change later.
+    discount = models.DecimalField(max_digits=10, decimal_places=2, editable=False, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["order", "product"], name="unique_order_item_product"),
+        ]
+
+    def calculate_discount(self):
+        """Calculate what the coupon takes off the line at the product's current price."""
+        if not self.coupon:
+            return 0
+        return (self.coupon.discount / 100) * (self.product.price * self.quantity)
 
     def calculate_total_price(self):
         """Calculate total price with coupon discount."""
-        discount = 0
-        if self.coupon:
-            discount = (self.coupon.discount / 100) * (self.product.price * self.quantity)
-        return (self.product.price * self.quantity) - discount
+        return (self.product.price * self.quantity) - self.calculate_discount()
+
+    def price_line(self):
+        """Set total_price and discount from the product's current price and the coupon."""
+        self.discount = self.calculate_discount()
+        self.total_price = self.calculate_total_price()
 
     def save(self, *args, **kwargs):
         """Handle stock deduction and restoration on order item changes."""
+        from .reservations import hold_stock
+
         with transaction.atomic():
             if self.pk:  # Updating an existing order item
                 old_item = OrderItem.objects.select_for_update().get(pk=self.pk)
@@ -100,26 +154,93 @@ class OrderItem(models.Model):
                 # Handle quantity changes
                 if not self.product.update_stock(self.quantity):
                     raise ValidationError({"detail": f"Insufficient stock for {self.product.name}."})
+                hold_stock(self.order, self.product, self.quantity - old_item.quantity)
 
             else:
-                # Check if the product already exists in the order
-                existing_item = OrderItem.objects.filter(order=self.order, product=self.product).first()
-                if existing_item:
-                    new_quantity = existing_item.quantity + self.quantity
-                    if not self.product.update_stock(self.quantity):
-                        raise ValidationError({"detail": f"Insufficient stock for {self.product.name}."})
-
-                    existing_item.quantity = new_quantity
-                    existing_item.total_price = existing_item.calculate_total_price()
-                    existing_item.save()
-                    return
-
                 # Deduct stock for new order items
                 if not self.product.update_stock(self.quantity):
                     raise ValidationError({"detail": f"Insufficient stock for {self.product.name}."})
-
-            self.total_price = self.calculate_total_price()
+                hold_stock(self.order, self.product, self.quantity)
+
+                self.price_line()
+                try:
+                    with transaction.atomic():
+                        super().save(*args, **kwargs)
+                except IntegrityError:
+                    # (order, product) is unique: the product is already in the order, so add to its line.
+                    self._merge_into_existing_item()
+                return
+
+            self.price_line()
             super().save(*args, **kwargs)
 
+    def _merge_into_existing_item(self):
+        """Add this item's quantity to the order's existing line for the product and become that line."""
+        existing_item = OrderItem.objects.select_for_update().select_related("product", "coupon").get(
+            order=self.order, product=self.product
+        )
+        existing_item.quantity += self.quantity
+        existing_item.price_line()
+        OrderItem.objects.filter(pk=existing_item.pk).update(
+            quantity=existing_item.quantity, total_price=existing_item.total_price, discount=existing_item.discount
+        )
+
+        self.pk, self.quantity, self.coupon, self.total_price, self.discount = (
+            existing_item.pk, existing_item.quantity, existing_item.coupon, existing_item.total_price, existing_item.discount
+        )
+        self._state.adding = False
+
     def __str__(self):
         return f"{self.quantity} x {self.product.name} in Order {self.order.id}"
+
+
+class StockReservation(models.Model):
+    """Stock held for a pending order until it is paid, canceled or the hold expires."""
+    STATUS_CHOICES = [
+        ("Active", "Active"),
+        ("Committed", "Committed"),
+        ("Released", "Released"),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="reservations")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="Active")
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "expires_at"], name="idx_reservation_expiry"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["order", "product"], name="unique_reservation_order_product"),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product.name} held for Order {self.order.id} | {self.status}"
+
+
+
+class OrderSummary(models.Model):
+    """
+    Per-user order totals for account dashboards, kept up to date as orders are
+    placed, change status or change total (see orders.summaries).
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="order_summary")
+    pending_orders = models.PositiveIntegerField(default=0)
+    completed_orders = models.PositiveIntegerField(default=0)
+    canceled_orders = models.PositiveIntegerField(default=0)
+    lifetime_spend = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    last_order_at = models.DateTimeField(null=True, blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "order summaries"
+
+    @property
+    def total_orders(self):
+        return self.pending_orders + self.completed_orders + self.canceled_orders
+
+    def __str__(self):
+        return f"Order summary of {self.user_id} | {self.total_orders} orders, {self.lifetime_spend} spent"
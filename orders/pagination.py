@@ -0,0 +1,17 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class OrderCursorPagination(CursorPagination):
+    """
+    Newest orders first. Cursor pages seek from the last row seen instead of
+    counting and skipping, so every page costs the same however deep it is.
+    """
+    page_size = settings.ORDER_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.ORDER_MAX_PAGE_SIZE
+    ordering = ("-created_at", "-id")
+
+
+class OrderItemCursorPagination(OrderCursorPagination):
+    ordering = ("order_id", "id")
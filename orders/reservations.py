@@ -0,0 +1,147 @@
+"""
+Time-boxed stock reservations.
+
+Placing an order takes its stock off the shelf and records a StockReservation
+that expires after settings.STOCK_RESERVATION_TTL. Paying the order commits the
+reservation; canceling it, or letting it expire, gives the stock back. Expired
+reservations are swept in batches by `manage.py release_expired_reservations`.
+"""
+from collections import defaultdict
+from django.conf import settings
+from django.db import transaction, connection
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Order, StockReservation
+from .coupons import release_orders
+from .summaries import OrderChange, record_changes
+from products.models import Product
+
+
+def reservation_expiry():
+    return timezone.now() + settings.STOCK_RESERVATION_TTL
+
+
+def reserve_order_stock(order, quantities, expires_at=None):
+    """Record holds for a freshly placed order whose stock has already been deducted."""
+    expires_at = expires_at or reservation_expiry()
+    StockReservation.objects.bulk_create([
+        StockReservation(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+        for product_id, quantity in quantities.items()
+    ])
+
+
+def hold_stock(order, product, quantity):
+    """Grow (or shrink, for a negative quantity) the hold on `product` for `order` and refresh the order's expiry."""
+    if not quantity:
+        return
+
+    # All of an order's holds expire together, so the sweeper never releases part of a pending order
+    expires_at = reservation_expiry()
+    refreshed = StockReservation.objects.filter(order=order, status="Active").update(expires_at=expires_at)
+    if not refreshed and not order.reservations.exists():
+        # Orders placed before stock reservations existed first get holds for the stock their items
+        # already took, since releasing an order's holds no longer falls back to its items once it has any
+        quantities = defaultdict(int)
+        for product_id, item_quantity in order.items.values_list("product_id", "quantity"):
+            quantities[product_id] += item_quantity
+        reserve_order_stock(order, quantities, expires_at)
+
+    updated = StockReservation.objects.filter(order=order, product=product, status="Active").update(
+        quantity=F("quantity") + quantity
+    )
+    if not updated and quantity > 0:
+        StockReservation.objects.update_or_create(
+            order=order, product=product,
+            defaults={"quantity": quantity, "status": "Active", "expires_at": expires_at},
+        )
+
+
+def release_order_reservations(order):
+    """
+    Return the stock held by the order's active reservations.
+
+    Returns False if the order has no reservations at all (orders placed before
+    reservations were introduced), so the caller can fall back to its items.
+    """
+    reservations = list(order.reservations.select_for_update().values_list("id", "product_id", "quantity", "status"))
+    if not reservations:
+        return False
+
+    active = [reservation for reservation in reservations if reservation[3] == "Active"]
+    _release(active, change_type="Order Canceled")
+    return True
+
+
+def release_committed_reservations(order, change_type="Refund"):
+    """
+    Return the stock a paid order's committed reservations still hold, e.g. once
+    its payment is refunded. Each reservation is only released once.
+
+    Returns False if the order has no reservations at all, like release_order_reservations.
+    """
+    reservations = list(order.reservations.select_for_update().values_list("id", "product_id", "quantity", "status"))
+    if not reservations:
+        return False
+
+    committed = [reservation for reservation in reservations if reservation[3] == "Committed"]
+    _release(committed, change_type=change_type)
+    return True
+
+
+def commit_order_reservations(order):
+    """Mark the order's holds as final once it has been paid."""
+    return order.reservations.filter(status="Active").update(status="Committed")
+
+
+def release_expired_reservations(batch_size=500, now=None):
+    """
+    Release reservations past their expiry, one batch per transaction.
+
+    Each batch restores stock with a single set-based update and cancels the
+    pending orders that no longer hold any stock, giving back their coupon uses. Returns the number of
+    reservations released.
+    """
+    now = now or timezone.now()
+    released = 0
+
+    while True:
+        with transaction.atomic():
+            expired = StockReservation.objects.filter(status="Active", expires_at__lte=now).order_by("expires_at")
+            if connection.features.has_select_for_update_skip_locked:
+                expired = expired.select_for_update(skip_locked=True)
+            batch = list(expired.values_list("id", "product_id", "quantity", "order_id")[:batch_size])
+            if not batch:
+                break
+
+            _release(batch, change_type="Reservation Expired")
+            order_ids = {reservation[3] for reservation in batch}
+            canceled = list(
+                Order.objects.select_for_update()
+                .filter(id__in=order_ids, status="Pending")
+                .exclude(reservations__status="Active")
+                .values_list("id", "user_id", "total_amount")
+            )
+            canceled_ids = [order_id for order_id, _, _ in canceled]
+            Order.objects.filter(id__in=canceled_ids).update(status="Canceled", total_amount=0)
+            release_orders(canceled_ids)
+            record_changes([OrderChange(user_id, "Pending", total, "Canceled", 0) for _, user_id, total in canceled])
+            released += len(batch)
+
+        if len(batch) < batch_size:
+            break
+
+    return released
+
+
+def _release(reservations, change_type):
+    """Restore stock for (id, product_id, quantity, ...) rows and mark them released."""
+    if not reservations:
+        return
+
+    quantities = defaultdict(int)
+    for reservation in reservations:
+        quantities[reservation[1]] += reservation[2]
+
+    Product.objects.restore_stock(dict(quantities), change_type=change_type)
+    StockReservation.objects.filter(id__in=[reservation[0] for reservation in reservations]).update(status="Released")
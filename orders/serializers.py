@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from decimal import Decimal
-from .models import Order, OrderItem, Coupon
+from .models import Order, OrderItem, Coupon, OrderSummary
+from .coupons import redeem, release_unused, validate_coupon
 from products.models import Product
 
 
@@ -42,31 +43,40 @@ class OrderItemSerializer(serializers.ModelSerializer):
 
         coupon = data.get("coupon", None)
         if coupon:
-            # If the coupon has a product set, ensure it matches the order item product.
-            if coupon.product and coupon.product.id != product.id:
-                raise serializers.ValidationError({"coupon": f"This coupon is not applicable for the product {product.name}"})
+            validate_coupon(coupon, product)
         return data
 
+    def redeem_coupon(self, order, coupon):
+        """Count a use of `coupon` unless another item of the order already uses it. Returns True if it counted one."""
+        if not coupon or OrderItem.objects.filter(order=order, coupon=coupon).exists():
+            return False
+        if not redeem([coupon.id]):
+            raise serializers.ValidationError({"coupon": f"Coupon {coupon.code} has reached its usage limit."})
+        return True
+
     # Custom create() to append quantities is an item already exists
     def create(self, validated_data):
         validated_data.pop("id", None)
         order = validated_data.get("order")
-        product = validated_data.get("product")
-        quantity = validated_data.get("quantity")
         coupon = validated_data.get("coupon", None)
+        redeemed = self.redeem_coupon(order, coupon)
 
-        # Check if an OrderItem for the same order and product already exists.
-        existing_item = OrderItem.objects.filter(order=order, product=product).first()
-        if existing_item:
-            # Increase the quantity instead of creating a new item.
-            existing_item.quantity += quantity
-            existing_item.total_price = existing_item.calculate_total_price()
-            existing_item.save()    # This will update total_price via the model's save()
-            return existing_item
-        else:
-            # No matching item exists, so create a new OrderItem.
-            new_item = OrderItem.objects.create(**validated_data)
-            return new_item   
+        # A product already in the order is added to its existing item by OrderItem.save().
+        order_item = OrderItem.objects.create(**validated_data)
+        if redeemed and order_item.coupon_id != coupon.id:
+            # Merged into a line that keeps its own coupon, so this one went unused
+            release_unused(order, coupon.id)
+        return order_item
+
+    def update(self, instance, validated_data):
+        old_coupon_id = instance.coupon_id
+        coupon = validated_data.get("coupon")
+        if coupon and coupon.id != old_coupon_id:
+            self.redeem_coupon(instance.order, coupon)
+        order_item = super().update(instance, validated_data)
+        if order_item.coupon_id != old_coupon_id:
+            release_unused(order_item.order, old_coupon_id)
+        return order_item
        
     
 class OrderSerializer(serializers.ModelSerializer):
@@ -127,7 +137,7 @@ class OrderSerializer(serializers.ModelSerializer):
                         else:
                             order_item.product.restore_stock(abs(quantity_difference))
                         order_item.quantity = new_quantity
-                        order_item.total_price = order_item.calculate_total_price()
+                        order_item.price_line()
                         order_item.save()
                 else:
                     item_data["order"] = instance
@@ -136,4 +146,12 @@ class OrderSerializer(serializers.ModelSerializer):
         instance.total_amount = sum(item.total_price for item in instance.items.all())
         instance.save()
         return instance
-    
\ No newline at end of file
+
+
+class OrderSummarySerializer(serializers.ModelSerializer):
+    """A user's order counts by status, lifetime spend and last order date."""
+    total_orders = serializers.ReadOnlyField()
+
+    class Meta:
+        model = OrderSummary
+        fields = ["total_orders", "pending_orders", "completed_orders", "canceled_orders", "lifetime_spend", "last_order_at"]
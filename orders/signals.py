@@ -0,0 +1,31 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+from .models import Coupon, Order, OrderSummary
+from .summaries import OrderChange, record_changes
+from . import coupons
+
+User = get_user_model()
+
+# Sent by Order.save() when an order changes status, with the order and its old_status
+order_status_changed = Signal()
+
+
+@receiver(post_save, sender=Coupon)
+@receiver(post_delete, sender=Coupon)
+def invalidate_coupons(sender, **kwargs):
+    """Cached coupon maps are stale once a coupon changes."""
+    coupons.invalidate_on_commit()
+
+
+@receiver(post_save, sender=User)
+def create_order_summary(sender, instance, created, **kwargs):
+    """Start every user with an empty order summary, so placing an order only has to update it."""
+    if created:
+        OrderSummary.objects.bulk_create([OrderSummary(user=instance)], ignore_conflicts=True)
+
+
+@receiver(post_delete, sender=Order)
+def remove_from_order_summary(sender, instance, **kwargs):
+    # The user's summary may be going away with them, so it isn't rebuilt if missing.
+    record_changes([OrderChange(instance.user_id, instance.status, instance.total_amount, None, 0)], create_missing=False)
@@ -0,0 +1,100 @@
+"""
+Per-user order summaries.
+
+OrderSummary keeps the number of orders a user has in each status, their
+lifetime spend (the total of their completed orders) and the date of their
+last order, so account dashboards read one row instead of the order history.
+
+Order.save() and the bulk order updates report what they change with
+record_changes(), which applies a whole batch of changes as a single UPDATE of
+relative (F expression) adjustments. Every user gets an empty summary when
+created (see orders.signals); a user found without one has it rebuilt from
+their orders. `manage.py rebuild_order_summaries` recomputes every row.
+"""
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+from django.db import models
+from django.db.models import Case, Count, F, Max, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Order, OrderSummary
+
+STATUS_FIELDS = {"Pending": "pending_orders", "Completed": "completed_orders", "Canceled": "canceled_orders"}
+
+# An order going from (old_status, old_total) to (new_status, new_total); a status of None
+# means the order did not exist before or no longer exists. placed_at is set for new orders.
+OrderChange = namedtuple("OrderChange", "user_id old_status old_total new_status new_total placed_at", defaults=(None,))
+
+
+def spend(status, total):
+    return total if status == "Completed" else Decimal("0.00")
+
+
+def record_changes(changes, create_missing=True):
+    """
+    Apply OrderChanges to their users' summaries with one UPDATE.
+
+    Users that have no summary row get one rebuilt from their orders, unless
+    `create_missing` is False (e.g. while the user is being deleted).
+    """
+    deltas = defaultdict(lambda: defaultdict(int))
+    placed = {}
+    for change in changes:
+        user_deltas = deltas[change.user_id]
+        if change.old_status:
+            user_deltas[STATUS_FIELDS[change.old_status]] -= 1
+        if change.new_status:
+            user_deltas[STATUS_FIELDS[change.new_status]] += 1
+        user_deltas["lifetime_spend"] += spend(change.new_status, change.new_total) - spend(change.old_status, change.old_total)
+        if change.placed_at:
+            placed[change.user_id] = max(change.placed_at, placed.get(change.user_id, change.placed_at))
+
+    updates = {}
+    output_fields = {field: models.IntegerField() for field in STATUS_FIELDS.values()}
+    output_fields["lifetime_spend"] = models.DecimalField(max_digits=12, decimal_places=2)
+    for field, output_field in output_fields.items():
+        whens = [When(user_id=user_id, then=F(field) + delta) for user_id, user_deltas in deltas.items() if (delta := user_deltas[field])]
+        if whens:
+            updates[field] = Case(*whens, default=F(field), output_field=output_field)
+    if placed:
+        updates["last_order_at"] = Case(
+            *[When(user_id=user_id, then=Greatest(Coalesce(F("last_order_at"), Value(placed_at)), Value(placed_at)))
+              for user_id, placed_at in placed.items()],
+            default=F("last_order_at"),
+            output_field=models.DateTimeField(),
+        )
+    if not updates:
+        return
+
+    user_ids = {user_id for user_id, user_deltas in deltas.items() if any(user_deltas.values())} | placed.keys()
+    updates["updated"] = timezone.now()
+    updated = OrderSummary.objects.filter(user_id__in=user_ids).update(**updates)
+    if create_missing and updated < len(user_ids):
+        rebuild(user_ids - set(OrderSummary.objects.filter(user_id__in=user_ids).values_list("user_id", flat=True)))
+
+
+def rebuild(user_ids):
+    """Recompute the summaries of `user_ids` from their orders, creating missing rows."""
+    summaries = {user_id: OrderSummary(user_id=user_id) for user_id in user_ids}
+    if not summaries:
+        return
+
+    rows = (
+        Order.objects.filter(user_id__in=summaries.keys())
+        .values("user_id", "status")
+        .annotate(count=Count("id"), total=Sum("total_amount"), last=Max("created_at"))
+        .order_by()
+    )
+    for row in rows:
+        summary = summaries[row["user_id"]]
+        setattr(summary, STATUS_FIELDS[row["status"]], row["count"])
+        summary.lifetime_spend += spend(row["status"], row["total"] or 0)
+        summary.last_order_at = max(filter(None, [summary.last_order_at, row["last"]]), default=None)
+
+    OrderSummary.objects.bulk_create(
+        summaries.values(),
+        update_conflicts=True,
+        unique_fields=["user"],
+        update_fields=[*STATUS_FIELDS.values(), "lifetime_spend", "last_order_at", "updated"],
+    )
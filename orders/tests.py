@@ -1,3 +1,427 @@
+from decimal import Decimal
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from products.models import Category, Product
+from .models import Order, OrderItem, Coupon, OrderSummary, StockReservation
+from .coupons import active_coupons
+from .serializers import OrderItemSerializer
+from .reservations import hold_stock, release_expired_reservations
+from utils.query_plans import unindexed_steps
+
+User = get_user_model()
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name="Gadgets")
+        self.products = [
+            Product.objects.create(name=f"Product {i}", description="-", category=self.category, price=Decimal("10.00"), stock=5)
+            for i in range(12)
+        ]
+
+    def checkout(self, order_items):
+        return self.client.post(reverse("checkout"), {"order_items": order_items}, format="json")
+
+    def test_checkout_creates_order_and_deducts_stock(self):
+        coupon = Coupon.objects.create(
+            code="TENOFF", discount=Decimal("10.00"), product=self.products[0],
+            valid_from=timezone.now(), valid_to=timezone.now() + timezone.timedelta(days=1),
+        )
+        response = self.checkout([
+            {"product": self.products[0].id, "quantity": 2, "coupon": coupon.id},
+            {"product": self.products[1].id, "quantity": 1},
+            {"product": self.products[1].id, "quantity": 1},
+        ])
+
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get(pk=response.data["order_id"])
+        self.assertEqual(order.total_amount, Decimal("38.00"))
+        self.assertEqual(order.items.count(), 2)
+        self.assertEqual(OrderItem.objects.get(order=order, product=self.products[1]).quantity, 2)
+        self.products[0].refresh_from_db()
+        self.products[1].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 3)
+        self.assertEqual(self.products[1].stock, 3)
+
+    def test_checkout_query_count_does_not_grow_with_cart_size(self):
+        def count_queries(products):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.checkout([{"product": p.id, "quantity": 1} for p in products])
+            self.assertEqual(response.status_code, 201)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(count_queries(self.products[:2]), count_queries(self.products[2:12]))
+
+    def test_checkout_is_all_or_nothing_when_stock_is_short(self):
+        response = self.checkout([
+            {"product": self.products[0].id, "quantity": 1},
+            {"product": self.products[1].id, "quantity": 6},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 5)
+
+    def test_deduct_stock_rolls_back_partial_updates(self):
+        self.products[1].stock = 0
+        self.products[1].save()
+
+        self.assertFalse(Product.objects.deduct_stock({self.products[0].id: 1, self.products[1].id: 1}))
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 5)
+
+
+class CouponTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name="Gadgets")
+        self.products = [
+            Product.objects.create(name=f"Product {i}", description="-", category=category, price=Decimal("10.00"), stock=5)
+            for i in range(10)
+        ]
+        now = timezone.now()
+        self.coupon = Coupon.objects.create(
+            code="SAVE10", discount=Decimal("10.00"), valid_from=now - timezone.timedelta(days=1),
+            valid_to=now + timezone.timedelta(days=1), usage_limit=1,
+        )
+
+    def checkout(self, order_items):
+        return self.client.post(reverse("checkout"), {"order_items": order_items}, format="json")
+
+    def test_coupon_by_code_applies_to_whole_cart_without_extra_queries_per_line(self):
+        def count_queries(products):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.checkout([{"product": p.id, "quantity": 1, "coupon_code": "SAVE10"} for p in products])
+            self.assertEqual(response.status_code, 201)
+            return len(ctx.captured_queries)
+
+        self.coupon.usage_limit = None
+        with self.captureOnCommitCallbacks(execute=True):
+            self.coupon.save()
+        active_coupons()
+
+        self.assertEqual(count_queries(self.products[:2]), count_queries(self.products[2:10]))
+        self.assertEqual(Order.objects.order_by("id").first().total_amount, Decimal("18.00"))
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.times_used, 2)
+
+    def test_expired_or_inactive_coupon_is_rejected(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Coupon.objects.create(
+                code="OLD", discount=Decimal("50.00"), valid_from=timezone.now() - timezone.timedelta(days=2),
+                valid_to=timezone.now() - timezone.timedelta(days=1),
+            )
+            self.coupon.active = False
+            self.coupon.save()
+
+        for code in ("OLD", "SAVE10"):
+            response = self.checkout([{"product": self.products[0].id, "quantity": 1, "coupon_code": code}])
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+    def test_usage_limit_is_enforced_and_released_on_cancel(self):
+        response = self.checkout([{"product": self.products[0].id, "quantity": 1, "coupon": self.coupon.id}])
+        self.assertEqual(response.status_code, 201)
+
+        response = self.checkout([{"product": self.products[1].id, "quantity": 1, "coupon": self.coupon.id}])
+        self.assertEqual(response.status_code, 400)
+        self.products[1].refresh_from_db()
+        self.assertEqual(self.products[1].stock, 5)
+
+        order = Order.objects.get()
+        order.status = "Canceled"
+        order.save()
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.times_used, 0)
+
+        response = self.checkout([{"product": self.products[1].id, "quantity": 1, "coupon": self.coupon.id}])
+        self.assertEqual(response.status_code, 201)
+
+    def add_item(self, order, product, coupon=None):
+        data = {"order": order.id, "product": product.id, "quantity": 1, "coupon": coupon and coupon.id}
+        return self.client.post(reverse("order-item-list-create"), data, format="json")
+
+    def assertTimesUsed(self, coupon, expected):
+        coupon.refresh_from_db()
+        self.assertEqual(coupon.times_used, expected)
+
+    def test_replacing_an_item_coupon_releases_the_old_one(self):
+        order = Order.objects.get(pk=self.checkout([{"product": self.products[0].id, "quantity": 1}]).data["order_id"])
+        item = self.add_item(order, self.products[1], self.coupon).data
+        other = Coupon.objects.create(code="SAVE20", discount=Decimal("20.00"), valid_from=self.coupon.valid_from, valid_to=self.coupon.valid_to, usage_limit=1)
+
+        response = self.client.patch(
+            reverse("order-item-detail", args=[item["id"]]), {"product": self.products[1].id, "quantity": 1, "coupon": other.id}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTimesUsed(self.coupon, 0)
+        self.assertTimesUsed(other, 1)
+
+    def test_deleting_an_item_releases_its_coupon(self):
+        order = Order.objects.get(pk=self.checkout([{"product": self.products[0].id, "quantity": 1}]).data["order_id"])
+        item = self.add_item(order, self.products[1], self.coupon).data
+        self.assertTimesUsed(self.coupon, 1)
+
+        self.assertEqual(self.client.delete(reverse("order-item-detail", args=[item["id"]])).status_code, 204)
+        self.assertTimesUsed(self.coupon, 0)
+
+    def test_coupon_of_a_line_merged_into_another_is_released(self):
+        order = Order.objects.get(pk=self.checkout([{"product": self.products[0].id, "quantity": 1}]).data["order_id"])
+
+        # As OrderSerializer adds a line for a product the order already has
+        item = OrderItemSerializer().create({"order": order, "product": self.products[0], "quantity": 1, "coupon": self.coupon})
+        self.assertEqual((item.quantity, item.coupon), (2, None))
+        self.assertTimesUsed(self.coupon, 0)
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name="Gadgets")
+        self.product = Product.objects.create(name="Widget", description="-", category=category, price=Decimal("10.00"), stock=5)
+
+    def place_order(self, quantity=2):
+        response = self.client.post(reverse("checkout"), {"order_items": [{"product": self.product.id, "quantity": quantity}]}, format="json")
+        self.assertEqual(response.status_code, 201)
+        return Order.objects.get(pk=response.data["order_id"])
+
+    def assertStock(self, expected):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, expected)
+
+    def test_expired_reservations_restore_stock_and_cancel_order(self):
+        order = self.place_order()
+        self.assertStock(3)
+
+        self.assertEqual(release_expired_reservations(now=timezone.now() + timezone.timedelta(days=1)), 1)
+        self.assertStock(5)
+        order.refresh_from_db()
+        self.assertEqual(order.status, "Canceled")
+        self.assertEqual(release_expired_reservations(now=timezone.now() + timezone.timedelta(days=1)), 0)
+
+    def test_cancel_releases_hold_once(self):
+        order = self.place_order()
+        order.status = "Canceled"
+        order.save()
+
+        self.assertStock(5)
+        self.assertEqual(StockReservation.objects.get(order=order).status, "Released")
+
+    def test_failed_cancel_rolls_back_released_stock(self):
+        order = self.place_order()
+        order.status = "Canceled"
+        with mock.patch("orders.coupons.release_orders", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                order.save()
+
+        self.assertStock(3)
+        self.assertEqual(StockReservation.objects.get(order=order).status, "Active")
+        self.assertEqual(Order.objects.get(pk=order.pk).status, "Pending")
+
+    def test_order_holds_expire_together(self):
+        order = self.place_order()
+        StockReservation.objects.filter(order=order).update(expires_at=timezone.now() + timezone.timedelta(minutes=1))
+        category = self.product.category
+        other = Product.objects.create(name="Gadget", description="-", category=category, price=Decimal("10.00"), stock=5)
+        hold_stock(order, other, 1)
+
+        self.assertEqual(StockReservation.objects.filter(order=order).values("expires_at").distinct().count(), 1)
+        self.assertEqual(release_expired_reservations(now=timezone.now() + timezone.timedelta(minutes=2)), 0)
+        self.assertEqual(release_expired_reservations(now=timezone.now() + timezone.timedelta(days=1)), 2)
+        order.refresh_from_db()
+        self.assertEqual(order.status, "Canceled")
+
+    def test_editing_an_order_without_holds_holds_all_of_its_stock(self):
+        order = self.place_order()
+        StockReservation.objects.filter(order=order).delete()  # Placed before stock reservations existed
+        item = order.items.get()
+        item.quantity = 3
+        item.save()
+
+        self.assertStock(2)
+        self.assertEqual(StockReservation.objects.get(order=order).quantity, 3)
+        order.status = "Canceled"
+        order.save()
+        self.assertStock(5)
+
+    def test_deleting_an_item_returns_its_stock_and_total(self):
+        order = self.place_order()
+        category = self.product.category
+        other = Product.objects.create(name="Gadget", description="-", category=category, price=Decimal("7.00"), stock=5)
+        OrderItem.objects.create(order=order, product=other, quantity=1)
+        item = order.items.get(product=self.product)
+
+        self.assertEqual(self.client.delete(reverse("order-item-detail", args=[item.id])).status_code, 204)
+        self.assertStock(5)
+        self.assertEqual(StockReservation.objects.get(order=order, product=self.product).quantity, 0)
+        order.refresh_from_db()
+        self.assertEqual(order.total_amount, Decimal("7.00"))
+
+        order.status = "Completed"
+        order.save()
+        self.assertStock(5)
+
+    def test_completed_order_commits_reservation(self):
+        order = self.place_order()
+        order.status = "Completed"
+        order.save()
+
+        self.assertEqual(StockReservation.objects.get(order=order).status, "Committed")
+        self.assertEqual(release_expired_reservations(now=timezone.now() + timezone.timedelta(days=1)), 0)
+        self.assertStock(3)
+
+
+class OrderListTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name="Gadgets")
+        self.products = [
+            Product.objects.create(name=f"Product {i}", description="-", category=category, price=Decimal("10.00"), stock=100)
+            for i in range(3)
+        ]
+        self.coupon = Coupon.objects.create(
+            code="TENOFF", discount=Decimal("10.00"),
+            valid_from=timezone.now(), valid_to=timezone.now() + timezone.timedelta(days=1),
+        )
+
+    def create_orders(self, count):
+        orders = Order.objects.bulk_create([Order(user=self.user, total_amount=Decimal("30.00")) for _ in range(count)])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=1, coupon=self.coupon, total_price=Decimal("9.00"))
+            for order in orders for product in self.products
+        ])
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_order_list_query_count_does_not_grow_with_results(self):
+        self.create_orders(2)
+        few = self.count_queries(reverse("order-list-create"))
+        self.create_orders(20)
+        many = self.count_queries(reverse("order-list-create"))
+
+        self.assertEqual(few, many)
+
+    def test_order_item_list_query_count_does_not_grow_with_results(self):
+        self.create_orders(2)
+        few = self.count_queries(reverse("order-item-list-create"))
+        self.create_orders(20)
+        many = self.count_queries(reverse("order-item-list-create"))
+
+        self.assertEqual(few, many)
+
+    def test_orders_are_cursor_paginated_newest_first(self):
+        self.create_orders(5)
+
+        first = self.client.get(reverse("order-list-create"), {"page_size": 3}).data
+        second = self.client.get(first["next"]).data
+
+        ids = [order["id"] for order in first["results"] + second["results"]]
+        self.assertEqual(ids, list(Order.objects.order_by("-created_at", "-id").values_list("id", flat=True)))
+        self.assertEqual(first["results"][0]["items"][0]["product_name"], "Product 0")
+        self.assertIsNone(second["next"])
+
+
+class OrderSummaryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name="Gadgets")
+        self.product = Product.objects.create(name="Widget", description="-", category=category, price=Decimal("10.00"), stock=20)
+
+    def place_order(self, quantity=1):
+        response = self.client.post(reverse("checkout"), {"order_items": [{"product": self.product.id, "quantity": quantity}]}, format="json")
+        self.assertEqual(response.status_code, 201)
+        return Order.objects.get(pk=response.data["order_id"])
+
+    def summary(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("user-order-summary"))
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_summary_follows_order_transitions(self):
+        completed, canceled, pending = self.place_order(2), self.place_order(1), self.place_order(3)
+        completed.status = "Completed"
+        completed.save()
+        canceled.status = "Canceled"
+        canceled.save()
+
+        summary = self.summary()
+        self.assertEqual(
+            (summary["total_orders"], summary["pending_orders"], summary["completed_orders"], summary["canceled_orders"]),
+            (3, 1, 1, 1),
+        )
+        self.assertEqual(Decimal(summary["lifetime_spend"]), Decimal("20.00"))
+        pending.refresh_from_db()
+        self.assertEqual(summary["last_order_at"], pending.created_at.isoformat().replace("+00:00", "Z"))
+
+    def test_expired_orders_are_counted_as_canceled(self):
+        self.place_order()
+        release_expired_reservations(now=timezone.now() + timezone.timedelta(days=1))
+
+        summary = self.summary()
+        self.assertEqual((summary["pending_orders"], summary["canceled_orders"]), (0, 1))
+
+    def test_missing_summary_is_rebuilt_from_orders(self):
+        order = self.place_order(2)
+        order.status = "Completed"
+        order.save()
+        OrderSummary.objects.all().delete()
+
+        response = self.client.get(reverse("user-order-summary"))
+        self.assertEqual((response.data["completed_orders"], Decimal(response.data["lifetime_spend"])), (1, Decimal("20.00")))
+
+
+class QueryPlanTests(TestCase):
+    """The hot order queries are served by indexes."""
+
+    def test_order_list_for_a_user(self):
+        orders = Order.objects.filter(user_id=1).order_by("-created_at", "-id")[:51]
+        self.assertEqual(unindexed_steps(orders), [])
+
+    def test_order_item_lookup_by_order_and_product(self):
+        self.assertEqual(unindexed_steps(OrderItem.objects.filter(order_id=1, product_id=1)), [])
+
+    def test_coupon_map_load(self):
+        coupons = Coupon.objects.select_related("product").filter(active=True, valid_to__gte=timezone.now())
+        self.assertEqual(unindexed_steps(coupons), [])
+
+    def test_duplicate_item_is_merged_into_the_existing_line(self):
+        user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        category = Category.objects.create(name="Gadgets")
+        product = Product.objects.create(name="Widget", description="-", category=category, price=Decimal("10.00"), stock=10)
+        order = Order.objects.create(user=user)
+
+        first = OrderItem.objects.create(order=order, product=product, quantity=2)
+        second = OrderItem.objects.create(order=order, product=product, quantity=3)
+
+        self.assertEqual(second.pk, first.pk)
+        item = OrderItem.objects.get(order=order)
+        self.assertEqual((item.quantity, item.total_price), (5, Decimal("50.00")))
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 5)
@@ -5,10 +5,16 @@ from django.utils.timezone import now
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError
 from django.db import transaction
+from django.db.models import Prefetch
 
 from .models import Order, OrderItem, Coupon
 from .serializers import OrderSerializer, OrderItemSerializer, CouponSerializer
+from .checkout import place_order
+from .coupons import active_coupons, release_unused
+from .reservations import hold_stock
+from .pagination import OrderCursorPagination, OrderItemCursorPagination
 from products.models import Product
+from ecommerce.replicas import ReplicaReadMixin
 
 
 class IsAdminOrReadOnly(BasePermission):
@@ -16,21 +22,26 @@ class IsAdminOrReadOnly(BasePermission):
         if request.method in SAFE_METHODS:
             return True
         return request.user and request.user.is_staff
-    
+
 
 # Views
-class OrderListCreateView(generics.ListCreateAPIView):
+class OrderListCreateView(ReplicaReadMixin, generics.ListCreateAPIView):
     """
     Stock deduction is managed by the OrderItem.save() logic via the serializer.
+    Listing prefetches every page's items with their products and coupons, so a page costs a fixed number of queries.
     """
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = OrderCursorPagination
 
     def get_queryset(self):
         user = self.request.user
+        orders = Order.objects.prefetch_related(
+            Prefetch("items", queryset=OrderItem.objects.select_related("product", "coupon").order_by("id"))
+        )
         if user.is_staff:
-            return Order.objects.all()
-        return Order.objects.filter(user=user)
+            return orders
+        return orders.filter(user=user)
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -62,24 +73,24 @@ class OrderDetailView(generics.RetrieveUpdateDestroyAPIView):
         return Response(OrderSerializer(order).data)
     
 
-class OrderItemListCreateView(generics.ListCreateAPIView):
+class OrderItemListCreateView(ReplicaReadMixin, generics.ListCreateAPIView):
     serializer_class = OrderItemSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = OrderItemCursorPagination
 
     def get_queryset(self):
         user = self.request.user
+        items = OrderItem.objects.select_related("product", "coupon")
         if user.is_staff:
-            return OrderItem.objects.all()
-        return OrderItem.objects.filter(order__user=user).order_by("order", "id")
+            return items
+        return items.filter(order__user=user)
 
     def perform_create(self, serializer):
         with transaction.atomic():
             # Create the order item using our custom create method in the serializer.
             order_item = serializer.save()
-            # Update the order's total amount after appending/updating items.
-            order = order_item.order
-            order.total_amount = sum(item.total_price for item in order.items.all())
-            order.save()
+            # Order.save() re-sums the order's total after appending/updating items.
+            order_item.order.save()
             return order_item
 
 
@@ -102,18 +113,36 @@ class OrderItemDetailView(generics.RetrieveUpdateDestroyAPIView):
         serializer.is_valid(raise_exception=True)
         with transaction.atomic():
             order_item = serializer.save()
-            order = order_item.order
-            order.total_amount = sum(item.total_price for item in order.items.all())
-            order.save()
+            order_item.order.save()  # Re-sums the order's total
         return Response(OrderItemSerializer(order_item).data)
 
+    def destroy(self, request, *args, **kwargs):
+        order_item = self.get_object()
+        if order_item.order.status in ["Completed", "Canceled"]:
+            return Response({"detail": "Cannot modify items in a completed or canceled order."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            order = order_item.order
+            # The item's stock goes back on sale and out of the order's holds
+            hold_stock(order, order_item.product, -order_item.quantity)
+            order_item.product.restore_stock(order_item.quantity, change_type="Order Item Removed")
+            order_item.delete()
+            release_unused(order, order_item.coupon_id)
+            order.save()  # Re-sums the order's total
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
 class CouponListCreateView(generics.ListCreateAPIView):
+    """Lists the active, unexpired coupons from the cached coupon map."""
     serializer_class = CouponSerializer
     permission_classes = [IsAdminOrReadOnly]
 
     def get_queryset(self):
         return Coupon.objects.filter(active=True)
+
+    def list(self, request, *args, **kwargs):
+        _, by_id = active_coupons()
+        return Response(self.get_serializer(list(by_id.values()), many=True).data)
     
 
 class CouponDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -123,6 +152,11 @@ class CouponDetailView(generics.RetrieveUpdateDestroyAPIView):
 
 
 class CheckoutView(APIView):
+    """
+    Places an order for the whole cart in one transaction.
+    Expects a POST request with:
+      - order_items: A list of {product, quantity, coupon (optional)} entries.
+    """
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request):
@@ -132,11 +166,8 @@ class CheckoutView(APIView):
         if not order_data:
             return Response({"detail": "Your cart is empty."}, status=status.HTTP_400_BAD_REQUEST)
 
-        with transaction.atomic():
-            order_serializer = OrderSerializer(data={"user": user.id, "status": "Pending", "items": order_data})
-            order_serializer.is_valid(raise_exception=True)
-            order = order_serializer.save(user=user)
-        
+        order = place_order(user, order_data)
+
         return Response({
             "message": "Order placed successfully!",
             "order_id": order.id,
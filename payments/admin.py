@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Payment
+from .models import Payment, MpesaTransaction, WebhookEvent, OutboundEmail
 
 # Register your models here.
 class PaymentAdmin(admin.ModelAdmin):
@@ -9,4 +9,31 @@ class PaymentAdmin(admin.ModelAdmin):
     ordering = ("-id",)
     readonly_fields = ()
 
-admin.site.register(Payment, PaymentAdmin)
\ No newline at end of file
+admin.site.register(Payment, PaymentAdmin)
+
+
+class MpesaTransactionAdmin(admin.ModelAdmin):
+    list_display = ("id", "payment", "checkout_request_id", "phone_number", "amount", "status", "receipt_number", "created_at")
+    search_fields = ("checkout_request_id", "receipt_number", "phone_number", "payment__order__id")
+    list_filter = ("status",)
+    ordering = ("-created_at",)
+
+admin.site.register(MpesaTransaction, MpesaTransactionAdmin)
+
+
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ("id", "source", "event_id", "event_type", "status", "attempts", "next_attempt_at", "received_at", "processed_at")
+    search_fields = ("event_id", "event_type")
+    list_filter = ("source", "status", "event_type")
+    ordering = ("-received_at",)
+
+admin.site.register(WebhookEvent, WebhookEventAdmin)
+
+
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ("id", "subject", "to", "status", "attempts", "next_attempt_at", "sent_at")
+    search_fields = ("subject", "to")
+    list_filter = ("status",)
+    ordering = ("-created_at",)
+
+admin.site.register(OutboundEmail, OutboundEmailAdmin)
@@ -0,0 +1,70 @@
+"""
+Webhook inbox worker.
+
+Webhook endpoints only store received events as WebhookEvent rows, tagged with
+their source (Stripe events here, M-Pesa callbacks in mpesa_callbacks). This
+module applies them: each event is marked processed in the same transaction as the
+handler's own writes, behind a conditional update, so an event is applied
+exactly once even if several workers drain the inbox or the worker crashes
+mid-batch. A failed event is retried with exponential backoff, and events are
+taken in the order they are due, so retries never hold back fresh events.
+"""
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import WebhookEvent
+from .webhooks import EVENT_HANDLERS
+
+logger = logging.getLogger(__name__)
+
+
+def pending_events(source, batch_size):
+    """Up to `batch_size` due pending events of one source, in the order they became due."""
+    return list(
+        WebhookEvent.objects.filter(source=source, status="Pending", next_attempt_at__lte=timezone.now())
+        .order_by("next_attempt_at", "id")[:batch_size]
+    )
+
+
+def process_pending_events(batch_size=100):
+    """Apply up to `batch_size` due Stripe events, oldest first. Returns the number processed."""
+    processed = 0
+    for event in pending_events("stripe", batch_size):
+        if process_event(event, handle_stripe_event):
+            processed += 1
+    return processed
+
+
+def handle_stripe_event(event):
+    """Pass a Stripe event's data object to the handler of its type."""
+    handler = EVENT_HANDLERS.get(event.event_type)
+    if handler:
+        handler(event.payload["data"]["object"])
+
+
+def process_event(event, handle):
+    """Apply a single event with `handle(event)`. Returns False if it failed or another worker already took it."""
+    try:
+        with transaction.atomic():
+            claimed = WebhookEvent.objects.filter(pk=event.pk, status="Pending").update(
+                status="Processed", processed_at=timezone.now(), attempts=F("attempts") + 1
+            )
+            if not claimed:
+                return False
+            handle(event)
+    except Exception as e:
+        logger.exception(f"Failed to process webhook event {event.event_id}")
+        attempts = event.attempts + 1
+        WebhookEvent.objects.filter(pk=event.pk, status="Pending").update(
+            attempts=attempts,
+            last_error=str(e),
+            status="Failed" if attempts >= settings.WEBHOOK_MAX_ATTEMPTS else "Pending",
+            next_attempt_at=timezone.now() + timedelta(seconds=settings.WEBHOOK_RETRY_BACKOFF * 2 ** (attempts - 1)),
+        )
+        return False
+
+    return True
@@ -0,0 +1,159 @@
+"""
+Invoice rendering service.
+
+Invoices are rendered by a process pool (settings.INVOICE_RENDER_WORKERS, 0 to
+render in-process) and stored in the default storage under a hash of the
+order and payment details they show. Re-sending or downloading an invoice for
+unchanged details is served from storage instead of re-rendering, and a change
+to the order or payment naturally produces a new file.
+"""
+import base64
+import hashlib
+import json
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+import barcode
+import qrcode
+from barcode.writer import ImageWriter
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.template.loader import render_to_string
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_in_flight = {}  # invoice key -> Future of a render already submitted to the pool
+
+
+def invoice_context(order, payment):
+    """Plain, picklable snapshot of everything the invoice shows."""
+    return {
+        "order": {
+            "id": order.id,
+            "status": order.status,
+            "total_amount": str(order.total_amount),
+            "created_at": order.created_at.isoformat() if order.created_at else None,
+            "customer": order.user.get_full_name() or order.user.username,
+            "email": order.user.email,
+            "items": [
+                {"product": item.product.name, "quantity": item.quantity, "total_price": str(item.total_price)}
+                for item in order.items.select_related("product").order_by("id")
+            ],
+        },
+        "payment": {
+            "id": payment.id,
+            "amount": str(payment.amount),
+            "status": payment.status,
+        },
+        "logo": f"{settings.STATIC_URL}images/logo.png",
+    }
+
+
+def invoice_key(context):
+    return hashlib.sha256(json.dumps(context, sort_keys=True).encode()).hexdigest()
+
+
+def invoice_path(key):
+    return f"invoices/{key}.pdf"
+
+
+def _png_data_uri(image_buffer):
+    return "data:image/png;base64," + base64.b64encode(image_buffer.getvalue()).decode()
+
+
+def invoice_images(order_id):
+    """QR code and Code128 barcode for the order, as in-memory data URIs."""
+    qr_buffer = BytesIO()
+    qrcode.make(f"Order ID: {order_id}").save(qr_buffer, format="PNG")
+
+    barcode_buffer = BytesIO()
+    barcode_class = barcode.get_barcode_class("code128")
+    barcode_class(f"{order_id}", writer=ImageWriter()).write(barcode_buffer)
+
+    return _png_data_uri(qr_buffer), _png_data_uri(barcode_buffer)
+
+
+def render_invoice(context):
+    """Render the invoice PDF for an invoice_context(). Runs inside the render pool."""
+    from weasyprint import HTML  # Heavy native dependency, only needed by render workers
+
+    qr_code, barcode_image = invoice_images(context["order"]["id"])
+    html_string = render_to_string("payments/invoice.html", {**context, "qr_code": qr_code, "barcode": barcode_image})
+
+    pdf_file = BytesIO()
+    HTML(string=html_string).write_pdf(pdf_file)
+    return pdf_file.getvalue()
+
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=settings.INVOICE_RENDER_WORKERS, initializer=_init_worker)
+    return _executor
+
+
+def _submit(key, context):
+    """Submit a render to the pool, reusing the one already running for the same invoice."""
+    with _executor_lock:
+        future = _in_flight.get(key)
+    if future is None:
+        future = get_executor().submit(render_invoice, context)
+        with _executor_lock:
+            future = _in_flight.setdefault(key, future)
+        future.add_done_callback(lambda done: _in_flight.pop(key, None))
+    return future
+
+
+def _store(key, pdf):
+    path = invoice_path(key)
+    if not default_storage.exists(path):
+        saved = default_storage.save(path, ContentFile(pdf))
+        if saved != path:
+            # Another worker stored this invoice first and the storage gave ours a free name; both hold the same bytes
+            default_storage.delete(saved)
+    return pdf
+
+
+def get_invoice(order, payment):
+    """Return the invoice PDF bytes, rendering and storing it only if it isn't cached yet."""
+    context = invoice_context(order, payment)
+    key = invoice_key(context)
+    path = invoice_path(key)
+
+    if default_storage.exists(path):
+        with default_storage.open(path, "rb") as cached:
+            return cached.read()
+
+    if not settings.INVOICE_RENDER_WORKERS:
+        return _store(key, render_invoice(context))
+    return _store(key, _submit(key, context).result())
+
+
+def schedule_invoice(order, payment):
+    """Render the invoice in the background so it is cached before anyone asks for it."""
+    context = invoice_context(order, payment)
+    key = invoice_key(context)
+    if default_storage.exists(invoice_path(key)):
+        return
+
+    if not settings.INVOICE_RENDER_WORKERS:
+        _store(key, render_invoice(context))
+        return
+
+    def store_result(future):
+        try:
+            _store(key, future.result())
+        except Exception:
+            logger.exception(f"Failed to render invoice for Order {context['order']['id']}")
+
+    _submit(key, context).add_done_callback(store_result)
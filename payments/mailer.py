@@ -0,0 +1,102 @@
+"""
+Outbound email sender.
+
+Notification emails are queued as OutboundEmail rows (see utils.send_payment_email)
+and delivered here in batches over a single SMTP connection. Failed deliveries
+are retried with exponential backoff until EMAIL_MAX_ATTEMPTS is reached.
+Emails left "Sending" by a sender that crashed are queued again once their
+claim is older than EMAIL_SENDING_TIMEOUT seconds, counting as an attempt.
+"""
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Case, F, Value, When
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.utils import timezone
+
+from .models import OutboundEmail
+from .invoices import get_invoice
+
+logger = logging.getLogger(__name__)
+
+
+def build_message(email, connection=None):
+    message = EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email,
+        to=email.to,
+        connection=connection,
+    )
+    if email.html_body:
+        message.attach_alternative(email.html_body, "text/html")
+    if email.attach_invoice and email.payment:
+        order = email.payment.order
+        message.attach(f"Invoice_{order.id}.pdf", get_invoice(order, email.payment), "application/pdf")
+    return message
+
+
+def send_queued_emails(batch_size=50):
+    """Deliver up to `batch_size` due emails over one SMTP connection. Returns the number sent."""
+    now = timezone.now()
+    recover_stale_claims(now)
+    emails = list(
+        OutboundEmail.objects.filter(status="Pending", next_attempt_at__lte=now)
+        .select_related("payment__order__user")
+        .order_by("next_attempt_at", "id")[:batch_size]
+    )
+    if not emails:
+        return 0
+
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        # The SMTP server is unreachable, the whole batch waits for its next attempt.
+        for email in emails:
+            _retry_later(email, e)
+        return 0
+
+    sent = 0
+    try:
+        for email in emails:
+            # Claim the email so a concurrent sender skips it.
+            if not OutboundEmail.objects.filter(pk=email.pk, status="Pending").update(status="Sending", claimed_at=timezone.now()):
+                continue
+            try:
+                connection.send_messages([build_message(email, connection)])
+            except Exception as e:
+                _retry_later(email, e)
+            else:
+                OutboundEmail.objects.filter(pk=email.pk).update(status="Sent", sent_at=timezone.now(), attempts=email.attempts + 1)
+                sent += 1
+    finally:
+        connection.close()
+
+    return sent
+
+
+def recover_stale_claims(now=None):
+    """Queue again the emails whose sender stopped while sending them. Returns the number recovered."""
+    now = now or timezone.now()
+    stale = OutboundEmail.objects.filter(status="Sending", claimed_at__lte=now - timedelta(seconds=settings.EMAIL_SENDING_TIMEOUT))
+    recovered = stale.update(
+        status=Case(When(attempts__gte=settings.EMAIL_MAX_ATTEMPTS - 1, then=Value("Failed")), default=Value("Pending")),
+        attempts=F("attempts") + 1,
+        last_error="The sender stopped while sending.",
+        next_attempt_at=now,
+    )
+    if recovered:
+        logger.warning(f"Recovered {recovered} email(s) left sending by a stopped sender")
+    return recovered
+
+
+def _retry_later(email, error):
+    attempts = email.attempts + 1
+    logger.warning(f"Failed to send email {email.id} (attempt {attempts}): {error}")
+    OutboundEmail.objects.filter(pk=email.pk).update(
+        status="Failed" if attempts >= settings.EMAIL_MAX_ATTEMPTS else "Pending",
+        attempts=attempts,
+        last_error=str(error),
+        next_attempt_at=timezone.now() + timedelta(seconds=settings.EMAIL_RETRY_BACKOFF * 2 ** (attempts - 1)),
+    )
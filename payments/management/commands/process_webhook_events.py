@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+
+from payments.inbox import process_pending_events
+
+
+class Command(BaseCommand):
+    help = "Apply pending webhook events stored in the WebhookEvent inbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100, help="Events fetched per batch.")
+        parser.add_argument("--interval", type=float, default=0, help="Keep running, polling every N seconds when the inbox is empty.")
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_pending_events(batch_size=options["batch_size"])
+            if processed:
+                self.stdout.write(f"Processed {processed} webhook event(s).")
+                continue  # Keep draining while there is a backlog
+
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,28 @@
+import time
+from django.core.management.base import BaseCommand
+
+from payments.mpesa_callbacks import reconcile_callbacks, sweep_lost_callbacks
+
+
+class Command(BaseCommand):
+    help = "Apply stored M-Pesa STK callbacks to their payments and query pushes whose callback was lost."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100, help="Callbacks fetched per batch.")
+        parser.add_argument("--interval", type=float, default=0, help="Keep running, polling every N seconds when there is nothing to do.")
+
+    def handle(self, *args, **options):
+        while True:
+            processed = reconcile_callbacks(batch_size=options["batch_size"])
+            if processed:
+                self.stdout.write(f"Reconciled {processed} M-Pesa payment result(s).")
+                continue  # Keep draining while there is a backlog
+
+            queried = sweep_lost_callbacks(batch_size=options["batch_size"])
+            if queried:
+                self.stdout.write(f"Recovered {queried} lost M-Pesa callback(s).")
+                continue
+
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+
+from payments.mailer import send_queued_emails
+
+
+class Command(BaseCommand):
+    help = "Deliver queued notification emails over a shared SMTP connection."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50, help="Emails sent per SMTP connection.")
+        parser.add_argument("--interval", type=float, default=0, help="Keep running, polling every N seconds when the queue is empty.")
+
+    def handle(self, *args, **options):
+        while True:
+            sent = send_queued_emails(batch_size=options["batch_size"])
+            if sent:
+                self.stdout.write(f"Sent {sent} email(s).")
+                continue  # Keep draining while there is a backlog
+
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,61 @@
+# Generated by Django 5.1.6 on 2026-10-18 10:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0003_outbound_emails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MpesaTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checkout_request_id', models.CharField(max_length=100, unique=True)),
+                ('merchant_request_id', models.CharField(blank=True, max_length=100)),
+                ('phone_number', models.CharField(max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('status', models.CharField(choices=[('Pending', 'Pending'), ('Completed', 'Completed'), ('Failed', 'Failed')], default='Pending', max_length=20)),
+                ('result_code', models.IntegerField(blank=True, null=True)),
+                ('result_desc', models.CharField(blank=True, max_length=255)),
+                ('receipt_number', models.CharField(blank=True, max_length=50)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='webhookevent',
+            name='idx_webhook_event_queue',
+        ),
+        migrations.AddField(
+            model_name='webhookevent',
+            name='source',
+            field=models.CharField(choices=[('stripe', 'Stripe'), ('mpesa', 'M-Pesa')], default='stripe', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='webhookevent',
+            name='event_id',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(fields=['source', 'status', 'received_at'], name='idx_webhook_event_queue'),
+        ),
+        migrations.AddConstraint(
+            model_name='webhookevent',
+            constraint=models.UniqueConstraint(fields=('source', 'event_id'), name='unique_webhook_event'),
+        ),
+        migrations.AddField(
+            model_name='mpesatransaction',
+            name='payment',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mpesa_transactions', to='payments.payment'),
+        ),
+        migrations.AddIndex(
+            model_name='mpesatransaction',
+            index=models.Index(fields=['status', 'updated'], name='idx_mpesa_transaction_status'),
+        ),
+    ]
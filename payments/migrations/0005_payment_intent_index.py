@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0009_hot_query_indexes'),
+        ('payments', '0004_mpesa_transactions'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['stripe_payment_intent'], name='idx_payment_intent'),
+        ),
+    ]
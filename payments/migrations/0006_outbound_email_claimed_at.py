@@ -0,0 +1,26 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:44
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def claim_sending_emails(apps, schema_editor):
+    # Emails already being sent get a claim now, so they are recovered if their sender died
+    OutboundEmail = apps.get_model("payments", "OutboundEmail")
+    OutboundEmail.objects.filter(status="Sending").update(claimed_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0005_payment_intent_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboundemail',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(claim_sending_emails, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:56
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0006_outbound_email_claimed_at'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='webhookevent',
+            name='idx_webhook_event_queue',
+        ),
+        migrations.AddField(
+            model_name='webhookevent',
+            name='next_attempt_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(fields=['source', 'status', 'next_attempt_at'], name='idx_webhook_event_queue'),
+        ),
+    ]
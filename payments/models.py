@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 import stripe
 from django.conf import settings
 from orders.models import Order
@@ -18,6 +19,11 @@ class Payment(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="Pending")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["stripe_payment_intent"], name="idx_payment_intent"),
+        ]
+
     def create_payment_intent(self):
         """Create a Stripe PaymentIntent and save the intent ID."""
         try:
@@ -40,4 +46,105 @@ class Payment(models.Model):
         super().save(*args, **kwargs)
 
     def __str__(self):
-        return f"Payment: {self.id} | Order: {self.order.id} | {self.status}"
\ No newline at end of file
+        return f"Payment: {self.id} | Order: {self.order.id} | {self.status}"
+
+
+class MpesaTransaction(models.Model):
+    """An STK push sent for a payment, matched to M-Pesa's callback by its CheckoutRequestID."""
+    STATUS_CHOICES = [
+        ("Pending", "Pending"),
+        ("Completed", "Completed"),
+        ("Failed", "Failed"),
+    ]
+
+    payment = models.ForeignKey(Payment, on_delete=models.CASCADE, related_name="mpesa_transactions")
+    checkout_request_id = models.CharField(max_length=100, unique=True)
+    merchant_request_id = models.CharField(max_length=100, blank=True)
+    phone_number = models.CharField(max_length=20)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="Pending")
+    result_code = models.IntegerField(null=True, blank=True)
+    result_desc = models.CharField(max_length=255, blank=True)
+    receipt_number = models.CharField(max_length=50, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "updated"], name="idx_mpesa_transaction_status"),
+        ]
+
+    def __str__(self):
+        return f"M-Pesa {self.checkout_request_id} | Payment: {self.payment_id} | {self.status}"
+
+
+class WebhookEvent(models.Model):
+    """Inbox of received webhook events, drained by the process_webhook_events command."""
+    STATUS_CHOICES = [
+        ("Pending", "Pending"),
+        ("Processed", "Processed"),
+        ("Failed", "Failed"),
+    ]
+
+    SOURCE_CHOICES = [
+        ("stripe", "Stripe"),
+        ("mpesa", "M-Pesa"),
+    ]
+
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default="stripe")
+    event_id = models.CharField(max_length=255)
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="Pending")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # Failed events wait until then before they are retried
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["source", "status", "next_attempt_at"], name="idx_webhook_event_queue"),
+        ]
+        constraints = [
+            # Redelivered events are dropped by this constraint
+            models.UniqueConstraint(fields=["source", "event_id"], name="unique_webhook_event"),
+        ]
+
+    def __str__(self):
+        return f"Webhook {self.source} {self.event_id} | {self.event_type} | {self.status}"
+
+
+class OutboundEmail(models.Model):
+    """Queued notification email, delivered in batches by the send_queued_emails command."""
+    STATUS_CHOICES = [
+        ("Pending", "Pending"),
+        ("Sending", "Sending"),
+        ("Sent", "Sent"),
+        ("Failed", "Failed"),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField(default=list)
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True)
+    attach_invoice = models.BooleanField(default=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="Pending")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    # When a sender last claimed the email, to recover it if that sender dies mid-send
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"], name="idx_outbound_email_queue"),
+        ]
+
+    def __str__(self):
+        return f"Email {self.id} to {', '.join(self.to)} | {self.subject} | {self.status}"
@@ -0,0 +1,179 @@
+"""
+M-Pesa STK Push callbacks.
+
+Every STK push sent by the mpesa_pay view is recorded as a MpesaTransaction,
+keyed by the CheckoutRequestID that M-Pesa echoes back in its callback. The
+callback endpoint only stores callbacks in the WebhookEvent inbox (source
+"mpesa", one row per CheckoutRequestID), and reconcile_callbacks applies them
+in batches, loading the transactions of a whole batch in a single query.
+Pushes whose callback never arrives are looked up with the STK Push query API
+by sweep_lost_callbacks and reconciled the same way.
+
+Callbacks are not signed, so they are never trusted as sent: they must carry
+MPESA_CALLBACK_TOKEN, and a successful one only completes a payment once the
+STK Push query API confirms it and its amount matches the push.
+"""
+import hmac
+import json
+import logging
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework import status
+
+from .models import MpesaTransaction, WebhookEvent
+from .inbox import pending_events, process_event
+from .mpesa_service import MpesaAPI
+from .webhooks import complete_payment, fail_payment
+
+logger = logging.getLogger(__name__)
+
+
+@csrf_exempt
+@require_POST
+async def mpesa_callback(request):
+    """
+    Stores an STK Push callback in the WebhookEvent inbox and acknowledges it.
+
+    A redelivered callback is ignored by the unique (source, event_id) pair.
+    """
+    token = settings.MPESA_CALLBACK_TOKEN
+    if token and not hmac.compare_digest(request.GET.get("token", ""), token):
+        logger.error("M-Pesa callback with an invalid token")
+        return JsonResponse({"ResultCode": 1, "ResultDesc": "Invalid token"}, status=status.HTTP_403_FORBIDDEN)
+
+    try:
+        result = json.loads(request.body)["Body"]["stkCallback"]
+        checkout_request_id = result["CheckoutRequestID"]
+    except (ValueError, KeyError, TypeError):
+        logger.error("Invalid M-Pesa callback payload")
+        return JsonResponse({"ResultCode": 1, "ResultDesc": "Invalid payload"}, status=status.HTTP_400_BAD_REQUEST)
+
+    await WebhookEvent.objects.abulk_create(
+        [WebhookEvent(source="mpesa", event_id=checkout_request_id, event_type="stk_callback", payload=result)],
+        ignore_conflicts=True,
+    )
+    return JsonResponse({"ResultCode": 0, "ResultDesc": "Accepted"})
+
+
+def callback_metadata(result):
+    """CallbackMetadata items of a successful STK result as a dict, e.g. {"MpesaReceiptNumber": ...}."""
+    items = result.get("CallbackMetadata", {}).get("Item", [])
+    return {item["Name"]: item.get("Value") for item in items}
+
+
+def confirm_success(mpesa_transaction, result):
+    """
+    The result to apply for a successful STK callback: the callback itself once
+    its amount matches the push and the STK Push query API agrees, or the
+    query's result if M-Pesa says otherwise. Raises if the callback can't be
+    trusted yet, so the event is retried.
+    """
+    checkout_request_id = mpesa_transaction.checkout_request_id
+    amount = callback_metadata(result).get("Amount")
+    try:
+        matches = amount is not None and Decimal(str(amount)) == mpesa_transaction.amount
+    except InvalidOperation:
+        matches = False
+    if not matches:
+        raise ValueError(f"Callback amount {amount!r} does not match {mpesa_transaction.amount} of STK push {checkout_request_id}")
+
+    confirmed = MpesaAPI.query_stk_status(checkout_request_id)
+    if "ResultCode" not in confirmed:
+        raise RuntimeError(f"Could not confirm STK push {checkout_request_id}: {confirmed}")
+    return result if int(confirmed["ResultCode"]) == 0 else confirmed
+
+
+def apply_stk_result(mpesa_transaction, result):
+    """Applies an STK Push result (callback or query response) to its transaction and payment."""
+    if mpesa_transaction.status != "Pending":
+        return
+
+    checkout_request_id = mpesa_transaction.checkout_request_id
+    mpesa_transaction.result_code = int(result["ResultCode"])
+    mpesa_transaction.result_desc = str(result.get("ResultDesc", ""))[:255]
+    payment = mpesa_transaction.payment
+
+    if mpesa_transaction.result_code == 0:
+        mpesa_transaction.status = "Completed"
+        mpesa_transaction.receipt_number = str(callback_metadata(result).get("MpesaReceiptNumber", ""))
+        mpesa_transaction.save()
+        if payment.status != "Completed":
+            complete_payment(payment, checkout_request_id)
+    else:
+        mpesa_transaction.status = "Failed"
+        mpesa_transaction.save()
+        # The customer may have retried with another push, which decides the payment instead
+        if payment.status == "Pending" and not payment.mpesa_transactions.filter(status="Pending").exists():
+            fail_payment(payment, checkout_request_id)
+
+
+def reconcile_callbacks(batch_size=100):
+    """Apply up to `batch_size` pending M-Pesa results, oldest first. Returns the number processed."""
+    events = pending_events("mpesa", batch_size)
+    if not events:
+        return 0
+
+    transactions = MpesaTransaction.objects.select_related("payment__order").in_bulk(
+        [event.event_id for event in events], field_name="checkout_request_id"
+    )
+
+    # Successful callbacks are confirmed before any event's transaction is opened
+    results = {}
+    for event in events:
+        mpesa_transaction = transactions.get(event.event_id)
+        results[event.pk] = event.payload
+        if event.event_type == "stk_callback" and mpesa_transaction and mpesa_transaction.status == "Pending" \
+                and str(event.payload.get("ResultCode")) == "0":
+            try:
+                results[event.pk] = confirm_success(mpesa_transaction, event.payload)
+            except Exception as e:
+                results[event.pk] = e
+
+    def handle(event):
+        mpesa_transaction = transactions.get(event.event_id)
+        if mpesa_transaction is None:
+            # Retried until WEBHOOK_MAX_ATTEMPTS in case the push is still being recorded
+            raise MpesaTransaction.DoesNotExist(f"No STK push with CheckoutRequestID {event.event_id}")
+        result = results[event.pk]
+        if isinstance(result, Exception):
+            raise result
+        apply_stk_result(mpesa_transaction, result)
+
+    processed = 0
+    for event in events:
+        if process_event(event, handle):
+            processed += 1
+    return processed
+
+
+def sweep_lost_callbacks(batch_size=100):
+    """
+    Query the status of pending pushes that got no callback within MPESA_QUERY_AFTER seconds.
+    Known results are stored in the inbox like callbacks. Returns the number stored.
+    """
+    now = timezone.now()
+    lost = list(
+        MpesaTransaction.objects.filter(status="Pending", updated__lte=now - timedelta(seconds=settings.MPESA_QUERY_AFTER))
+        .exclude(checkout_request_id__in=WebhookEvent.objects.filter(source="mpesa").values("event_id"))
+        .order_by("updated")[:batch_size]
+    )
+    if not lost:
+        return 0
+
+    events = []
+    for mpesa_transaction in lost:
+        result = MpesaAPI.query_stk_status(mpesa_transaction.checkout_request_id)
+        if "ResultCode" in result:
+            events.append(
+                WebhookEvent(source="mpesa", event_id=mpesa_transaction.checkout_request_id, event_type="stk_query", payload=result)
+            )
+
+    WebhookEvent.objects.bulk_create(events, ignore_conflicts=True)
+    # Pushes still being processed are queried again once MPESA_QUERY_AFTER has passed
+    MpesaTransaction.objects.filter(pk__in=[mpesa_transaction.pk for mpesa_transaction in lost]).update(updated=now)
+    return len(events)
@@ -1,45 +1,118 @@
+import asyncio
 import requests
+import httpx
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 from django.conf import settings
+from django.core.cache import cache
 from datetime import datetime
 import base64
 import logging
+import threading
+import time
+from urllib.parse import urlencode
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# The OAuth token is shared by every worker through the Django cache
+TOKEN_CACHE_KEY = "mpesa:access_token"
+TOKEN_LOCK_KEY = "mpesa:access_token:lock"
+
+
 class MpesaAPI:
-    # Set base URL depending on the environment
-    base_url = "https://sandbox.safaricom.co.ke" if settings.MPESA_ENV == "sandbox" else "https://api.safaricom.co.ke"
+    """
+    Blocking M-Pesa client.
 
+    Requests go through one pooled keep-alive session with timeouts, and the
+    OAuth access token is cached until shortly before it expires, so an STK
+    push normally costs a single HTTPS round trip.
+    """
     # Use default sandbox credentials if no passkey is provided
     DEFAULT_SANDBOX_SHORTCODE = "174379"
     DEFAULT_SANDBOX_PASSKEY = "bfb279f9aa9bdbcf158e97dd71a467cd2e0c893059b10f78e6b72ada1ed2c919"
 
+    _session = None
+    _session_lock = threading.Lock()
+
     @staticmethod
-    def get_access_token():
-        """Generates an access token for M-Pesa API authentication."""
+    def get_base_url():
+        """Base URL depending on the environment, or MPESA_BASE_URL (e.g. a local stub server)."""
+        if settings.MPESA_BASE_URL:
+            return settings.MPESA_BASE_URL.rstrip("/")
+        return "https://sandbox.safaricom.co.ke" if settings.MPESA_ENV == "sandbox" else "https://api.safaricom.co.ke"
+
+    @staticmethod
+    def get_timeout():
+        return (settings.MPESA_CONNECT_TIMEOUT, settings.MPESA_TIMEOUT)
+
+    @classmethod
+    def get_session(cls):
+        """Process-wide session so connections to M-Pesa are kept alive and reused."""
+        with cls._session_lock:
+            if cls._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.MPESA_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                cls._session = session
+        return cls._session
+
+    @staticmethod
+    def token_cache_timeout(response_data):
+        """Seconds to keep a token: its lifetime minus a safety margin."""
+        expires_in = int(response_data.get("expires_in", 3599))
+        return max(expires_in - settings.MPESA_TOKEN_REFRESH_MARGIN, 1)
+
+    @staticmethod
+    def fetch_access_token():
+        """Requests a new access token from M-Pesa and caches it."""
         try:
-            url = f"{MpesaAPI.base_url}/oauth/v1/generate?grant_type=client_credentials"
-            response = requests.get(url, auth=HTTPBasicAuth(settings.MPESA_CONSUMER_KEY, settings.MPESA_CONSUMER_SECRET))
+            url = f"{MpesaAPI.get_base_url()}/oauth/v1/generate?grant_type=client_credentials"
+            response = MpesaAPI.get_session().get(
+                url,
+                auth=HTTPBasicAuth(settings.MPESA_CONSUMER_KEY, settings.MPESA_CONSUMER_SECRET),
+                timeout=MpesaAPI.get_timeout(),
+            )
             response_data = response.json()
 
             if response.status_code == 200 and "access_token" in response_data:
+                cache.set(TOKEN_CACHE_KEY, response_data["access_token"], MpesaAPI.token_cache_timeout(response_data))
                 return response_data["access_token"]
             else:
                 logger.error(f"Failed to get M-Pesa access token: {response_data}")
                 return None
-        except requests.RequestException as e:
+        except (requests.RequestException, ValueError) as e:
             logger.error(f"Error while fetching M-Pesa access token: {str(e)}")
             return None
 
     @staticmethod
-    def initiate_stk_push(phone_number, amount, account_reference="OrderPayment", transaction_desc="Payment for order"):
-        """Initiates Lipa Na M-Pesa Online (STK Push)."""
-        access_token = MpesaAPI.get_access_token()
-        if not access_token:
-            return {"error": "Failed to retrieve M-Pesa access token"}
+    def get_access_token():
+        """
+        Returns a cached access token, fetching a new one when it has expired.
+        Only one worker fetches at a time; the others wait briefly for its token.
+        """
+        token = cache.get(TOKEN_CACHE_KEY)
+        if token:
+            return token
+
+        if cache.add(TOKEN_LOCK_KEY, 1, timeout=settings.MPESA_CONNECT_TIMEOUT + settings.MPESA_TIMEOUT):
+            try:
+                return MpesaAPI.fetch_access_token()
+            finally:
+                cache.delete(TOKEN_LOCK_KEY)
+
+        deadline = time.monotonic() + settings.MPESA_CONNECT_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            token = cache.get(TOKEN_CACHE_KEY)
+            if token:
+                return token
+        return MpesaAPI.fetch_access_token()
 
+    @staticmethod
+    def get_password():
+        """Shortcode, request password and its timestamp, as signed requests expect them."""
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
 
         # Use the provided shortcode and passkey, or fallback to default sandbox credentials
@@ -47,14 +120,21 @@ class MpesaAPI:
         passkey = settings.MPESA_PASSKEY if settings.MPESA_PASSKEY else MpesaAPI.DEFAULT_SANDBOX_PASSKEY
 
         password = base64.b64encode(f"{shortcode}{passkey}{timestamp}".encode()).decode()
+        return shortcode, password, timestamp
 
-        url = f"{MpesaAPI.base_url}/mpesa/stkpush/v1/processrequest"
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json",
-        }
+    @staticmethod
+    def get_callback_url():
+        """MPESA_CALLBACK_URL, carrying MPESA_CALLBACK_TOKEN so mpesa_callback can tell M-Pesa's callbacks from forged ones."""
+        url = settings.MPESA_CALLBACK_URL
+        if settings.MPESA_CALLBACK_TOKEN:
+            url += f"{'&' if '?' in url else '?'}{urlencode({'token': settings.MPESA_CALLBACK_TOKEN})}"
+        return url
+
+    @staticmethod
+    def build_stk_push_payload(phone_number, amount, account_reference, transaction_desc):
+        shortcode, password, timestamp = MpesaAPI.get_password()
 
-        payload = {
+        return {
             "BusinessShortCode": shortcode,
             "Password": password,
             "Timestamp": timestamp,
@@ -63,13 +143,175 @@ class MpesaAPI:
             "PartyA": phone_number,
             "PartyB": shortcode,
             "PhoneNumber": phone_number,
-            "CallBackURL": settings.MPESA_CALLBACK_URL if hasattr(settings, "MPESA_CALLBACK_URL") else "https://yourdomain.com/api/payments/mpesa-callback/",
+            "CallBackURL": MpesaAPI.get_callback_url(),
             "AccountReference": account_reference,
             "TransactionDesc": transaction_desc,
         }
 
+    @staticmethod
+    def build_stk_query_payload(checkout_request_id):
+        shortcode, password, timestamp = MpesaAPI.get_password()
+
+        return {
+            "BusinessShortCode": shortcode,
+            "Password": password,
+            "Timestamp": timestamp,
+            "CheckoutRequestID": checkout_request_id,
+        }
+
+    @staticmethod
+    def post(path, payload):
+        """POST an authenticated request, refreshing the access token once if it was revoked."""
+        access_token = MpesaAPI.get_access_token()
+        if not access_token:
+            return None
+
+        url = f"{MpesaAPI.get_base_url()}{path}"
+        response = MpesaAPI.get_session().post(
+            url, json=payload, headers={"Authorization": f"Bearer {access_token}"}, timeout=MpesaAPI.get_timeout()
+        )
+        if response.status_code == 401:
+            # The cached token was revoked early, fetch a new one and retry once.
+            cache.delete(TOKEN_CACHE_KEY)
+            access_token = MpesaAPI.fetch_access_token()
+            if not access_token:
+                return None
+            response = MpesaAPI.get_session().post(
+                url, json=payload, headers={"Authorization": f"Bearer {access_token}"}, timeout=MpesaAPI.get_timeout()
+            )
+        return response
+
+    @staticmethod
+    def initiate_stk_push(phone_number, amount, account_reference="OrderPayment", transaction_desc="Payment for order"):
+        """Initiates Lipa Na M-Pesa Online (STK Push)."""
+        payload = MpesaAPI.build_stk_push_payload(phone_number, amount, account_reference, transaction_desc)
+
+        try:
+            response = MpesaAPI.post("/mpesa/stkpush/v1/processrequest", payload)
+            if response is None:
+                return {"error": "Failed to retrieve M-Pesa access token"}
+            response_data = response.json()
+
+            if response.status_code == 200:
+                return response_data
+            else:
+                logger.error(f"Failed to initiate STK Push: {response_data}")
+                return {"error": "STK Push request failed", "details": response_data}
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"Error during STK Push request: {str(e)}")
+            return {"error": "STK Push request error", "details": str(e)}
+
+    @staticmethod
+    def query_stk_status(checkout_request_id):
+        """Asks M-Pesa for the result of an STK Push whose callback never arrived."""
+        payload = MpesaAPI.build_stk_query_payload(checkout_request_id)
+
+        try:
+            response = MpesaAPI.post("/mpesa/stkpushquery/v1/query", payload)
+            if response is None:
+                return {"error": "Failed to retrieve M-Pesa access token"}
+            response_data = response.json()
+
+            if response.status_code == 200:
+                return response_data
+            else:
+                logger.error(f"Failed to query STK Push {checkout_request_id}: {response_data}")
+                return {"error": "STK Push query failed", "details": response_data}
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"Error during STK Push query: {str(e)}")
+            return {"error": "STK Push query error", "details": str(e)}
+
+
+class AsyncMpesaAPI:
+    """
+    asyncio M-Pesa client for async views served through ecommerce/asgi.py.
+
+    Same behaviour as MpesaAPI (shared token cache, pooled connections,
+    timeouts) on top of httpx.AsyncClient, one client per event loop. A client
+    can only be closed from its own loop, so code running in a short-lived loop
+    (an async view served under WSGI, asyncio.run) must call aclose() before
+    the loop ends; the ASGI server's loop keeps its client until shutdown.
+    """
+    _clients = {}
+    _token_locks = {}
+
+    @classmethod
+    def get_client(cls):
+        loop = asyncio.get_running_loop()
+        client = cls._clients.get(loop)
+        if client is None or client.is_closed:
+            # Finished loops can't use (or close) their client any more; forget those that weren't closed
+            for closed in [other for other in cls._clients if other.is_closed()]:
+                cls._clients.pop(closed)
+                cls._token_locks.pop(closed, None)
+            client = httpx.AsyncClient(
+                timeout=httpx.Timeout(settings.MPESA_TIMEOUT, connect=settings.MPESA_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=settings.MPESA_POOL_SIZE, max_keepalive_connections=settings.MPESA_POOL_SIZE),
+            )
+            cls._clients[loop] = client
+        return client
+
+    @classmethod
+    async def aclose(cls):
+        """Close the client of the running event loop (e.g. on shutdown)."""
+        loop = asyncio.get_running_loop()
+        cls._token_locks.pop(loop, None)
+        client = cls._clients.pop(loop, None)
+        if client is not None:
+            await client.aclose()
+
+    @classmethod
+    async def fetch_access_token(cls):
+        try:
+            response = await cls.get_client().get(
+                f"{MpesaAPI.get_base_url()}/oauth/v1/generate",
+                params={"grant_type": "client_credentials"},
+                auth=(settings.MPESA_CONSUMER_KEY, settings.MPESA_CONSUMER_SECRET),
+            )
+            response_data = response.json()
+
+            if response.status_code == 200 and "access_token" in response_data:
+                await cache.aset(TOKEN_CACHE_KEY, response_data["access_token"], MpesaAPI.token_cache_timeout(response_data))
+                return response_data["access_token"]
+            else:
+                logger.error(f"Failed to get M-Pesa access token: {response_data}")
+                return None
+        except (httpx.HTTPError, ValueError) as e:
+            logger.error(f"Error while fetching M-Pesa access token: {str(e)}")
+            return None
+
+    @classmethod
+    async def get_access_token(cls):
+        token = await cache.aget(TOKEN_CACHE_KEY)
+        if token:
+            return token
+
+        # Coroutines of this loop wait on one fetch instead of each requesting a token.
+        lock = cls._token_locks.setdefault(asyncio.get_running_loop(), asyncio.Lock())
+        async with lock:
+            token = await cache.aget(TOKEN_CACHE_KEY)
+            if token:
+                return token
+            return await cls.fetch_access_token()
+
+    @classmethod
+    async def initiate_stk_push(cls, phone_number, amount, account_reference="OrderPayment", transaction_desc="Payment for order"):
+        """Initiates Lipa Na M-Pesa Online (STK Push) without blocking the event loop."""
+        access_token = await cls.get_access_token()
+        if not access_token:
+            return {"error": "Failed to retrieve M-Pesa access token"}
+
+        url = f"{MpesaAPI.get_base_url()}/mpesa/stkpush/v1/processrequest"
+        payload = MpesaAPI.build_stk_push_payload(phone_number, amount, account_reference, transaction_desc)
+
         try:
-            response = requests.post(url, json=payload, headers=headers)
+            response = await cls.get_client().post(url, json=payload, headers={"Authorization": f"Bearer {access_token}"})
+            if response.status_code == 401:
+                await cache.adelete(TOKEN_CACHE_KEY)
+                access_token = await cls.fetch_access_token()
+                if not access_token:
+                    return {"error": "Failed to retrieve M-Pesa access token"}
+                response = await cls.get_client().post(url, json=payload, headers={"Authorization": f"Bearer {access_token}"})
             response_data = response.json()
 
             if response.status_code == 200:
@@ -77,6 +319,6 @@ class MpesaAPI:
             else:
                 logger.error(f"Failed to initiate STK Push: {response_data}")
                 return {"error": "STK Push request failed", "details": response_data}
-        except requests.RequestException as e:
+        except (httpx.HTTPError, ValueError) as e:
             logger.error(f"Error during STK Push request: {str(e)}")
             return {"error": "STK Push request error", "details": str(e)}
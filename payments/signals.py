@@ -0,0 +1,4 @@
+from django.dispatch import Signal
+
+# Sent when a completed payment is refunded, with the payment
+payment_refunded = Signal()
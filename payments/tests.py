@@ -1,3 +1,418 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import hmac
+import json
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from decimal import Decimal
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
 
-# Create your tests here.
+from orders.models import Order, StockReservation
+from orders.reservations import release_expired_reservations
+from products.models import Category, Product
+from .models import Payment, MpesaTransaction, WebhookEvent, OutboundEmail
+from .inbox import process_pending_events
+from .mpesa_callbacks import reconcile_callbacks, sweep_lost_callbacks
+from .invoices import invoice_images
+from .mailer import send_queued_emails
+from .utils import send_payment_email
+from .mpesa_service import MpesaAPI, AsyncMpesaAPI
+from utils.query_plans import unindexed_steps
+
+User = get_user_model()
+
+
+def stripe_signature(payload, secret=None):
+    """Build a Stripe-Signature header for `payload` the way Stripe signs webhooks."""
+    timestamp = int(time.time())
+    secret = secret or settings.STRIPE_WEBHOOK_SECRET
+    signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+class StripeWebhookInboxTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        self.order = Order.objects.create(user=user, total_amount=Decimal("20.00"))
+        self.payment = Payment.objects.create(order=self.order, stripe_payment_intent="pi_123", amount=Decimal("20.00"))
+
+    def post_event(self, event_id="evt_1", event_type="payment_intent.succeeded", secret=None):
+        payload = json.dumps({"id": event_id, "object": "event", "type": event_type, "data": {"object": {"id": "pi_123"}}})
+        return self.client.post(
+            reverse("stripe-webhook"), payload, content_type="application/json",
+            HTTP_STRIPE_SIGNATURE=stripe_signature(payload, secret),
+        )
+
+    def test_events_are_stored_once_and_acknowledged(self):
+        self.assertEqual(self.post_event().status_code, 200)
+        self.assertEqual(self.post_event().status_code, 200)
+
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, "Pending")  # Nothing applied until the worker runs
+
+    def test_invalid_signature_is_rejected(self):
+        self.assertEqual(self.post_event(secret="whsec_wrong").status_code, 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_worker_applies_each_event_exactly_once(self):
+        self.post_event()
+
+        self.assertEqual(process_pending_events(), 1)
+        self.assertEqual(process_pending_events(), 0)
+
+        self.payment.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertEqual(self.payment.status, "Completed")
+        self.assertEqual(self.order.status, "Completed")
+        self.assertEqual(WebhookEvent.objects.get().status, "Processed")
+
+    def test_failed_events_back_off_without_blocking_newer_ones(self):
+        broken = WebhookEvent.objects.create(
+            source="stripe", event_id="evt_broken", event_type="payment_intent.succeeded", payload={"data": {"object": {}}}
+        )
+        self.post_event()
+
+        self.assertEqual(process_pending_events(batch_size=1), 0)
+        self.assertEqual(process_pending_events(batch_size=1), 1)  # The new event goes first while the broken one waits
+        broken.refresh_from_db()
+        self.assertEqual((broken.status, broken.attempts), ("Pending", 1))
+        self.assertGreater(broken.next_attempt_at, timezone.now())
+        self.assertEqual(process_pending_events(), 0)
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, "Completed")
+
+
+class StripeRefundTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        client = APIClient()
+        client.force_authenticate(user)
+        category = Category.objects.create(name="Gadgets")
+        self.product = Product.objects.create(name="Widget", description="-", category=category, price=Decimal("10.00"), stock=5)
+        response = client.post(reverse("checkout"), {"order_items": [{"product": self.product.id, "quantity": 2}]}, format="json")
+        self.order = Order.objects.get(pk=response.data["order_id"])
+        self.payment = Payment.objects.create(order=self.order, stripe_payment_intent="pi_123", amount=Decimal("20.00"))
+
+    def apply_event(self, event_id, event_type, data):
+        WebhookEvent.objects.create(source="stripe", event_id=event_id, event_type=event_type, payload={"data": {"object": data}})
+        self.assertEqual(process_pending_events(), 1)
+
+    def assertStock(self, expected):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, expected)
+
+    def test_refund_returns_the_stock_of_a_completed_order_once(self):
+        self.apply_event("evt_1", "payment_intent.succeeded", {"id": "pi_123"})
+        self.assertStock(3)
+
+        self.apply_event("evt_2", "charge.refunded", {"id": "ch_1", "payment_intent": "pi_123"})
+        self.assertStock(5)
+        self.assertEqual(StockReservation.objects.get(order=self.order).status, "Released")
+
+        self.apply_event("evt_3", "charge.refunded", {"id": "ch_1", "payment_intent": "pi_123"})  # Another partial refund
+        self.assertStock(5)
+        self.assertEqual(Payment.objects.get().status, "Refunded")
+
+    def test_refund_of_an_order_canceled_before_payment_keeps_stock(self):
+        release_expired_reservations(now=timezone.now() + timedelta(days=1))
+        self.assertStock(5)
+        self.apply_event("evt_1", "payment_intent.succeeded", {"id": "pi_123"})  # A refund is required
+
+        self.apply_event("evt_2", "charge.refunded", {"id": "ch_1", "payment_intent": "pi_123"})
+        self.assertStock(5)
+        self.assertEqual(Payment.objects.get().status, "Refunded")
+
+
+@override_settings(INVOICE_RENDER_WORKERS=0, MEDIA_ROOT=tempfile.mkdtemp())
+class InvoiceTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        self.order = Order.objects.create(user=self.user, total_amount=Decimal("20.00"))
+        self.payment = Payment.objects.create(order=self.order, stripe_payment_intent="pi_123", amount=Decimal("20.00"), status="Completed")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_invoice_images_are_rendered_in_memory(self):
+        qr_code, barcode_image = invoice_images(self.order.id)
+        self.assertTrue(qr_code.startswith("data:image/png;base64,"))
+        self.assertTrue(barcode_image.startswith("data:image/png;base64,"))
+
+    @mock.patch("payments.invoices.render_invoice", return_value=b"%PDF-1.4 invoice")
+    def test_downloads_are_served_from_the_invoice_cache(self, render_invoice):
+        url = reverse("order-invoice", args=[self.order.id])
+        first = self.client.get(url)
+        second = self.client.get(url)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first["Content-Type"], "application/pdf")
+        self.assertEqual(second.content, b"%PDF-1.4 invoice")
+        render_invoice.assert_called_once()
+
+    @mock.patch("payments.invoices.render_invoice", return_value=b"%PDF-1.4 invoice")
+    def test_concurrent_renders_store_one_file(self, render_invoice):
+        with override_settings(MEDIA_ROOT=tempfile.mkdtemp()):
+            self.client.get(reverse("order-invoice", args=[self.order.id]))
+            # Another worker that looked for the file (in get_invoice and _store) before it was stored
+            exists, missed = default_storage.exists, [False, False]
+            with mock.patch.object(default_storage, "exists", side_effect=lambda name: missed.pop() if missed else exists(name)):
+                self.client.get(reverse("order-invoice", args=[self.order.id]))
+
+            self.assertEqual(len(default_storage.listdir("invoices")[1]), 1)
+
+    def test_other_customers_cannot_download_the_invoice(self):
+        other = User.objects.create_user(email="other@example.com", username="other", password="pass12345")
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(reverse("order-invoice", args=[self.order.id])).status_code, 404)
+
+
+@override_settings(INVOICE_RENDER_WORKERS=0, MEDIA_ROOT=tempfile.mkdtemp())
+@mock.patch("payments.invoices.render_invoice", return_value=b"%PDF-1.4 invoice")
+class OutboundEmailTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        order = Order.objects.create(user=user, total_amount=Decimal("20.00"))
+        self.payment = Payment.objects.create(order=order, stripe_payment_intent="pi_123", amount=Decimal("20.00"))
+
+    def test_queued_emails_are_sent_with_their_invoice(self, render_invoice):
+        send_payment_email(self.payment.order, self.payment)
+        send_payment_email(self.payment.order, self.payment, failure=True)
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(send_queued_emails(), 2)
+        self.assertEqual(send_queued_emails(), 0)
+
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[0].attachments[0][0], f"Invoice_{self.payment.order.id}.pdf")
+        self.assertEqual(mail.outbox[1].attachments, [])
+        self.assertEqual(OutboundEmail.objects.filter(status="Sent").count(), 2)
+
+    def test_failed_delivery_is_retried_later(self, render_invoice):
+        email = send_payment_email(self.payment.order, self.payment, refund=True)
+
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.send_messages", side_effect=OSError("SMTP down")):
+            self.assertEqual(send_queued_emails(), 0)
+
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts, email.last_error), ("Pending", 1, "SMTP down"))
+        self.assertGreater(email.next_attempt_at, email.created_at)
+        self.assertEqual(send_queued_emails(), 0)  # Not due yet
+
+    def test_emails_left_sending_by_a_crashed_sender_are_recovered(self, render_invoice):
+        stale = send_payment_email(self.payment.order, self.payment, failure=True)
+        in_flight = send_payment_email(self.payment.order, self.payment, failure=True)
+        OutboundEmail.objects.filter(pk=stale.pk).update(status="Sending", claimed_at=timezone.now() - timedelta(seconds=settings.EMAIL_SENDING_TIMEOUT))
+        OutboundEmail.objects.filter(pk=in_flight.pk).update(status="Sending", claimed_at=timezone.now())
+
+        self.assertEqual(send_queued_emails(), 1)
+        stale.refresh_from_db()
+        in_flight.refresh_from_db()
+        self.assertEqual((stale.status, stale.attempts), ("Sent", 2))  # The lost attempt counts
+        self.assertEqual(in_flight.status, "Sending")
+
+
+class MpesaStubHandler(BaseHTTPRequestHandler):
+    """Minimal stand-in for the M-Pesa OAuth, STK push and STK query endpoints."""
+    token_requests = 0
+    query_result_code = "0"
+
+    def send_json(self, status_code, data):
+        body = json.dumps(data).encode()
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        MpesaStubHandler.token_requests += 1
+        self.send_json(200, {"access_token": "fresh-token", "expires_in": "3599"})
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.headers["Authorization"] != "Bearer fresh-token":
+            return self.send_json(401, {"errorMessage": "Invalid Access Token"})
+        if self.path == "/mpesa/stkpushquery/v1/query":
+            return self.send_json(
+                200, {"CheckoutRequestID": payload["CheckoutRequestID"], "ResultCode": MpesaStubHandler.query_result_code, "ResultDesc": "Processed"}
+            )
+        self.send_json(200, {"CheckoutRequestID": "ws_CO_1", "MerchantRequestID": "mr_1", "ResponseCode": "0"})
+
+    def log_message(self, *args):
+        pass
+
+
+class MpesaStubTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        server = ThreadingHTTPServer(("127.0.0.1", 0), MpesaStubHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        cls.addClassCleanup(server.shutdown)
+        # Callbacks are posted without a token unless a test sets one
+        cls.enterClassContext(override_settings(MPESA_BASE_URL=f"http://127.0.0.1:{server.server_port}", MPESA_CALLBACK_TOKEN=""))
+
+    def setUp(self):
+        cache.clear()
+        MpesaStubHandler.token_requests = 0
+        MpesaStubHandler.query_result_code = "0"
+
+
+class MpesaClientTests(MpesaStubTestCase):
+    def test_access_token_is_cached_across_pushes(self):
+        for _ in range(3):
+            self.assertEqual(MpesaAPI.initiate_stk_push("254700000000", 10)["CheckoutRequestID"], "ws_CO_1")
+        self.assertEqual(MpesaStubHandler.token_requests, 1)
+
+    def test_revoked_token_is_refreshed_once(self):
+        cache.set("mpesa:access_token", "stale-token")
+        self.assertEqual(MpesaAPI.initiate_stk_push("254700000000", 10)["CheckoutRequestID"], "ws_CO_1")
+        self.assertEqual(MpesaStubHandler.token_requests, 1)
+
+    def test_async_client_shares_one_token_fetch(self):
+        async def push_many():
+            try:
+                return await asyncio.gather(*[AsyncMpesaAPI.initiate_stk_push("254700000000", 10) for _ in range(5)])
+            finally:
+                await AsyncMpesaAPI.aclose()
+
+        responses = asyncio.run(push_many())
+        self.assertEqual({response["CheckoutRequestID"] for response in responses}, {"ws_CO_1"})
+        self.assertEqual(MpesaStubHandler.token_requests, 1)
+
+
+class MpesaCallbackTests(MpesaStubTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        self.order = Order.objects.create(user=self.user, total_amount=Decimal("19.50"))
+
+    def push(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client.post(reverse("mpesa-pay"), {"order": self.order.id, "phone_number": "+254700000000"}, format="json")
+
+    def post_callback(self, result_code=0, checkout_request_id="ws_CO_1", amount=20, query=""):
+        result = {"MerchantRequestID": "mr_1", "CheckoutRequestID": checkout_request_id, "ResultCode": result_code, "ResultDesc": "Done"}
+        if result_code == 0:
+            result["CallbackMetadata"] = {"Item": [{"Name": "Amount", "Value": amount}, {"Name": "MpesaReceiptNumber", "Value": "NLJ7RT61SV"}]}
+        return self.client.post(
+            reverse("mpesa-callback") + query, json.dumps({"Body": {"stkCallback": result}}), content_type="application/json"
+        )
+
+    def test_push_records_the_transaction_of_the_order_payment(self):
+        response = self.push()
+
+        self.assertEqual(response.status_code, 200)
+        mpesa_transaction = MpesaTransaction.objects.select_related("payment").get()
+        self.assertEqual(mpesa_transaction.checkout_request_id, "ws_CO_1")
+        self.assertEqual(mpesa_transaction.amount, 20)  # Rounded up to a whole amount
+        self.assertEqual(mpesa_transaction.payment.order, self.order)
+        self.assertEqual(AsyncMpesaAPI._clients, {})  # The view's event loop ended with the request, and so did its client
+
+    async def test_push_and_callback_through_asgi(self):
+        token = RefreshToken.for_user(self.user).access_token
+        try:
+            unauthenticated = await self.async_client.post(reverse("mpesa-pay"), {"order": self.order.id, "phone_number": "254700000000"}, content_type="application/json")
+            response = await self.async_client.post(
+                reverse("mpesa-pay"), {"order": self.order.id, "phone_number": "254700000000"},
+                content_type="application/json", headers={"Authorization": f"Bearer {token}"},
+            )
+        finally:
+            await AsyncMpesaAPI.aclose()
+        self.assertEqual(unauthenticated.status_code, 401)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("ws_CO_1", response.content.decode())  # Only M-Pesa and the server know the CheckoutRequestID
+        self.assertEqual(await MpesaTransaction.objects.filter(payment__order=self.order).acount(), 1)
+
+        result = {"MerchantRequestID": "mr_1", "CheckoutRequestID": "ws_CO_1", "ResultCode": 1032, "ResultDesc": "Cancelled"}
+        callback = await self.async_client.post(reverse("mpesa-callback"), {"Body": {"stkCallback": result}}, content_type="application/json")
+        self.assertEqual(callback.json(), {"ResultCode": 0, "ResultDesc": "Accepted"})
+        self.assertTrue(await WebhookEvent.objects.filter(source="mpesa", event_id="ws_CO_1").aexists())
+
+    def test_callbacks_are_stored_once_and_reconciled_in_batches(self):
+        self.push()
+        self.assertEqual(self.post_callback().json(), {"ResultCode": 0, "ResultDesc": "Accepted"})
+        self.post_callback()
+        self.assertEqual(WebhookEvent.objects.filter(source="mpesa").count(), 1)
+
+        self.assertEqual(reconcile_callbacks(), 1)
+        self.assertEqual(reconcile_callbacks(), 0)
+
+        mpesa_transaction = MpesaTransaction.objects.select_related("payment__order").get()
+        self.assertEqual((mpesa_transaction.status, mpesa_transaction.receipt_number), ("Completed", "NLJ7RT61SV"))
+        self.assertEqual(mpesa_transaction.payment.status, "Completed")
+        self.assertEqual(mpesa_transaction.payment.order.status, "Completed")
+
+    def test_cancelled_push_fails_the_payment(self):
+        self.push()
+        self.post_callback(result_code=1032)
+
+        self.assertEqual(reconcile_callbacks(), 1)
+        self.assertEqual(Payment.objects.get().status, "Failed")
+        self.assertEqual(OutboundEmail.objects.count(), 1)
+
+    def test_forged_success_is_checked_with_an_stk_query(self):
+        self.push()
+        MpesaStubHandler.query_result_code = "1032"
+        self.post_callback()
+
+        self.assertEqual(reconcile_callbacks(), 1)
+        mpesa_transaction = MpesaTransaction.objects.select_related("payment__order").get()
+        self.assertEqual((mpesa_transaction.status, mpesa_transaction.receipt_number), ("Failed", ""))
+        self.assertEqual(mpesa_transaction.payment.status, "Failed")
+        self.assertEqual(mpesa_transaction.payment.order.status, "Pending")
+
+    @override_settings(WEBHOOK_RETRY_BACKOFF=0)
+    def test_callback_for_another_amount_does_not_complete_the_payment(self):
+        self.push()
+        self.post_callback(amount=1)
+
+        for _ in range(settings.WEBHOOK_MAX_ATTEMPTS):
+            reconcile_callbacks()
+        self.assertEqual(WebhookEvent.objects.get(source="mpesa").status, "Failed")
+        self.assertEqual(MpesaTransaction.objects.get().status, "Pending")
+        self.assertEqual(Payment.objects.get().status, "Pending")
+
+    @override_settings(MPESA_CALLBACK_TOKEN="s3cret")
+    def test_callbacks_without_the_token_are_rejected(self):
+        self.assertEqual(MpesaAPI.get_callback_url(), settings.MPESA_CALLBACK_URL + "?token=s3cret")
+        self.push()
+
+        self.assertEqual(self.post_callback().status_code, 403)
+        self.assertEqual(self.post_callback(query="?token=guess").status_code, 403)
+        self.assertFalse(WebhookEvent.objects.filter(source="mpesa").exists())
+        self.assertEqual(self.post_callback(query="?token=s3cret").status_code, 200)
+        self.assertEqual(reconcile_callbacks(), 1)
+        self.assertEqual(Payment.objects.get().status, "Completed")
+
+    def test_lost_callbacks_are_recovered_with_an_stk_query(self):
+        self.push()
+        self.assertEqual(sweep_lost_callbacks(), 0)  # Too early, the callback may still arrive
+
+        MpesaTransaction.objects.update(updated=timezone.now() - timedelta(seconds=settings.MPESA_QUERY_AFTER))
+        self.assertEqual(sweep_lost_callbacks(), 1)
+        self.assertEqual(reconcile_callbacks(), 1)
+        self.assertEqual(Payment.objects.get().status, "Completed")
+
+        self.post_callback()  # A late callback is ignored
+        self.assertEqual(reconcile_callbacks(), 0)
+
+
+class QueryPlanTests(TestCase):
+    def test_payment_lookup_by_payment_intent(self):
+        self.assertEqual(unindexed_steps(Payment.objects.select_related("order").filter(stripe_payment_intent="pi_123")), [])
@@ -1,10 +1,13 @@
 from django.urls import path
 from . import views
 from .webhooks import stripe_webhook
+from .mpesa_callbacks import mpesa_callback
 
 urlpatterns = [
     path("payments/", views.PaymentListCreateView.as_view(), name="payment-list"),
     path("payments/<int:pk>/", views.PaymentDetailView.as_view(), name="payment-detail"),
     path("webhook/", stripe_webhook, name="stripe-webhook"),
-    path("mpesa-pay/", views.MpesaPaymentView.as_view(), name="mpesa-pay"),
+    path("mpesa-pay/", views.mpesa_pay, name="mpesa-pay"),
+    path("payments/mpesa-callback/", mpesa_callback, name="mpesa-callback"),
+    path("orders/<int:pk>/invoice/", views.InvoiceDownloadView.as_view(), name="order-invoice"),
 ]
\ No newline at end of file
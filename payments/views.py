@@ -1,12 +1,20 @@
 import stripe
+from asgiref.sync import sync_to_async
+from decimal import ROUND_CEILING
 from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import require_POST
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from orders.models import Order
-from .models import Payment
+from .models import Payment, MpesaTransaction
 from .serializers import PaymentSerializer
-from .mpesa_service import MpesaAPI
+from .mpesa_service import AsyncMpesaAPI
+from .invoices import get_invoice
+from utils.async_api import async_api_view, release_connections
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
@@ -34,51 +42,90 @@ class PaymentDetailView(generics.RetrieveUpdateAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
 
-class MpesaPaymentView(APIView):
+@require_POST
+@async_api_view
+async def mpesa_pay(request, api_request):
     """
     Endpoint to initiate an Mpesa payment via STK Push.
     Expects a POST request with:
+      - order: The pending order to pay for.
       - phone_number: The mobile number to be charged.
-      - amount: The amount to be charged.
 
-    This view calls MpesaAPI.initiate_stk_push() (from mpesa-service.py) to start the payment process.
+    This view calls AsyncMpesaAPI.initiate_stk_push() (from mpesa_service.py) to start the payment process
+    and records the push, so the callback at payments/mpesa-callback/ can be matched to the order's payment.
+    It is async, so under ASGI a request waiting on M-Pesa holds neither a worker thread nor a pooled connection.
     """
-    permission_classes = [permissions.IsAuthenticated]
+    phone_number = api_request.data.get("phone_number")
+    order_id = api_request.data.get("order")
 
-    def post(self, request):
-        phone_number = request.data.get("phone_number")
-        amount = request.data.get("amount")
-
-        if not phone_number or not amount:
-            return Response ({"error": "Phone number and amount are required"}, status=status.HTTP_400_BAD_REQUEST)
-
-        if phone_number.startswith("+"):
-            phone_number = phone_number[1:]
-
-        try:
-            amount_value = int(amount)
-        except ValueError:
-            return Response({"error": "Invalid amount. Amount must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Call the MpesaAPI service to initiate an STK push.
-        mpesa_response = MpesaAPI.initiate_stk_push(
+    if not phone_number or not order_id:
+        return JsonResponse({"error": "Phone number and order are required"}, status=status.HTTP_400_BAD_REQUEST)
+
+    if phone_number.startswith("+"):
+        phone_number = phone_number[1:]
+
+    try:
+        order = await Order.objects.aget(pk=int(order_id), user=api_request.user, status="Pending")
+    except (ValueError, TypeError, Order.DoesNotExist):
+        return JsonResponse({"error": "Invalid order. Only your pending orders can be paid."}, status=status.HTTP_400_BAD_REQUEST)
+
+    # M-Pesa only charges whole amounts
+    amount_value = int(order.total_amount.to_integral_value(rounding=ROUND_CEILING))
+
+    # Call the M-Pesa API to initiate an STK push.
+    await sync_to_async(release_connections)()
+    try:
+        mpesa_response = await AsyncMpesaAPI.initiate_stk_push(
             phone_number=phone_number,
             amount=amount_value,
-            account_reference="OrderPayment",      # Customize as needed
+            account_reference=f"Order{order.id}",
             transaction_desc="Payment for order"     # Customize as needed
         )
+    finally:
+        if not isinstance(request, ASGIRequest):
+            # Under WSGI the view runs in an event loop of its own, which ends with this request
+            await AsyncMpesaAPI.aclose()
+
+    if "error" in mpesa_response:
+        return JsonResponse({"error": mpesa_response["error"]}, status=status.HTTP_400_BAD_REQUEST)
+
+    payment, _ = await Payment.objects.aget_or_create(order=order, defaults={"amount": order.total_amount})
+    if payment.status == "Failed":
+        await Payment.objects.filter(pk=payment.pk).aupdate(status="Pending")  # Retried with a new push
+    await MpesaTransaction.objects.acreate(
+        payment=payment,
+        checkout_request_id=mpesa_response["CheckoutRequestID"],
+        merchant_request_id=mpesa_response.get("MerchantRequestID", ""),
+        phone_number=phone_number,
+        amount=amount_value,
+    )
+
+    response_data = {
+        "message": "Mpesa payment initiated successfully.",
+        "order": order.id,
+        "phone_number": phone_number,
+        "amount": amount_value,
+        "status": "pending"
+    }
+    return JsonResponse(response_data, status=status.HTTP_200_OK)
+
+
+class InvoiceDownloadView(APIView):
+    """
+    Download the PDF invoice of a paid order.
+    Invoices are served from the invoice cache and only rendered on a cache miss.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
+        payments = Payment.objects.select_related("order__user")
+        if not request.user.is_staff:
+            payments = payments.filter(order__user=request.user)
+        payment = get_object_or_404(payments, order_id=pk, status="Completed")
 
-        if "error" in mpesa_response:
-            return Response(mpesa_response, status=status.HTTP_400_BAD_REQUEST)
-
-        response_data = {
-            "message": "Mpesa payment initiated successfully.",
-            "phone_number": phone_number,
-            "amount": amount_value,
-            "transaction_response": mpesa_response,
-            "status": "pending"
-        }
-        return Response(response_data, status=status.HTTP_200_OK)
+        response = HttpResponse(get_invoice(payment.order, payment), content_type="application/pdf")
+        response["Content-Disposition"] = f'attachment; filename="Invoice_{pk}.pdf"'
+        return response
 
 
 class WebhookView(APIView):
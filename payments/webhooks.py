@@ -1,13 +1,19 @@
+import json
 import stripe
 import logging
+from collections import defaultdict
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 from django.http import JsonResponse
 from rest_framework import status
 from orders.models import Order
-from .models import Payment
+from orders.reservations import release_committed_reservations
+from django.db import transaction
+from .models import Payment, WebhookEvent
+from .signals import payment_refunded
 from .utils import send_payment_email
-from products.models import StockLog
+from .invoices import schedule_invoice
+from products.models import Product
 
 
 logger = logging.getLogger(__name__)
@@ -15,8 +21,14 @@ logger = logging.getLogger(__name__)
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
 @csrf_exempt
-def stripe_webhook(request):
-    """Handles incoming Stripe webhook events."""
+async def stripe_webhook(request):
+    """
+    Verifies incoming Stripe webhook events and stores them in the WebhookEvent inbox.
+
+    Events are acknowledged as soon as they are stored; the process_webhook_events
+    command applies them. A redelivered event is ignored by the unique event id.
+    The view is async, so under ASGI acknowledging an event needs no worker thread.
+    """
 
     payload = request.body
     sig_header = request.headers.get("Stripe-Signature")
@@ -36,76 +48,86 @@ def stripe_webhook(request):
         logger.error("Invalid webhook payload")
         return JsonResponse({"error": "Invalid webhook payload"}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Handle specific Stripe events
-    if event["type"] == "payment_intent.succeeded":
-        handle_payment_success(event["data"]["object"])
-    elif event["type"] == "payment_intent.payment_failed":
-        handle_payment_failure(event["data"]["object"])
-    elif event["type"] == "charge.refunded":
-        handle_refund(event["data"]["object"])
+    # Only keep the events we act on
+    if event["type"] in EVENT_HANDLERS:
+        await WebhookEvent.objects.abulk_create(
+            [WebhookEvent(source="stripe", event_id=event["id"], event_type=event["type"], payload=json.loads(payload))],
+            ignore_conflicts=True,
+        )
 
     return JsonResponse({"status": "success"}, status=status.HTTP_200_OK)
     
 
-def handle_payment_success(payment_intent):
-    """Marks a payment as successful , updates stock, and sends an invoice."""
-    payment = Payment.objects.filter(stripe_payment_intent=payment_intent["id"]).first()
-    if payment:
-        payment.status = "Completed"
-        payment.save()
+def complete_payment(payment, reference):
+    """Marks a payment as successful, commits the order's reserved stock, and sends an invoice."""
+    order = payment.order
+    if order.status == "Canceled":
+        # The stock reservation expired before the customer paid; the stock is back on sale.
+        Payment.objects.filter(pk=payment.pk).update(status="Completed")
+        logger.error(f"Payment {reference} succeeded for canceled Order {order.id}. A refund is required.")
+        return
 
-        order = payment.order
-        if order:
-            order.status = "completed"
-            order.product.stock -= order.quantity   # Reduce stock
-            order.product.save()
-            order.save()
+    payment.status = "Completed"
+    payment.save()  # Completes the order, which commits its stock reservations.
+
+    logger.info(f"Order {order.id} paid. Reserved stock committed.")
 
-            # Log stock update
-            StockLog.objects.create(
-                product=order.product,
-                change_type="Payment Success",
-                quantity_changed=-order.quantity,
-                new_stock_level=order.product.stock
-            )
+    # Render the invoice in the background pool; the email sender picks it up from the cache.
+    transaction.on_commit(lambda: schedule_invoice(order, payment))
+    send_payment_email(payment.order, payment)  # Queued with the rest of this transaction
 
-            logger.info(f"Stock updated: {order.product.name} reduced by {order.quantity}. New stock: {order.product.stock}")
 
-        send_payment_email(payment.order, payment)
+def fail_payment(payment, reference):
+    """Marks a payment as failed and sends an email notification."""
+    payment.status = "Failed"
+    payment.save()
+    send_payment_email(payment.order, payment, failure=True)
+    logger.warning(f"Payment failed for Order {payment.order.id}. Reference: {reference}")
+
+
+def handle_payment_success(payment_intent):
+    """Completes the payment of a succeeded Stripe PaymentIntent."""
+    payment = Payment.objects.select_related("order").filter(stripe_payment_intent=payment_intent["id"]).first()
+    if payment:
+        complete_payment(payment, payment_intent["id"])
 
 
 def handle_payment_failure(payment_intent):
-    """Marks a payment as failed and sends an email notification."""
-    payment = Payment.objects.filter(stripe_payment_intent=payment_intent["id"]).first()
+    """Fails the payment of a failed Stripe PaymentIntent."""
+    payment = Payment.objects.select_related("order").filter(stripe_payment_intent=payment_intent["id"]).first()
     if payment:
-        payment.status = "Failed"
-        payment.save()
-        send_payment_email(payment.order, payment, failure=True)
-        logger.warning(f"Payment failed for Order {payment.order.id}. Payment Intent: {payment_intent['id']}")
+        fail_payment(payment, payment_intent["id"])
 
 
 def handle_refund(charge):
-    """Marks a payment as refunded restores stock, and sends an email."""
-    payment = Payment.objects.filter(stripe_payment_intent=charge["payment_intent"]).first()
+    """Marks a payment as refunded, returns the stock its order still holds, and sends an email."""
+    payment = Payment.objects.select_related("order").filter(stripe_payment_intent=charge["payment_intent"]).first()
     if payment:
+        was_refunded = payment.status == "Refunded"
         payment.status = "Refunded"
         payment.save()
+        if not was_refunded:
+            payment_refunded.send(sender=Payment, payment=payment)
 
+        # Only completed orders still hold their stock: canceled ones (including those
+        # whose reservation expired before the payment arrived) already gave it back.
         order = payment.order
-        if order:
-            order.status = "refunded"
-            order.product.stock += order.quantity  # Restore stock
-            order.product.save()
-            order.save()
-
-             # Log stock restoration
-            StockLog.objects.create(
-                product=order.product,
-                change_type="Refund",
-                quantity_changed=order.quantity,
-                new_stock_level=order.product.stock
-            )
-            
-            logger.info(f"Stock restored: {order.product.name} increased by {order.quantity}. New stock: {order.product.stock}")
+        if order and not was_refunded and order.status == "Completed":
+            # Orders placed before stock reservations existed have no holds to release.
+            if not release_committed_reservations(order):
+                quantities = defaultdict(int)
+                for product_id, quantity in order.items.values_list("product_id", "quantity"):
+                    quantities[product_id] += quantity
+                Product.objects.restore_stock(dict(quantities), change_type="Refund")  # Logged through the stock audit
+
+            logger.info(f"Stock restored for refunded Order {order.id}")
 
         send_payment_email(payment.order, payment, refund=True)
+
+
+# Stripe event type -> handler receiving the event's data object
+EVENT_HANDLERS = {
+    "payment_intent.succeeded": handle_payment_success,
+    "payment_intent.payment_failed": handle_payment_failure,
+    "charge.refunded": handle_refund,
+}
@@ -1,15 +1,41 @@
 from django.contrib import admin
 from markdownx.admin import MarkdownxModelAdmin
-from .models import StockLog, Product
+from .models import StockLog, Product, StockShard
+from .inventory import enable_sharding, disable_sharding
+
+
+class StockShardInline(admin.TabularInline):
+    model = StockShard
+    extra = 0
+    can_delete = False
+    readonly_fields = ("index", "stock")
 
 
 @admin.register(Product)
 class ProductAdmin(MarkdownxModelAdmin):  
-    list_display = ("id", "name", "price", "stock", "category")
-    search_fields = ("name", "category__name") 
+    list_display = ("id", "sku", "name", "price", "stock", "stock_shard_count", "category")
+    search_fields = ("sku", "name", "category__name") 
     list_filter = ()
     ordering = ("-id",)
-    readonly_fields = ()
+    readonly_fields = ("stock_shard_count",)
+    inlines = [StockShardInline]
+    actions = ["enable_stock_sharding", "disable_stock_sharding"]
+
+    def get_readonly_fields(self, request, obj=None):
+        # Stock of a sharded product is an aggregate of its shards, don't edit it directly.
+        if obj and obj.is_sharded:
+            return self.readonly_fields + ("stock",)
+        return self.readonly_fields
+
+    @admin.action(description="Split stock across shards (for hot products)")
+    def enable_stock_sharding(self, request, queryset):
+        for product in queryset:
+            enable_sharding(product)
+
+    @admin.action(description="Fold stock shards back into the product")
+    def disable_stock_sharding(self, request, queryset):
+        for product in queryset:
+            disable_sharding(product)
 
 
 @admin.register(StockLog)
@@ -17,4 +43,4 @@ class StockLogAdmin(admin.ModelAdmin):
     list_display = ("id", "product", "change_type", "quantity_changed", "new_stock_level", "timestamp")
     list_filter = ("change_type", "timestamp")
     search_fields = ("product__name", "change_type")
-    ordering = ("-timestamp",)  
+    ordering = ("-timestamp",)
@@ -0,0 +1,111 @@
+"""
+Catalog response cache.
+
+Catalog reads (product and category listings) are served as pre-rendered JSON
+bytes. Entries are keyed by a catalog version that every Product/Category
+write and stock change replaces once its transaction commits, so stale entries
+are never read again and simply expire.
+
+Entries are kept in two tiers: a small in-process dict in front of the cache
+named by settings.CATALOG_CACHE_ALIAS (shared between workers when that cache
+is Redis or memcached). The version itself only lives in the shared cache,
+and starts with the time it was created, so a cache miss right after a write
+can be filled from the primary rather than a replica that may not have it yet.
+"""
+import hashlib
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+VERSION_KEY = "catalog:version"
+
+_local = {"version": None, "entries": {}}
+_local_lock = threading.Lock()
+
+
+def shared_cache():
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def new_version():
+    return f"{time.time():.3f}:{uuid.uuid4().hex}"
+
+
+def version_age(version):
+    """Seconds since `version` was created (infinite for versions without a timestamp)."""
+    try:
+        return time.time() - float(version.split(":", 1)[0])
+    except ValueError:
+        return float("inf")
+
+
+def get_version():
+    """Current catalog version, starting a new one if the shared cache lost it."""
+    version = shared_cache().get(VERSION_KEY)
+    if version is None:
+        shared_cache().add(VERSION_KEY, new_version(), None)
+        version = shared_cache().get(VERSION_KEY)
+    return version
+
+
+async def aget_version():
+    version = await shared_cache().aget(VERSION_KEY)
+    if version is None:
+        await shared_cache().aadd(VERSION_KEY, new_version(), None)
+        version = await shared_cache().aget(VERSION_KEY)
+    return version
+
+
+def invalidate():
+    """Start a new catalog version; every cached response becomes unreachable."""
+    shared_cache().set(VERSION_KEY, new_version(), None)
+
+
+def invalidate_on_commit():
+    """Invalidate once the current transaction commits, so no reader caches the old rows under the new version."""
+    transaction.on_commit(invalidate)
+
+
+def entry_key(version, key):
+    return f"catalog:{version}:{hashlib.sha256(key.encode()).hexdigest()}"
+
+
+def lookup(version, key):
+    """Return the cached (etag, body) for `key` at `version`, or None."""
+    with _local_lock:
+        if _local["version"] == version and key in _local["entries"]:
+            return _local["entries"][key]
+
+    entry = shared_cache().get(entry_key(version, key))
+    if entry is not None:
+        _remember(version, key, entry)
+    return entry
+
+
+async def alookup(version, key):
+    with _local_lock:
+        if _local["version"] == version and key in _local["entries"]:
+            return _local["entries"][key]
+
+    entry = await shared_cache().aget(entry_key(version, key))
+    if entry is not None:
+        _remember(version, key, entry)
+    return entry
+
+
+def store(version, key, body):
+    """Cache rendered `body` bytes for `key` at `version`. Returns the stored (etag, body)."""
+    entry = (f'"{hashlib.sha256(body).hexdigest()[:32]}"', body)
+    shared_cache().set(entry_key(version, key), entry, settings.CATALOG_CACHE_TIMEOUT)
+    _remember(version, key, entry)
+    return entry
+
+
+def _remember(version, key, entry):
+    with _local_lock:
+        if _local["version"] != version or len(_local["entries"]) >= settings.CATALOG_LOCAL_CACHE_SIZE:
+            _local["version"], _local["entries"] = version, {}
+        _local["entries"][key] = entry
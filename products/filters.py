@@ -19,4 +19,6 @@ class StockLogFilter(django_filters.FilterSet):
 # http://localhost:8000/products/stock-logs/?change_type=Stock%20Added
 # http://localhost:8000/products/stock-logs/?date_from=2025-02-20&date_to=2025-02-20
 # http://localhost:8000/products/stock-logs/?change_type=Stock%20Added&date_from=2025-02-20&date_to=2025-02-20
+# http://localhost:8000/products/stock-logs/export/csv/?product=1
+# http://localhost:8000/products/stock-logs/export/ndjson/?start_date=2025-02-20T00:00
 # 
@@ -0,0 +1,148 @@
+"""
+Bulk product import.
+
+Rows are read lazily from CSV or NDJSON, validated and upserted by SKU in
+chunks of settings.PRODUCT_IMPORT_CHUNK_SIZE. Each chunk costs a handful of
+queries whatever its size: missing categories are created in one insert,
+existing products are read once, products are written with a single
+INSERT ... ON CONFLICT (sku) DO UPDATE, and their stock changes go to the
+stock audit in bulk. Invalid rows are reported by row number and skipped;
+the rest of the chunk is still imported.
+
+Bulk upserts skip Product.save() and model signals, so what they do on save
+(description rendering, stock audit, search indexing and catalog cache
+invalidation) is done here per chunk.
+"""
+import csv
+import io
+import json
+from itertools import islice
+from django.conf import settings
+from django.db import transaction
+from markdownx.utils import markdownify
+
+from .models import Category, Product
+from .serializers import ProductImportSerializer
+from . import catalog_cache, search, stock_audit
+
+FORMATS = ("csv", "ndjson")
+UPDATE_FIELDS = ["name", "description", "description_html", "category", "price", "stock"]
+
+
+def read_rows(file, file_format):
+    """Yield (row number, row dict or None if unreadable) from a binary CSV or NDJSON file."""
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    if file_format == "csv":
+        for row_number, row in enumerate(csv.DictReader(text), start=1):
+            yield row_number, row
+        return
+
+    for row_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield row_number, row if isinstance(row, dict) else None
+
+
+def import_products(rows, chunk_size=None, max_errors=None):
+    """
+    Import (row number, row) pairs as produced by read_rows().
+
+    Returns {"created", "updated", "failed", "errors"}, where errors lists
+    {"row", "errors"} for up to `max_errors` failed rows (all if None).
+    """
+    chunk_size = chunk_size or settings.PRODUCT_IMPORT_CHUNK_SIZE
+    report = {"created": 0, "updated": 0, "failed": 0, "errors": []}
+    categories = {}  # lowercase name -> id, shared by all chunks
+
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        _import_chunk(chunk, categories, report, max_errors)
+    return report
+
+
+def _fail(report, row_number, errors, max_errors):
+    report["failed"] += 1
+    if max_errors is None or len(report["errors"]) < max_errors:
+        report["errors"].append({"row": row_number, "errors": errors})
+
+
+def _import_chunk(chunk, categories, report, max_errors):
+    valid = {}  # sku -> (row number, validated data); a repeated SKU keeps its last row
+    for row_number, row in chunk:
+        if row is None:
+            _fail(report, row_number, {"detail": ["Unreadable row."]}, max_errors)
+            continue
+        serializer = ProductImportSerializer(data=row)
+        if serializer.is_valid():
+            valid[serializer.validated_data["sku"]] = (row_number, serializer.validated_data)
+        else:
+            _fail(report, row_number, serializer.errors, max_errors)
+    if not valid:
+        return
+
+    _create_categories({data["category"] for _, data in valid.values()}, categories)
+
+    existing = {
+        product["sku"]: product
+        for product in Product.objects.filter(sku__in=valid.keys())
+        .values("sku", "id", "stock", "description", "description_html", "stock_shard_count")
+    }
+
+    products = []
+    for sku, (row_number, data) in valid.items():
+        current = existing.get(sku)
+        if current and current["stock_shard_count"] and current["stock"] != data["stock"]:
+            _fail(report, row_number, {"stock": ["Stock of a sharded product is managed by its stock shards."]}, max_errors)
+            continue
+        if current and current["description"] == data["description"] and current["description_html"]:
+            description_html = current["description_html"]
+        else:
+            description_html = markdownify(data["description"])
+        products.append(Product(
+            sku=sku,
+            name=data["name"],
+            description=data["description"],
+            description_html=description_html,
+            category_id=categories[data["category"]],
+            price=data["price"],
+            stock=data["stock"],
+        ))
+    if not products:
+        return
+
+    with transaction.atomic():
+        Product.objects.bulk_create(products, update_conflicts=True, unique_fields=["sku"], update_fields=UPDATE_FIELDS)
+        ids = dict(Product.objects.filter(sku__in=[product.sku for product in products]).values_list("sku", "id"))
+
+        created, changes, stock_levels = {}, {}, {}
+        for product in products:
+            product_id, current = ids[product.sku], existing.get(product.sku)
+            if current is None:
+                created[product_id] = product.stock
+            elif current["stock"] != product.stock:
+                changes[product_id] = product.stock - current["stock"]
+                stock_levels[product_id] = product.stock
+        stock_audit.record_many(created, change_type="Initial Stock", new_stock_levels=created)
+        stock_audit.record_many(changes, change_type="Product Import", new_stock_levels=stock_levels)
+
+        search.index_products(list(ids.values()))  # Part of the import's transaction, like products.signals
+        catalog_cache.invalidate_on_commit()
+
+    report["created"] += len(created)
+    report["updated"] += len(products) - len(created)
+
+
+def _create_categories(names, categories):
+    """Make sure every (lowercase) category name exists, with one insert for the missing ones."""
+    missing = names - categories.keys()
+    if not missing:
+        return
+    Category.objects.bulk_create([Category(name=name) for name in missing], ignore_conflicts=True)
+    categories.update(Category.objects.filter(name__in=missing).values_list("name", "id"))
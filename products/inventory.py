@@ -0,0 +1,176 @@
+"""
+Sharded inventory.
+
+A hot product can have its stock split across several StockShard rows. Buyers
+claim from a random shard, so concurrent checkouts of the same product lock
+different rows instead of queuing on Product.stock. Product.stock is then only
+an aggregate, refreshed in the background by `manage.py reconcile_stock`.
+
+Bulk stock adjustments (adjust_stock) work on sharded and unsharded products alike.
+"""
+import random
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import Product, StockShard
+from . import catalog_cache, stock_audit
+
+
+def enable_sharding(product, shard_count=None):
+    """Split the product's current stock evenly across `shard_count` shards."""
+    shard_count = shard_count or settings.STOCK_SHARD_COUNT
+
+    with transaction.atomic():
+        product = Product.objects.select_for_update().get(pk=product.pk)
+        if product.is_sharded:
+            return product
+
+        per_shard, remainder = divmod(product.stock, shard_count)
+        StockShard.objects.bulk_create([
+            StockShard(product=product, index=index, stock=per_shard + (1 if index < remainder else 0))
+            for index in range(shard_count)
+        ])
+        Product.objects.filter(pk=product.pk).update(stock_shard_count=shard_count)
+        product.stock_shard_count = shard_count
+    return product
+
+
+def disable_sharding(product):
+    """Fold the shards back into Product.stock and go back to single-row stock."""
+    with transaction.atomic():
+        product = Product.objects.select_for_update().get(pk=product.pk)
+        if not product.is_sharded:
+            return product
+
+        shards = StockShard.objects.select_for_update().filter(product=product)
+        total = shards.aggregate(total=Sum("stock"))["total"] or 0
+        shards.delete()
+        Product.objects.filter(pk=product.pk).update(stock=total, stock_shard_count=0)
+        catalog_cache.invalidate_on_commit()
+        product.stock, product.stock_shard_count = total, 0
+    return product
+
+
+def claim_stock(product_id, quantity, shard_count=None):
+    """
+    Deduct `quantity` from the product's shards.
+
+    The fast path is a single conditional UPDATE on one random shard. If that
+    shard can't cover the whole quantity, the claim is spread over the other
+    shards in random order. Returns False (with nothing deducted) if the shards
+    together don't hold enough stock.
+    """
+    if shard_count:
+        index = random.randrange(shard_count)
+        if StockShard.objects.filter(product_id=product_id, index=index, stock__gte=quantity).update(stock=F("stock") - quantity):
+            return True
+
+    with transaction.atomic():
+        shards = list(StockShard.objects.filter(product_id=product_id, stock__gt=0).values_list("id", "stock"))
+        random.shuffle(shards)
+
+        remaining = quantity
+        for shard_id, stock in shards:
+            take = min(stock, remaining)
+            if StockShard.objects.filter(id=shard_id, stock__gte=take).update(stock=F("stock") - take):
+                remaining -= take
+            if not remaining:
+                return True
+
+        transaction.set_rollback(True)
+    return False
+
+
+def release_stock(product_id, quantity, shard_count=None):
+    """Return `quantity` to one random shard of the product."""
+    shards = StockShard.objects.filter(product_id=product_id)
+    if shard_count:
+        shards = shards.filter(index=random.randrange(shard_count))
+    else:
+        shards = shards.filter(pk=Subquery(shards.order_by("?").values("pk")[:1]))
+    shards.update(stock=F("stock") + quantity)
+
+
+def reconcile_stock(product_ids=None):
+    """Refresh Product.stock from the sum of its shards. Returns the number of products updated."""
+    products = Product.objects.filter(stock_shard_count__gt=0)
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+
+    shard_total = (
+        StockShard.objects.filter(product=OuterRef("pk"))
+        .values("product")
+        .annotate(total=Sum("stock"))
+        .values("total")
+    )
+    updated = products.update(stock=Coalesce(Subquery(shard_total), Value(0)))
+    catalog_cache.invalidate_on_commit()
+    return updated
+
+
+def adjust_stock(deltas=None, levels=None, change_type="Stock Adjustment"):
+    """
+    Apply signed stock `deltas` and absolute stock `levels` ({product id: value},
+    disjoint) to many products at once, all or nothing.
+
+    Unsharded products are updated by a single UPDATE ... CASE; sharded ones can
+    only take deltas, claimed from or released to their shards. Returns
+    ({product id: new stock}, {}) on success, or ({}, {product id: error}) with
+    nothing changed.
+    """
+    deltas, levels = deltas or {}, levels or {}
+    product_ids = [*deltas, *levels]
+
+    with transaction.atomic():
+        current = {
+            product_id: (stock, shard_count)
+            for product_id, stock, shard_count in Product.objects.select_for_update()
+            .filter(id__in=product_ids).values_list("id", "stock", "stock_shard_count")
+        }
+
+        errors = {}
+        for product_id in product_ids:
+            if product_id not in current:
+                errors[product_id] = "Product not found."
+            elif product_id in levels and current[product_id][1]:
+                errors[product_id] = "Stock of a sharded product can only be adjusted by a delta."
+            elif product_id in deltas and not current[product_id][1] and current[product_id][0] + deltas[product_id] < 0:
+                errors[product_id] = f"Only {current[product_id][0]} items available in stock."
+        if errors:
+            return {}, errors
+
+        unsharded = [
+            *[When(id=product_id, then=F("stock") + delta) for product_id, delta in deltas.items() if not current[product_id][1]],
+            *[When(id=product_id, then=Value(level)) for product_id, level in levels.items()],
+        ]
+        sharded = {product_id: delta for product_id, delta in deltas.items() if current[product_id][1]}
+
+        try:
+            with transaction.atomic():
+                if unsharded:
+                    Product.objects.filter(id__in=product_ids).update(
+                        stock=Case(*unsharded, default=F("stock"), output_field=models.PositiveIntegerField())
+                    )
+        except IntegrityError:
+            # A concurrent change took the stock below zero between our read and the update.
+            return {}, {product_id: "Stock changed during the adjustment, try again." for product_id in deltas if deltas[product_id] < 0}
+
+        for product_id, delta in sharded.items():
+            if delta > 0:
+                release_stock(product_id, delta, current[product_id][1])
+            elif delta < 0 and not claim_stock(product_id, -delta, current[product_id][1]):
+                errors[product_id] = "Not enough stock left in the product's shards."
+        if errors:
+            transaction.set_rollback(True)
+            return {}, errors
+
+        if sharded:
+            reconcile_stock(sharded.keys())
+        new_levels = dict(Product.objects.filter(id__in=product_ids).values_list("id", "stock"))
+
+        changes = {**deltas, **{product_id: level - current[product_id][0] for product_id, level in levels.items()}}
+        stock_audit.record_many(changes, change_type=change_type, new_stock_levels=new_levels)
+        catalog_cache.invalidate_on_commit()
+    return new_levels, {}
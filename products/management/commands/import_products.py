@@ -0,0 +1,27 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+
+from products.importer import FORMATS, import_products, read_rows
+
+
+class Command(BaseCommand):
+    help = "Create or update products by SKU from a CSV or NDJSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV or NDJSON file with sku, name, description, category, price and stock.")
+        parser.add_argument("--format", choices=FORMATS, help="File format, guessed from the file name by default.")
+        parser.add_argument("--chunk-size", type=int, default=None, help="Rows validated and written per batch.")
+
+    def handle(self, *args, **options):
+        file_format = options["format"] or ("ndjson" if options["path"].endswith((".ndjson", ".jsonl")) else "csv")
+        try:
+            file = open(options["path"], "rb")
+        except OSError as e:
+            raise CommandError(str(e))
+
+        with file:
+            report = import_products(read_rows(file, file_format), chunk_size=options["chunk_size"])
+
+        for error in report["errors"]:
+            self.stderr.write(f"Row {error['row']}: {json.dumps(error['errors'])}")
+        self.stdout.write(f"Created {report['created']}, updated {report['updated']}, failed {report['failed']} product(s).")
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from products.models import Product
+from products.search import index_products
+
+
+class Command(BaseCommand):
+    help = "Re-index every product for full-text search."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Products indexed per batch.")
+
+    def handle(self, *args, **options):
+        ids = Product.objects.order_by("id").values_list("id", flat=True)
+        batch, indexed = [], 0
+        for product_id in ids.iterator(chunk_size=options["batch_size"]):
+            batch.append(product_id)
+            if len(batch) == options["batch_size"]:
+                index_products(batch)
+                indexed += len(batch)
+                batch = []
+        index_products(batch)
+        indexed += len(batch)
+        self.stdout.write(f"Indexed {indexed} product(s).")
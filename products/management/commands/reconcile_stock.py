@@ -0,0 +1,21 @@
+import time
+from django.core.management.base import BaseCommand
+
+from products.inventory import reconcile_stock
+
+
+class Command(BaseCommand):
+    help = "Refresh Product.stock for sharded products from the sum of their stock shards."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--product", type=int, action="append", dest="products", help="Only reconcile these product ids.")
+        parser.add_argument("--interval", type=float, default=0, help="Keep running, reconciling every N seconds.")
+
+    def handle(self, *args, **options):
+        while True:
+            updated = reconcile_stock(options["products"])
+            self.stdout.write(f"Reconciled stock for {updated} sharded product(s).")
+
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from markdownx.utils import markdownify
+
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = "Render product descriptions to HTML for products that don't have it yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Products rendered and saved per batch.")
+        parser.add_argument("--all", action="store_true", help="Re-render every product, e.g. after changing Markdown settings.")
+
+    def handle(self, *args, **options):
+        products = Product.objects.order_by("id").only("id", "description")
+        if not options["all"]:
+            products = products.filter(description_html="").exclude(description="")
+
+        last_id, rendered = 0, 0
+        while True:
+            batch = list(products.filter(id__gt=last_id)[:options["batch_size"]])
+            if not batch:
+                break
+            for product in batch:
+                product.description_html = markdownify(product.description)
+            Product.objects.bulk_update(batch, ["description_html"])
+            rendered += len(batch)
+            last_id = batch[-1].id
+
+        self.stdout.write(f"Rendered {rendered} product description(s).")
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.6 on 2026-10-18 10:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_stock_shards'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stocklog',
+            index=models.Index(fields=['-timestamp', '-id'], name='idx_stocklog_timestamp'),
+        ),
+        migrations.AddIndex(
+            model_name='stocklog',
+            index=models.Index(fields=['product', '-timestamp', '-id'], name='idx_stocklog_product_time'),
+        ),
+    ]
@@ -0,0 +1,77 @@
+import html
+
+from django.db import migrations
+from django.utils.html import strip_tags
+from markdownx.utils import markdownify
+
+# The search index as it was created here; products.search may change later.
+SQLITE_TABLE = "products_product_fts"
+POSTGRES_TABLE = "products_product_search"
+
+
+def plain_text(markdown):
+    return " ".join(html.unescape(strip_tags(markdownify(markdown or ""))).split())
+
+
+def write_documents(connection, rows):
+    documents = [(product_id, name, category or "", plain_text(description)) for product_id, name, description, category in rows]
+    if not documents:
+        return
+
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.executemany(f"INSERT INTO {SQLITE_TABLE} (rowid, name, category, description) VALUES (%s, %s, %s, %s)", documents)
+        elif connection.vendor == "postgresql":
+            cursor.executemany(
+                f"INSERT INTO {POSTGRES_TABLE} (product_id, document) VALUES (%s, "
+                "setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'B') "
+                "|| setweight(to_tsvector('simple', %s), 'C'))",
+                documents,
+            )
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {SQLITE_TABLE} USING fts5("
+            "name, category, description, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+    elif vendor == "postgresql":
+        schema_editor.execute(
+            f"CREATE TABLE {POSTGRES_TABLE} ("
+            "product_id bigint PRIMARY KEY REFERENCES products_product (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(f"CREATE INDEX {POSTGRES_TABLE}_document ON {POSTGRES_TABLE} USING gin (document)")
+    else:
+        return
+
+    Product = apps.get_model("products", "Product")
+    rows = Product.objects.using(schema_editor.connection.alias).order_by("id").values_list("id", "name", "description", "category__name")
+    batch = []
+    for row in rows.iterator(chunk_size=1000):
+        batch.append(row)
+        if len(batch) == 1000:
+            write_documents(schema_editor.connection, batch)
+            batch = []
+    write_documents(schema_editor.connection, batch)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SQLITE_TABLE}")
+    elif vendor == "postgresql":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {POSTGRES_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_stock_log_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 10:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='description_html',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+    ]
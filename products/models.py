@@ -1,8 +1,9 @@
-from django.db import models, IntegrityError
+from django.db import connections, models, IntegrityError, transaction
+from django.db.models.sql import UpdateQuery
 from markdownx.models import MarkdownxField
 from markdownx.utils import markdownify
 from django.utils.timezone import now
-from django.db.models import F
+from django.db.models import F, Q, Case, Sum, When
 
 # Create your models here.
 class Category(models.Model):
@@ -38,33 +39,232 @@ class Category(models.Model):
         verbose_name_plural = "Categories" 
 
 
+class ProductQuerySet(models.QuerySet):
+    """Set-based stock operations used by batched checkout and restoration paths."""
+
+    def deduct_stock(self, quantities, shard_counts=None, change_type=None):
+        """
+        Deduct stock for several products in a single conditional UPDATE.
+
+        `quantities` maps product ids to the quantity to deduct. Either every
+        product has enough stock and all of them are updated, or nothing is.
+        Products using sharded inventory are claimed from their stock shards;
+        pass `shard_counts` ({product id: shard count}) when the caller already
+        knows which products are sharded.
+        """
+        from .inventory import claim_stock
+        from . import catalog_cache, stock_audit
+
+        if not quantities:
+            return True
+
+        if shard_counts is None:
+            shard_counts = self.shard_counts(quantities.keys())
+
+        sharded = {product_id: quantity for product_id, quantity in quantities.items() if product_id in shard_counts}
+        unsharded = {product_id: quantity for product_id, quantity in quantities.items() if product_id not in shard_counts}
+
+        condition = Q()
+        for product_id, quantity in unsharded.items():
+            condition |= Q(id=product_id, stock__gte=quantity)
+
+        with transaction.atomic():
+            levels = {}
+            if unsharded:
+                levels = self.filter(condition).update_stock_levels(
+                    Case(
+                        *[When(id=product_id, then=F("stock") - quantity) for product_id, quantity in unsharded.items()],
+                        default=F("stock"),
+                        output_field=models.PositiveIntegerField(),
+                    ),
+                    unsharded.keys(),
+                )
+            claimed = all(claim_stock(product_id, quantity, shard_counts[product_id]) for product_id, quantity in sharded.items())
+
+            if len(levels) != len(unsharded) or not claimed:
+                # At least one product ran out, undo the partial update.
+                transaction.set_rollback(True)
+                return False
+            levels.update(self.stock_levels(sharded.keys(), shard_counts))
+
+        stock_audit.record_many(
+            {product_id: -quantity for product_id, quantity in quantities.items()}, change_type=change_type, new_stock_levels=levels
+        )
+        if unsharded:
+            catalog_cache.invalidate_on_commit()
+        return True
+
+    def restore_stock(self, quantities, shard_counts=None, change_type=None):
+        """Give stock back to several products in a single UPDATE."""
+        from .inventory import release_stock
+        from . import catalog_cache, stock_audit
+
+        if not quantities:
+            return
+
+        if shard_counts is None:
+            shard_counts = self.shard_counts(quantities.keys())
+
+        unsharded = {product_id: quantity for product_id, quantity in quantities.items() if product_id not in shard_counts}
+        sharded = [product_id for product_id in quantities if product_id in shard_counts]
+        with transaction.atomic():
+            levels = {}
+            if unsharded:
+                levels = self.filter(id__in=unsharded.keys()).update_stock_levels(
+                    Case(
+                        *[When(id=product_id, then=F("stock") + quantity) for product_id, quantity in unsharded.items()],
+                        default=F("stock"),
+                        output_field=models.PositiveIntegerField(),
+                    ),
+                    unsharded.keys(),
+                )
+                catalog_cache.invalidate_on_commit()
+            for product_id in sharded:
+                release_stock(product_id, quantities[product_id], shard_counts[product_id])
+            levels.update(self.stock_levels(sharded, shard_counts))
+
+        stock_audit.record_many(quantities, change_type=change_type, new_stock_levels=levels)
+
+    def update_stock_levels(self, stock, product_ids):
+        """
+        Set the stock of the products in this queryset to the expression `stock`
+        and return {product id: new stock} for the rows that changed.
+
+        Backends with UPDATE ... RETURNING (PostgreSQL, SQLite 3.35+) do it in one
+        statement. Elsewhere the levels of `product_ids` are read back in the same
+        transaction, and only if the UPDATE changed all of them: callers compare
+        the result to what they asked for.
+        """
+        self._for_write = True
+        connection = connections[self.db]
+        if connection.vendor in ("postgresql", "sqlite") and connection.features.can_return_columns_from_insert:
+            query = self.query.chain(UpdateQuery)
+            query.add_update_values({"stock": stock})
+            statement, params = query.get_compiler(self.db).as_sql()
+            quote = connection.ops.quote_name
+            with connection.cursor() as cursor:
+                cursor.execute(f"{statement} RETURNING {quote(self.model._meta.pk.column)}, {quote('stock')}", params)
+                return dict(cursor.fetchall())
+
+        product_ids = list(product_ids)
+        if self.update(stock=stock) != len(product_ids):
+            return {}
+        return dict(self.model.objects.filter(id__in=product_ids).values_list("id", "stock"))
+
+    def shard_counts(self, product_ids):
+        """Return {product id: shard count} for the sharded products among `product_ids`."""
+        return dict(self.filter(id__in=product_ids, stock_shard_count__gt=0).values_list("id", "stock_shard_count"))
+
+    def stock_levels(self, product_ids, shard_counts):
+        """
+        Return {product id: stock} for the stock log, read in the transaction that
+        just changed it: the UPDATE's row locks keep unsharded levels exact until
+        commit. Sharded products get the sum of their shards, which other buyers
+        may be changing at the same time.
+        """
+        unsharded = [product_id for product_id in product_ids if product_id not in shard_counts]
+        sharded = [product_id for product_id in product_ids if product_id in shard_counts]
+        levels = dict(self.filter(id__in=unsharded).values_list("id", "stock")) if unsharded else {}
+        if sharded:
+            levels.update(
+                StockShard.objects.filter(product_id__in=sharded).values("product_id").annotate(total=Sum("stock")).values_list("product_id", "total")
+            )
+        return levels
+
+
 class Product(models.Model):
+    # Stock keeping unit, the key bulk imports match products on
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=200)
     description = MarkdownxField()
+    # `description` rendered to HTML whenever it changes, see save()
+    description_html = models.TextField(blank=True, default="", editable=False)
     category = models.ForeignKey(Category, related_name="products" ,on_delete=models.CASCADE)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField()
+    # 0 keeps stock on this row; N > 0 splits it across N StockShard rows and
+    # `stock` becomes an aggregate refreshed by the reconcile_stock command.
+    stock_shard_count = models.PositiveSmallIntegerField(default=0)
+
+    objects = ProductQuerySet.as_manager()
 
     def formatted_description(self):
         """Returns the description as HTML for rendering in templates."""
-        return markdownify(self.description)
+        if self.description_html or not self.description:
+            return self.description_html
+        return markdownify(self.description)  # Not rendered yet, see the render_descriptions command
+
+    def save(self, *args, **kwargs):
+        """Render the Markdown description once, when it changes, instead of on every read."""
+        update_fields = kwargs.get("update_fields")
+        if self.description != getattr(self, "_old_description", None) or (self.description and not self.description_html):
+            if update_fields is None or "description" in update_fields:
+                self.description_html = markdownify(self.description)
+                if update_fields is not None:
+                    kwargs["update_fields"] = {*update_fields, "description_html"}
+        super().save(*args, **kwargs)
+        self._old_description = self.description
     
-    def update_stock(self, quantity):
+    @property
+    def is_sharded(self):
+        return self.stock_shard_count > 0
+
+    def update_stock(self, quantity, change_type=None):
         """Deduct stock safely using atomic update to prevent race conditions."""
-        updated_count = Product.objects.filter(
-            id=self.id, stock__gte=quantity
-        ).update(stock=F("stock") - quantity)
+        from . import catalog_cache, stock_audit
+
+        if self.is_sharded:
+            return Product.objects.deduct_stock({self.id: quantity}, shard_counts={self.id: self.stock_shard_count}, change_type=change_type)
+
+        with transaction.atomic():
+            levels = Product.objects.filter(
+                id=self.id, stock__gte=quantity
+            ).update_stock_levels(F("stock") - quantity, [self.id])
 
-        return updated_count > 0  # True if stock was successfully updated
+            if levels:
+                stock_audit.record(self.id, -quantity, levels[self.id], change_type=change_type)
+                catalog_cache.invalidate_on_commit()
+        return bool(levels)  # True if stock was successfully updated
 
-    def restore_stock(self, quantity):
+    def restore_stock(self, quantity, change_type=None):
         """Restore stock when an order is canceled using update()."""
-        Product.objects.filter(pk=self.pk).update(stock=F("stock") + quantity)
+        from . import catalog_cache, stock_audit
+
+        if self.is_sharded:
+            return Product.objects.restore_stock({self.pk: quantity}, shard_counts={self.pk: self.stock_shard_count}, change_type=change_type)
+
+        with transaction.atomic():
+            levels = Product.objects.filter(pk=self.pk).update_stock_levels(F("stock") + quantity, [self.pk])
+        stock_audit.record(self.pk, quantity, levels[self.pk], change_type=change_type)
+        catalog_cache.invalidate_on_commit()
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        # Keep the notion of the saved stock and searchable fields in sync (see products.signals).
+        self._old_stock = self.__dict__.get("stock")
+        self._old_description = self.__dict__.get("description")
+        self._old_name = self.__dict__.get("name")
+        self._old_category_id = self.__dict__.get("category_id")
     
     def __str__(self):
         return f"{self.name} - {self.category.name} | Stock: {self.stock}"
 
 
+class StockShard(models.Model):
+    """One slice of a product's stock, so concurrent buyers don't queue on a single row."""
+    product = models.ForeignKey(Product, related_name="stock_shards", on_delete=models.CASCADE)
+    index = models.PositiveSmallIntegerField()
+    stock = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "index"], name="unique_stock_shard_index"),
+        ]
+
+    def __str__(self):
+        return f"{self.product.name} | Shard {self.index} | Stock: {self.stock}"
+
+
 class StockLog(models.Model):
     """Logs stock changes for tracking inventory adjustments."""
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -73,5 +273,12 @@ class StockLog(models.Model):
     new_stock_level = models.IntegerField()
     timestamp = models.DateTimeField(default=now)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination and exports walk the log newest first
+            models.Index(fields=["-timestamp", "-id"], name="idx_stocklog_timestamp"),
+            models.Index(fields=["product", "-timestamp", "-id"], name="idx_stocklog_product_time"),
+        ]
+
     def __str__(self):
         return f"{self.product.name} -> {self.change_type} -> {self.quantity_changed} items"
\ No newline at end of file
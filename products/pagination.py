@@ -0,0 +1,13 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class StockLogCursorPagination(CursorPagination):
+    """
+    Newest log entries first, paginated by (timestamp, id) keys so a page is an
+    index seek no matter how large the log grows.
+    """
+    page_size = settings.STOCK_LOG_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.STOCK_LOG_MAX_PAGE_SIZE
+    ordering = ("-timestamp", "-id")
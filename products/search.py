@@ -0,0 +1,172 @@
+"""
+Full-text product search.
+
+Products are indexed by name, category name and the plain text of their
+Markdown description in a table kept next to products_product: an FTS5
+virtual table on SQLite, or a tsvector column with a GIN index on PostgreSQL
+(created by migration 0007).
+The index is updated when a product or category is saved (see
+products.signals) and can be rebuilt with `manage.py rebuild_search_index`.
+Other databases fall back to unindexed icontains matching.
+
+Search terms are prefix matched and all of them must match. Results are
+ranked (name over category over description) and can be narrowed by
+category, price range and stock.
+"""
+import html
+import re
+from django.db import connection
+from django.db.models import Count, Q
+from django.utils.html import strip_tags
+from markdownx.utils import markdownify
+
+SQLITE_TABLE = "products_product_fts"
+POSTGRES_TABLE = "products_product_search"
+
+
+def plain_text(markdown):
+    """The text a reader sees in a Markdown description, without markup."""
+    return " ".join(html.unescape(strip_tags(markdownify(markdown or ""))).split())
+
+
+def query_terms(query):
+    return re.findall(r"\w+", (query or "").lower())
+
+
+def write_documents(rows):
+    """Index (id, name, description, category name) rows, replacing what was indexed for those ids."""
+    documents = [(product_id, name, category or "", plain_text(description)) for product_id, name, description, category in rows]
+    if not documents:
+        return
+
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute(
+                f"DELETE FROM {SQLITE_TABLE} WHERE rowid IN ({', '.join(['%s'] * len(documents))})",
+                [document[0] for document in documents],
+            )
+            cursor.executemany(f"INSERT INTO {SQLITE_TABLE} (rowid, name, category, description) VALUES (%s, %s, %s, %s)", documents)
+        elif connection.vendor == "postgresql":
+            cursor.executemany(
+                f"INSERT INTO {POSTGRES_TABLE} (product_id, document) VALUES (%s, "
+                "setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'B') "
+                "|| setweight(to_tsvector('simple', %s), 'C')) "
+                "ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+                documents,
+            )
+
+
+def index_products(product_ids):
+    """(Re)index the given products."""
+    from .models import Product
+
+    write_documents(Product.objects.filter(id__in=product_ids).values_list("id", "name", "description", "category__name"))
+
+
+def remove_products(product_ids):
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+
+    placeholders = ", ".join(["%s"] * len(product_ids))
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute(f"DELETE FROM {SQLITE_TABLE} WHERE rowid IN ({placeholders})", product_ids)
+        elif connection.vendor == "postgresql":
+            cursor.execute(f"DELETE FROM {POSTGRES_TABLE} WHERE product_id IN ({placeholders})", product_ids)
+
+
+def _facet_filters(min_price, max_price, in_stock):
+    clauses, params = [], []
+    if min_price is not None:
+        clauses.append("p.price >= %s")
+        params.append(min_price)
+    if max_price is not None:
+        clauses.append("p.price <= %s")
+        params.append(max_price)
+    if in_stock:
+        clauses.append("p.stock > 0")
+    return clauses, params
+
+
+def _match(terms):
+    """FROM/WHERE fragment matching every term as a prefix, with its rank expression and parameters."""
+    if connection.vendor == "sqlite":
+        return (
+            f"{SQLITE_TABLE} JOIN products_product p ON p.id = {SQLITE_TABLE}.rowid",
+            f"{SQLITE_TABLE} MATCH %s",
+            f"bm25({SQLITE_TABLE}, 10.0, 3.0, 1.0)",
+            [" ".join(f'"{term}"*' for term in terms)],
+        )
+    return (
+        f"{POSTGRES_TABLE} f JOIN products_product p ON p.id = f.product_id",
+        "f.document @@ to_tsquery('simple', %s)",
+        "-ts_rank(f.document, to_tsquery('simple', %s))",
+        [" & ".join(f"{term}:*" for term in terms)],
+    )
+
+
+def search(query, category=None, min_price=None, max_price=None, in_stock=False, limit=20, offset=0):
+    """
+    Return (products, count, category facets) for `query`.
+
+    `products` is the requested page of ranked Product objects. The category
+    facets ({"id", "name", "count"} dicts) count the matches in every category
+    under the other filters, so a client can offer them as refinements.
+    """
+    from .models import Product
+
+    terms = query_terms(query)
+    if not terms:
+        return [], 0, []
+    if connection.vendor not in ("sqlite", "postgresql"):
+        return _search_unindexed(terms, category, min_price, max_price, in_stock, limit, offset)
+
+    source, match, rank, match_params = _match(terms)
+    clauses, params = _facet_filters(min_price, max_price, in_stock)
+    where = " AND ".join([match] + clauses)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT p.category_id, c.name, COUNT(*) FROM {source} JOIN products_category c ON c.id = p.category_id "
+            f"WHERE {where} GROUP BY p.category_id, c.name ORDER BY COUNT(*) DESC, c.name",
+            match_params + params,
+        )
+        facets = [{"id": category_id, "name": name, "count": count} for category_id, name, count in cursor.fetchall()]
+
+        if category is not None:
+            where += " AND p.category_id = %s"
+            params.append(category)
+        rank_params = match_params if connection.vendor == "postgresql" else []
+        cursor.execute(
+            f"SELECT p.id FROM {source} WHERE {where} ORDER BY {rank}, p.id LIMIT %s OFFSET %s",
+            match_params + params + rank_params + [limit, offset],
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+
+    count = sum(facet["count"] for facet in facets if category is None or facet["id"] == category)
+    products = Product.objects.select_related("category").in_bulk(ids)
+    return [products[product_id] for product_id in ids if product_id in products], count, facets
+
+
+def _search_unindexed(terms, category, min_price, max_price, in_stock, limit, offset):
+    from .models import Product
+
+    products = Product.objects.select_related("category")
+    for term in terms:
+        products = products.filter(Q(name__icontains=term) | Q(description__icontains=term) | Q(category__name__icontains=term))
+    if min_price is not None:
+        products = products.filter(price__gte=min_price)
+    if max_price is not None:
+        products = products.filter(price__lte=max_price)
+    if in_stock:
+        products = products.filter(stock__gt=0)
+
+    facets = [
+        {"id": row["category_id"], "name": row["category__name"], "count": row["count"]}
+        for row in products.values("category_id", "category__name").annotate(count=Count("id")).order_by("-count", "category__name")
+    ]
+    if category is not None:
+        products = products.filter(category_id=category)
+    count = sum(facet["count"] for facet in facets if category is None or facet["id"] == category)
+    return list(products.order_by("name", "id")[offset:offset + limit]), count, facets
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from decimal import Decimal
+from django.conf import settings
 from .models import Category, Product, StockLog
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -25,14 +26,66 @@ class ProductSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Product
-        fields = ["id", "name", "description", "category", "category_name", "price", "stock"]
+        fields = ["id", "sku", "name", "description", "category", "category_name", "price", "stock"]
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
         data["price"] = f"{instance.price:,.2f}"
+        # ?include=description_html adds the pre-rendered description
+        request = self.context.get("request")
+        if request and "description_html" in request.query_params.get("include", "").split(","):
+            data["description_html"] = instance.formatted_description()
         return data
 
 
+class ProductImportSerializer(serializers.Serializer):
+    """One row of a bulk product import; the category is given by name and created if missing."""
+    sku = serializers.CharField(max_length=64)
+    name = serializers.CharField(max_length=200)
+    description = serializers.CharField()
+    category = serializers.CharField(max_length=255)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal("0.01"))
+    stock = serializers.IntegerField(min_value=0)
+
+    def validate_name(self, value):
+        if len(value) < 3:
+            raise serializers.ValidationError("Product name must be at least 3 characters long.")
+        return value
+
+    def validate_category(self, value):
+        return value.lower()
+
+
+class StockAdjustmentSerializer(serializers.Serializer):
+    """One product of a bulk stock adjustment: a product id or SKU, and a delta or an absolute stock."""
+    product = serializers.IntegerField(required=False)
+    sku = serializers.CharField(max_length=64, required=False)
+    delta = serializers.IntegerField(required=False)
+    stock = serializers.IntegerField(min_value=0, required=False)
+
+    def validate(self, data):
+        if ("product" in data) == ("sku" in data):
+            raise serializers.ValidationError("Give either a product id or a SKU.")
+        if ("delta" in data) == ("stock" in data):
+            raise serializers.ValidationError("Give either a stock delta or an absolute stock.")
+        return data
+
+
+class BulkStockAdjustmentSerializer(serializers.Serializer):
+    adjustments = StockAdjustmentSerializer(many=True, allow_empty=False, max_length=settings.STOCK_ADJUST_MAX_ITEMS)
+
+
+class ProductSearchSerializer(serializers.Serializer):
+    """Query parameters of the product search endpoint."""
+    q = serializers.CharField(max_length=200)
+    category = serializers.IntegerField(required=False)
+    min_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    max_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    in_stock = serializers.BooleanField(default=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+    offset = serializers.IntegerField(min_value=0, default=0)
+
+
 class StockLogSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source="product.name", read_only=True)
     timestamp = serializers.DateTimeField(read_only=True)
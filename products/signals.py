@@ -1,37 +1,68 @@
-from django.db.models.signals import pre_save, post_save
+from django.db.models.signals import post_delete, post_init, post_save
 from django.dispatch import receiver
-from .models import Product, StockLog
+from .models import Category, Product
+from . import catalog_cache, search, stock_audit
 
-@receiver(pre_save, sender=Product)
+# Product fields the search index is built from
+SEARCH_FIELDS = {"name", "description", "category", "category_id"}
+
+@receiver(post_init, sender=Product)
 def capture_old_stock(sender, instance, **kwargs):
     """
-    Store the old stock value before saving the product.
+    Remember the stock value (and searchable fields) the product was loaded with,
+    so saving it doesn't need to read the old values back from the database.
     """
-    try:
-        instance._old_stock = Product.objects.get(pk=instance.pk).stock
-    except Product.DoesNotExist:
-        instance._old_stock = None  # New product, no old stock
+    instance._old_stock = instance.__dict__.get("stock")
+    instance._old_description = instance.__dict__.get("description")
+    instance._old_name = instance.__dict__.get("name")
+    instance._old_category_id = instance.__dict__.get("category_id")
 
 
 @receiver(post_save, sender=Product)
 def log_stock_change(sender, instance, created, **kwargs):
     """
-    Automatically create a StockLog entry after a product's stock is updated.
+    Record a StockLog entry through the buffered audit log after a product's stock is updated.
     """
     if created:
-        StockLog.objects.create(
-            product=instance,
-            change_type="Initial Stock",
-            quantity_changed=instance.stock,
-            new_stock_level=instance.stock
-        )
+        stock_audit.record(instance.pk, instance.stock, change_type="Initial Stock", new_stock_level=instance.stock)
     elif instance._old_stock is not None and instance._old_stock != instance.stock:
-        change = instance.stock - instance._old_stock
-        change_type = "Stock Added" if change > 0 else "Stock Deducted"
-
-        StockLog.objects.create(
-            product=instance,
-            change_type=change_type,
-            quantity_changed=abs(change),
-            new_stock_level=instance.stock
-        )
+        stock_audit.record(instance.pk, instance.stock - instance._old_stock, new_stock_level=instance.stock)
+
+    instance._old_stock = instance.stock
+
+
+# The search index is written in the saving transaction, and these receivers are
+# connected before invalidate_catalog, so cached search results are only dropped
+# once the index they're rebuilt from has the change.
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, created, update_fields=None, **kwargs):
+    """Re-index the product for search, unless none of its searchable fields changed."""
+    if update_fields is not None and not SEARCH_FIELDS.intersection(update_fields):
+        return
+    changed = (instance.name, instance.description, instance.category_id) != (
+        instance._old_name, instance._old_description, instance._old_category_id
+    )
+    if created or changed:
+        search.index_products([instance.pk])
+    instance._old_name, instance._old_category_id = instance.name, instance.category_id
+
+
+@receiver(post_save, sender=Category)
+def index_category_products(sender, instance, created, **kwargs):
+    """Products are searchable by their category name."""
+    if not created:
+        search.index_products(instance.products.values_list("id", flat=True))
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_catalog(sender, **kwargs):
+    """Cached catalog responses are stale once a product or category changes."""
+    catalog_cache.invalidate_on_commit()
@@ -0,0 +1,95 @@
+"""
+Buffered stock audit log.
+
+Every stock change is recorded here instead of being written to StockLog one
+row at a time. Entries only join the in-process buffer once the transaction
+that made the change commits (rolled back changes are never logged), and the
+buffer is written with a single bulk_create when it reaches
+STOCK_AUDIT_BUFFER_SIZE entries, when its oldest entry is older than
+STOCK_AUDIT_FLUSH_INTERVAL seconds, or when the process exits.
+
+Callers pass the stock level each change left behind, read in the same
+transaction as the change (see ProductQuerySet.stock_levels), since the
+current stock at flush time already includes later changes.
+"""
+import atexit
+import threading
+import time
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import StockLog
+
+_buffer = []
+_oldest = None
+_lock = threading.Lock()
+
+
+def record(product_id, change, new_stock_level, change_type=None):
+    """Record a single stock change. `change` is signed: positive for stock added."""
+    record_many({product_id: change}, {product_id: new_stock_level}, change_type=change_type)
+
+
+def record_many(changes, new_stock_levels, change_type=None):
+    """Record {product id: signed change} entries made by one operation, with {product id: resulting stock}."""
+    timestamp = timezone.now()
+    entries = []
+    for product_id, change in changes.items():
+        if not change:
+            continue
+        entries.append(StockLog(
+            product_id=product_id,
+            change_type=change_type or ("Stock Added" if change > 0 else "Stock Deducted"),
+            quantity_changed=abs(change),
+            new_stock_level=new_stock_levels[product_id],
+            timestamp=timestamp,
+        ))
+
+    if entries:
+        transaction.on_commit(lambda: _enqueue(entries))
+
+
+def _enqueue(entries):
+    global _oldest
+    with _lock:
+        if not _buffer:
+            _oldest = time.monotonic()
+        _buffer.extend(entries)
+        size = len(_buffer)
+
+    if size >= settings.STOCK_AUDIT_BUFFER_SIZE:
+        flush()
+    else:
+        flush_if_due()
+
+
+def flush_if_due():
+    """Flush the buffer if its oldest entry has waited longer than the flush interval."""
+    if _oldest is not None and time.monotonic() - _oldest >= settings.STOCK_AUDIT_FLUSH_INTERVAL:
+        flush()
+
+
+def flush():
+    """Write every buffered entry to StockLog. Returns the number of rows written."""
+    global _oldest
+    with _lock:
+        entries = _buffer[:]
+        _buffer.clear()
+        _oldest = None
+
+    if not entries:
+        return 0
+
+    StockLog.objects.bulk_create(entries, batch_size=500)
+    return len(entries)
+
+
+@receiver(request_finished)
+def flush_after_request(sender, **kwargs):
+    flush_if_due()
+
+
+atexit.register(flush)
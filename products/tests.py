@@ -1,3 +1,459 @@
-from django.test import TestCase
+import csv
+import json
+import os
+from datetime import timedelta
+from decimal import Decimal
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from .models import Category, Product, StockShard, StockLog
+from .views import ProductListCreateView
+from .inventory import enable_sharding, disable_sharding, reconcile_stock, adjust_stock
+from .importer import import_products
+from . import search, stock_audit
+from utils.query_plans import unindexed_steps
+
+
+class ShardedStockTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Gadgets")
+        self.product = Product.objects.create(name="Hot item", description="-", category=category, price=Decimal("5.00"), stock=10)
+
+    def shard_total(self):
+        return StockShard.objects.filter(product=self.product).aggregate(total=Sum("stock"))["total"]
+
+    def test_enable_sharding_splits_stock_evenly(self):
+        product = enable_sharding(self.product, shard_count=4)
+
+        self.assertEqual(product.stock_shard_count, 4)
+        self.assertEqual(
+            list(StockShard.objects.filter(product=product).order_by("index").values_list("stock", flat=True)),
+            [3, 3, 2, 2],
+        )
+
+    def test_claims_span_shards_and_fail_without_partial_deduction(self):
+        product = enable_sharding(self.product, shard_count=4)
+
+        self.assertTrue(product.update_stock(7))
+        self.assertEqual(self.shard_total(), 3)
+        self.assertFalse(product.update_stock(4))
+        self.assertEqual(self.shard_total(), 3)
+
+        product.restore_stock(2)
+        self.assertEqual(self.shard_total(), 5)
+
+    def test_reconcile_and_disable_fold_shards_into_product(self):
+        product = enable_sharding(self.product, shard_count=3)
+        self.assertTrue(Product.objects.deduct_stock({product.id: 4}))
+
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 10)  # Aggregate is refreshed asynchronously.
+        self.assertEqual(reconcile_stock(), 1)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 6)
+
+        product = disable_sharding(product)
+        self.assertEqual(product.stock, 6)
+        self.assertFalse(StockShard.objects.filter(product=product).exists())
+
+
+@override_settings(STOCK_AUDIT_BUFFER_SIZE=1000, STOCK_AUDIT_FLUSH_INTERVAL=3600)
+class StockAuditTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Gadgets")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = Product.objects.create(name="Widget", description="-", category=category, price=Decimal("5.00"), stock=10)
+        stock_audit.flush()
+
+    def test_saving_stock_needs_no_extra_read_and_is_logged_on_flush(self):
+        self.product.stock = 12
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(1):
+            self.product.save()
+
+        self.assertEqual(StockLog.objects.filter(change_type="Stock Added").count(), 0)
+        self.assertEqual(stock_audit.flush(), 1)
+        log = StockLog.objects.get(change_type="Stock Added")
+        self.assertEqual((log.quantity_changed, log.new_stock_level), (2, 12))
+
+    def test_set_based_updates_are_logged_with_their_stock_levels(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.deduct_stock({self.product.id: 3}, change_type="Order Placed")
+            self.product.restore_stock(1, change_type="Order Canceled")
+        stock_audit.flush()
+
+        levels = list(StockLog.objects.exclude(change_type="Initial Stock").order_by("id").values_list("change_type", "quantity_changed", "new_stock_level"))
+        self.assertEqual(levels, [("Order Placed", 3, 7), ("Order Canceled", 1, 8)])
+
+    def test_levels_are_read_when_the_stock_changes_not_at_flush(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.deduct_stock({self.product.id: 3}, change_type="Order Placed")
+        Product.objects.filter(pk=self.product.pk).update(stock=50)  # Another worker's change, logged by that worker
+        stock_audit.flush()
+
+        self.assertEqual(StockLog.objects.get(change_type="Order Placed").new_stock_level, 7)
+
+    def test_stock_changes_return_their_levels_without_another_read(self):
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as ctx:
+            self.product.update_stock(2, change_type="Order Placed")
+            Product.objects.deduct_stock({self.product.id: 3}, shard_counts={}, change_type="Order Placed")
+            self.product.restore_stock(1, change_type="Order Canceled")
+        stock_audit.flush()
+
+        statements = [query["sql"] for query in ctx.captured_queries]
+        if connection.features.can_return_columns_from_insert:
+            self.assertFalse([sql for sql in statements if sql.startswith("SELECT")])
+        levels = list(StockLog.objects.exclude(change_type="Initial Stock").order_by("id").values_list("quantity_changed", "new_stock_level"))
+        self.assertEqual(levels, [(2, 8), (3, 5), (1, 6)])
+
+    def test_rolled_back_changes_are_not_logged(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.product.update_stock(2)
+                transaction.set_rollback(True)
+
+        self.assertEqual(stock_audit.flush(), 0)
+
+
+class StockLogListTests(TestCase):
+    def setUp(self):
+        admin = get_user_model().objects.create_superuser(email="admin@example.com", username="admin", password="pass12345")
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+        category = Category.objects.create(name="Gadgets")
+        self.products = [
+            Product.objects.create(name=f"Product {i}", description="-", category=category, price=Decimal("5.00"), stock=10)
+            for i in range(2)
+        ]
+        StockLog.objects.all().delete()
+
+    def create_logs(self, count):
+        start = timezone.now() - timedelta(days=1)
+        StockLog.objects.bulk_create([
+            StockLog(product=self.products[i % 2], change_type="Stock Added", quantity_changed=1, new_stock_level=i, timestamp=start + timedelta(minutes=i))
+            for i in range(count)
+        ])
+
+    def test_list_is_keyset_paginated_with_a_flat_query_count(self):
+        self.create_logs(5)
+        with CaptureQueriesContext(connection) as few:
+            first = self.client.get(reverse("stock-log-list"), {"page_size": 3}).data
+        self.create_logs(50)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(reverse("stock-log-list"), {"page_size": 50})
+
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+        self.assertEqual(len(first["results"]), 3)
+        self.assertIn("cursor=", first["next"])
+
+    def test_export_streams_filtered_rows_as_csv(self):
+        self.create_logs(6)
+        response = self.client.get(reverse("stock-log-export", args=["csv"]), {"product": self.products[0].id})
+
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(b"".join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][:3], ["id", "product", "product_name"])
+        self.assertEqual(len(rows), 4)
+        self.assertEqual({row[2] for row in rows[1:]}, {"Product 0"})
+
+    def test_export_streams_ndjson_newest_first(self):
+        self.create_logs(3)
+        response = self.client.get(reverse("stock-log-export", args=["ndjson"]))
+
+        entries = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([entry["new_stock_level"] for entry in entries], [2, 1, 0])
+
+    def test_unknown_export_format_is_not_found(self):
+        self.assertEqual(self.client.get(reverse("stock-log-export", args=["xml"])).status_code, 404)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(stock_audit.flush)  # Audit entries of committed callbacks belong to this test's data
+        self.client = APIClient()
+        category = Category.objects.create(name="Gadgets")
+        self.product = Product.objects.create(name="Phone", description="-", category=category, price=Decimal("1200.00"), stock=10)
+
+    def test_repeated_reads_do_not_touch_the_database(self):
+        first = self.client.get(reverse("product-list"))
+        with self.assertNumQueries(0):
+            second = self.client.get(reverse("product-list"))
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(json.loads(second.content)[0]["price"], "1,200.00")
+
+    def test_unchanged_catalog_answers_not_modified(self):
+        etag = self.client.get(reverse("product-detail", args=[self.product.id]))["ETag"]
+
+        response = self.client.get(reverse("product-detail", args=[self.product.id]), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+    def test_product_and_stock_writes_invalidate_cached_reads(self):
+        etag = self.client.get(reverse("product-list"))["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = Decimal("999.00")
+            self.product.save()
+        response = self.client.get(reverse("product-list"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)[0]["price"], "999.00")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.deduct_stock({self.product.id: 3})
+        self.assertEqual(json.loads(self.client.get(reverse("product-list")).content)[0]["stock"], 7)
+
+    async def test_cached_reads_are_served_by_the_async_front(self):
+        first = await self.async_client.get(reverse("product-list"))
+        self.assertEqual(first.status_code, 200)
+
+        with mock.patch.object(ProductListCreateView, "get", side_effect=AssertionError("DRF view called")):
+            second = await self.async_client.get(reverse("product-list"))
+            not_modified = await self.async_client.get(reverse("product-list"), headers={"If-None-Match": first["ETag"]})
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(not_modified.status_code, 304)
+
+        browsable = await self.async_client.get(reverse("product-list"), headers={"Accept": "text/html"})
+        self.assertEqual(browsable.status_code, 200)
+        self.assertIn("text/html", browsable["Content-Type"])
+
+    async def test_cached_reads_with_credentials_are_authenticated(self):
+        self.assertEqual((await self.async_client.get(reverse("product-list"))).status_code, 200)
+
+        response = await self.async_client.get(reverse("product-list"), headers={"Authorization": "Bearer not-a-token"})
+        self.assertEqual(response.status_code, 401)
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(stock_audit.flush)  # Audit entries of committed callbacks belong to this test's data
+        self.client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            phones = Category.objects.create(name="Phones")
+            cases = Category.objects.create(name="Accessories")
+            self.phone = Product.objects.create(name="Galaxy Phone", description="A **fast** phone", category=phones, price=Decimal("500.00"), stock=3)
+            self.cheap = Product.objects.create(name="Budget Phone", description="Cheap and cheerful", category=phones, price=Decimal("90.00"), stock=0)
+            self.case = Product.objects.create(name="Leather case", description="Fits the *Galaxy Phone*", category=cases, price=Decimal("20.00"), stock=8)
+
+    def search(self, **params):
+        response = self.client.get(reverse("product-search"), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_results_are_prefix_matched_and_ranked(self):
+        data = self.search(q="gala pho")
+
+        self.assertEqual([product["id"] for product in data["results"]], [self.phone.id, self.case.id])
+        self.assertEqual(data["count"], 2)
+        self.assertEqual({facet["name"]: facet["count"] for facet in data["facets"]["categories"]}, {"phones": 1, "accessories": 1})
+
+    def test_filters_narrow_results(self):
+        data = self.search(q="phone", in_stock="true", max_price="100")
+        self.assertEqual([product["id"] for product in data["results"]], [self.case.id])
+
+        data = self.search(q="phone", category=self.phone.category_id)
+        self.assertEqual({product["id"] for product in data["results"]}, {self.phone.id, self.cheap.id})
+        self.assertEqual(data["count"], 2)
+
+    def test_index_follows_product_and_category_changes(self):
+        self.assertEqual(self.search(q="fast")["count"], 1)  # Markdown is indexed as plain text
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.phone.name = "Pixel"
+            self.phone.description = "Slow"
+            self.phone.save()
+            self.case.category.name = "Covers"
+            self.case.category.save()
+            self.cheap.delete()
+
+        self.assertEqual(self.search(q="fast")["count"], 0)
+        self.assertEqual([product["id"] for product in self.search(q="pixel")["results"]], [self.phone.id])
+        self.assertEqual(self.search(q="covers")["count"], 1)
+        self.assertEqual(self.search(q="budget")["count"], 0)
+
+    def test_index_is_written_in_the_saving_transaction(self):
+        self.phone.name = "Pixel"
+        self.phone.save()  # Its on_commit callbacks (cache invalidation) haven't run
+
+        self.assertEqual(search.search("pixel")[1], 1)
+
+
+class DescriptionRenderingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Gadgets")
+        self.product = Product.objects.create(name="Widget", description="A **bold** claim", category=self.category, price=Decimal("5.00"), stock=10)
+
+    def test_description_is_rendered_once_when_it_changes(self):
+        self.assertEqual(self.product.description_html, "<p>A <strong>bold</strong> claim</p>")
+
+        with mock.patch("products.models.markdownify") as markdownify:
+            product = Product.objects.get(pk=self.product.pk)
+            product.formatted_description()
+            product.stock = 5
+            product.save()
+            markdownify.assert_not_called()
+
+        product.description = "*New*"
+        product.save()
+        self.assertEqual(Product.objects.get(pk=product.pk).description_html, "<p><em>New</em></p>")
+
+    def test_backfill_renders_missing_html(self):
+        Product.objects.update(description_html="")
+
+        call_command("render_descriptions", stdout=StringIO())
+        self.assertEqual(Product.objects.get(pk=self.product.pk).description_html, "<p>A <strong>bold</strong> claim</p>")
+
+    def test_api_includes_html_on_request(self):
+        client = APIClient()
+        url = reverse("product-detail", args=[self.product.pk])
+
+        self.assertNotIn("description_html", client.get(url).json())
+        self.assertEqual(client.get(url, {"include": "description_html"}).json()["description_html"], "<p>A <strong>bold</strong> claim</p>")
+
+
+class ProductImportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(stock_audit.flush)
+        admin = get_user_model().objects.create_superuser(email="admin@example.com", username="admin", password="pass12345")
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+        stock_audit.flush()
+
+    def upload(self, name, content):
+        file = BytesIO(content.encode())
+        file.name = name
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("product-import"), {"file": file}, format="multipart")
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_csv_import_creates_products_categories_and_reports_bad_rows(self):
+        report = self.upload("catalog.csv", (
+            "sku,name,description,category,price,stock\n"
+            "PH-1,Galaxy Phone,A **fast** phone,Phones,500.00,3\n"
+            "PH-2,Budget Phone,Cheap,PHONES,90.00,7\n"
+            "PH-3,Free Phone,Too cheap,Phones,0,1\n"
+        ))
+
+        self.assertEqual((report["created"], report["updated"], report["failed"]), (2, 0, 1))
+        self.assertEqual(report["errors"][0]["row"], 3)
+        self.assertIn("price", report["errors"][0]["errors"])
+        self.assertEqual(list(Category.objects.values_list("name", flat=True)), ["phones"])
+        self.assertEqual(Product.objects.get(sku="PH-1").description_html, "<p>A <strong>fast</strong> phone</p>")
+
+        stock_audit.flush()
+        self.assertEqual(StockLog.objects.filter(change_type="Initial Stock").count(), 2)
+        self.assertEqual(search.search("galaxy")[1], 1)
+
+    def test_ndjson_import_updates_existing_products_by_sku(self):
+        self.upload("catalog.ndjson", '{"sku": "PH-1", "name": "Galaxy Phone", "description": "-", "category": "Phones", "price": "500.00", "stock": 3}\n')
+        report = self.upload("catalog.ndjson", (
+            '{"sku": "PH-1", "name": "Galaxy Phone 2", "description": "-", "category": "Phones", "price": "450.00", "stock": 10}\n'
+            "not json\n"
+            '{"sku": "PH-9", "name": "Case", "description": "-", "category": "Accessories", "price": "9.00", "stock": 4}\n'
+        ))
+
+        self.assertEqual((report["created"], report["updated"], report["failed"]), (1, 1, 1))
+        product = Product.objects.get(sku="PH-1")
+        self.assertEqual((product.name, product.price, product.stock), ("Galaxy Phone 2", Decimal("450.00"), 10))
+
+        stock_audit.flush()
+        log = StockLog.objects.get(change_type="Product Import")
+        self.assertEqual((log.product_id, log.quantity_changed, log.new_stock_level), (product.id, 7, 10))
+
+    def test_query_count_does_not_grow_with_rows(self):
+        def count_queries(skus):
+            rows = [(i, {"sku": sku, "name": f"Product {sku}", "description": "-", "category": "Bulk", "price": "1.00", "stock": 1}) for i, sku in enumerate(skus)]
+            with CaptureQueriesContext(connection) as ctx:
+                import_products(rows)
+            return len(ctx.captured_queries)
+
+        count_queries(["warmup"])  # Creates the category
+        self.assertEqual(count_queries([f"A{i}" for i in range(5)]), count_queries([f"B{i}" for i in range(50)]))
+
+    def test_command_imports_a_file(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as file:
+            file.write("sku,name,description,category,price,stock\nPH-1,Galaxy Phone,-,Phones,500.00,3\n")
+        self.addCleanup(os.remove, file.name)
+        out = StringIO()
+
+        call_command("import_products", file.name, stdout=out)
+        self.assertIn("Created 1, updated 0, failed 0", out.getvalue())
+        self.assertTrue(Product.objects.filter(sku="PH-1").exists())
+
+
+class StockAdjustmentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(stock_audit.flush)
+        admin = get_user_model().objects.create_superuser(email="admin@example.com", username="admin", password="pass12345")
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+        category = Category.objects.create(name="Gadgets")
+        self.products = [
+            Product.objects.create(sku=f"SKU-{i}", name=f"Product {i}", description="-", category=category, price=Decimal("5.00"), stock=10)
+            for i in range(60)
+        ]
+        stock_audit.flush()
+
+    def adjust(self, adjustments):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse("product-stock-adjust"), {"adjustments": adjustments}, format="json")
+
+    def test_deltas_and_absolute_levels_are_applied_and_logged(self):
+        response = self.adjust([
+            {"product": self.products[0].id, "delta": -4},
+            {"sku": "SKU-1", "stock": 25},
+            {"sku": "SKU-1", "delta": 5},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({p["product"]: p["stock"] for p in response.json()["products"]}, {self.products[0].id: 6, self.products[1].id: 30})
+
+        stock_audit.flush()
+        logs = dict(StockLog.objects.filter(change_type="Stock Adjustment").values_list("product_id", "quantity_changed"))
+        self.assertEqual(logs, {self.products[0].id: 4, self.products[1].id: 20})
+
+    def test_adjustment_is_all_or_nothing(self):
+        response = self.adjust([{"product": self.products[0].id, "delta": 3}, {"product": self.products[1].id, "delta": -11}])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["errors"], [{"product": self.products[1].id, "error": "Only 10 items available in stock."}])
+        self.assertEqual(list(Product.objects.filter(id__in=[self.products[0].id, self.products[1].id]).values_list("stock", flat=True)), [10, 10])
+
+    def test_sharded_products_take_deltas(self):
+        enable_sharding(self.products[0], shard_count=4)
+
+        new_levels, errors = adjust_stock({self.products[0].id: -7})
+        self.assertEqual((new_levels, errors), ({self.products[0].id: 3}, {}))
+        self.assertIn(self.products[0].id, adjust_stock(levels={self.products[0].id: 5})[1])
+
+    def test_query_count_does_not_grow_with_products(self):
+        def count_queries(products):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.adjust([{"sku": product.sku, "delta": 1} for product in products])
+            self.assertEqual(response.status_code, 200)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(count_queries(self.products[:5]), count_queries(self.products[5:60]))
+
+
+class QueryPlanTests(TestCase):
+    def test_stock_log_list_for_a_product(self):
+        logs = StockLog.objects.filter(product_id=1).order_by("-timestamp", "-id")[:51]
+        self.assertEqual(unindexed_steps(logs), [])
@@ -2,9 +2,13 @@ from django.urls import path
 from . import views
 
 urlpatterns = [
-    path("categories/", views.CategoryListCreateView.as_view(), name="category-list"),
+    path("categories/", views.async_catalog_view(views.CategoryListCreateView.as_view()), name="category-list"),
     path("categories/<int:pk>/", views.CategoryDetailView.as_view(), name="category-detail"),
-    path("products/", views.ProductListCreateView.as_view(), name="product-list"),
-    path("products/<int:pk>/", views.ProductDetailView.as_view(), name="product-detail"),
+    path("products/", views.async_catalog_view(views.ProductListCreateView.as_view()), name="product-list"),
+    path("products/search/", views.async_catalog_view(views.ProductSearchView.as_view()), name="product-search"),
+    path("products/import/", views.ProductImportView.as_view(), name="product-import"),
+    path("products/stock/adjust/", views.StockAdjustView.as_view(), name="product-stock-adjust"),
+    path("products/<int:pk>/", views.async_catalog_view(views.ProductDetailView.as_view()), name="product-detail"),
     path("stock-logs/", views.StockLogListView.as_view(), name="stock-log-list"),
+    path("stock-logs/export/<str:file_format>/", views.StockLogExportView.as_view(), name="stock-log-export"),
 ]
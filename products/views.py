@@ -1,11 +1,31 @@
-from rest_framework import generics, permissions, filters
+import csv
+import json
+from contextlib import nullcontext
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework import generics, permissions, filters, status
+from rest_framework.parsers import MultiPartParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework.permissions import BasePermission, SAFE_METHODS
 
-from .serializers import CategorySerializer, ProductSerializer, StockLogSerializer
+from .serializers import (
+    BulkStockAdjustmentSerializer, CategorySerializer, ProductSerializer, ProductSearchSerializer, StockLogSerializer,
+)
 from .models import Category, Product, StockLog
 from .filters import StockLogFilter
+from .pagination import StockLogCursorPagination
+from .inventory import adjust_stock
+from . import catalog_cache, importer, search
+from ecommerce.replicas import ReplicaReadMixin, primary_reads
 
 
 class IsAdminOrReadOnly(BasePermission):
@@ -19,8 +39,76 @@ class IsAdminOrReadOnly(BasePermission):
         return request.user and request.user.is_staff
 
 
+class CatalogCacheMixin:
+    """
+    Serves JSON reads from the catalog cache instead of querying and serializing,
+    and answers If-None-Match with 304 Not Modified while the catalog is unchanged.
+    """
+    def get(self, request, *args, **kwargs):
+        if not isinstance(request.accepted_renderer, JSONRenderer):
+            return super().get(request, *args, **kwargs)
+
+        version = catalog_cache.get_version()
+        key = request.get_full_path()
+        entry = catalog_cache.lookup(version, key)
+        if entry is None:
+            # Replicas may not have the write that started this version yet, and the entry would outlive their lag
+            fresh = catalog_cache.version_age(version) < settings.DATABASE_REPLICA_PIN_SECONDS
+            with primary_reads() if fresh else nullcontext():
+                response = super().get(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            entry = catalog_cache.store(version, key, JSONRenderer().render(response.data))
+
+        return cached_response(request, entry)
+
+
+def cached_response(request, entry):
+    """The JSON response for a catalog cache entry, or 304 Not Modified if the client has it."""
+    etag, body = entry
+    if etag in parse_etags(request.headers.get("If-None-Match", "")):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type="application/json")
+    response["ETag"] = etag
+    patch_vary_headers(response, ["Accept"])
+    return response
+
+
+def accepts_json(request):
+    """Whether DRF would pick its JSON renderer for `request` (no ?format= and JSON or anything first in Accept)."""
+    accepted = request.headers.get("Accept", "*/*").split(",")[0].split(";")[0].strip()
+    return "format" not in request.GET and accepted in ("", "*/*", "application/*", "application/json")
+
+
+def has_credentials(request):
+    """Whether DRF would try to authenticate `request` (a token or a session)."""
+    return "Authorization" in request.headers or settings.SESSION_COOKIE_NAME in request.COOKIES
+
+
+def async_catalog_view(view):
+    """
+    Async front for a CatalogCacheMixin view: JSON GETs the catalog cache can
+    answer are served on the event loop under ASGI, without a worker thread or
+    the DRF request cycle. Only requests without credentials take this path,
+    since skipping DRF skips authentication; catalog reads are public, so for
+    them DRF's answer is the cached one. Cache misses, requests with
+    credentials, other renderers and writes run `view` in a thread as usual.
+    """
+    sync_view = sync_to_async(view)
+
+    @wraps(view)
+    async def catalog_view(request, *args, **kwargs):
+        if request.method == "GET" and accepts_json(request) and not has_credentials(request):
+            entry = await catalog_cache.alookup(await catalog_cache.aget_version(), request.get_full_path())
+            if entry is not None:
+                return cached_response(request, entry)
+        return await sync_view(request, *args, **kwargs)
+    return catalog_view
+
+
 # Create your views here.
-class CategoryListCreateView(generics.ListCreateAPIView):
+class CategoryListCreateView(ReplicaReadMixin, CatalogCacheMixin, generics.ListCreateAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAdminOrReadOnly]
@@ -32,13 +120,13 @@ class CategoryDetailView(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [IsAdminOrReadOnly]
 
 
-class ProductListCreateView(generics.ListCreateAPIView):
+class ProductListCreateView(ReplicaReadMixin, CatalogCacheMixin, generics.ListCreateAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAdminOrReadOnly]
 
 
-class ProductDetailView(generics.RetrieveUpdateDestroyAPIView):
+class ProductDetailView(CatalogCacheMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAdminOrReadOnly]
@@ -52,12 +140,151 @@ class ProductDetailView(generics.RetrieveUpdateDestroyAPIView):
         return super().patch(request, *args, **kwargs)
 
 
-class StockLogListView(generics.ListAPIView):
-    queryset = StockLog.objects.all().order_by("-timestamp")
+class ProductImportView(generics.GenericAPIView):
+    """
+    Create or update products in bulk from an uploaded CSV or NDJSON file.
+    Expects a multipart POST with:
+      - file: Rows with sku, name, description, category (name), price and stock.
+      - file_format (optional): "csv" or "ndjson", guessed from the file name by default.
+    Products are matched by SKU and missing categories are created. The response
+    counts created, updated and failed rows and lists the errors of failed rows.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        upload = request.FILES.get("file")
+        if upload is None:
+            return Response({"detail": "Upload a CSV or NDJSON file as 'file'."}, status=status.HTTP_400_BAD_REQUEST)
+
+        file_format = request.data.get("file_format") or ("ndjson" if upload.name.endswith((".ndjson", ".jsonl")) else "csv")
+        if file_format not in importer.FORMATS:
+            return Response({"detail": f"Unsupported file format: {file_format}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        report = importer.import_products(importer.read_rows(upload, file_format), max_errors=settings.PRODUCT_IMPORT_MAX_ERRORS)
+        return Response(report, status=status.HTTP_200_OK)
+
+
+class StockAdjustView(generics.GenericAPIView):
+    """
+    Adjust the stock of many products in one transaction, e.g. for a warehouse sync.
+    Expects a POST request with:
+      - adjustments: A list of {product or sku, delta or stock} entries.
+    Entries are applied in order, so a later delta adds to an earlier absolute stock.
+    Either every adjustment is applied or none is; the response lists the new stock levels.
+    """
+    serializer_class = BulkStockAdjustmentSerializer
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        adjustments = serializer.validated_data["adjustments"]
+
+        skus = {adjustment["sku"] for adjustment in adjustments if "sku" in adjustment}
+        product_ids = dict(Product.objects.filter(sku__in=skus).values_list("sku", "id")) if skus else {}
+        unknown = sorted(skus - product_ids.keys())
+        if unknown:
+            raise ValidationError({"detail": f"Unknown SKUs: {', '.join(unknown)}"})
+
+        deltas, levels = {}, {}
+        for adjustment in adjustments:
+            product_id = adjustment["product"] if "product" in adjustment else product_ids[adjustment["sku"]]
+            if "stock" in adjustment:
+                deltas.pop(product_id, None)
+                levels[product_id] = adjustment["stock"]
+            elif product_id in levels:
+                levels[product_id] += adjustment["delta"]
+                if levels[product_id] < 0:
+                    raise ValidationError({"detail": f"Adjustments take the stock of product {product_id} below zero."})
+            else:
+                deltas[product_id] = deltas.get(product_id, 0) + adjustment["delta"]
+
+        new_levels, errors = adjust_stock(deltas, levels)
+        if errors:
+            return Response({
+                "detail": "Stock was not adjusted.",
+                "errors": [{"product": product_id, "error": error} for product_id, error in errors.items()],
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({"products": [{"product": product_id, "stock": stock} for product_id, stock in new_levels.items()]})
+
+
+class ProductSearchView(CatalogCacheMixin, generics.ListAPIView):
+    """
+    Full-text product search over names, categories and descriptions, ranked by relevance.
+    Query parameters:
+      - q: Search terms, each matched as a word prefix.
+      - category, min_price, max_price, in_stock: Optional filters.
+      - limit, offset: The page of results to return.
+    The response includes match counts per category (facets) for refining the search.
+    """
+    serializer_class = ProductSerializer
+    permission_classes = [permissions.AllowAny]
+
+    def list(self, request, *args, **kwargs):
+        params = ProductSearchSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        products, count, facets = search.search(params.validated_data.pop("q"), **params.validated_data)
+        return Response({
+            "count": count,
+            "results": self.get_serializer(products, many=True).data,
+            "facets": {"categories": facets},
+        })
+
+
+class StockLogListView(ReplicaReadMixin, generics.ListAPIView):
+    queryset = StockLog.objects.select_related("product").order_by("-timestamp", "-id")
     serializer_class = StockLogSerializer
     permission_classes = [permissions.IsAdminUser]
+    pagination_class = StockLogCursorPagination
 
     # Enable filtering by product and date
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_class = StockLogFilter
-    ordering_fields = ["timestamp"] 
\ No newline at end of file
+    ordering_fields = ["timestamp"]
+
+
+class StockLogExportView(generics.GenericAPIView):
+    """
+    Streams every stock log entry matching the StockLogFilter filters as CSV or NDJSON.
+    Rows are fetched in chunks and written as they are read, so memory use stays flat however large the export.
+    """
+    queryset = StockLog.objects.order_by("-timestamp", "-id")
+    permission_classes = [permissions.IsAdminUser]
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = StockLogFilter
+
+    FIELDS = ("id", "product", "product_name", "change_type", "quantity_changed", "new_stock_level", "timestamp")
+    CONTENT_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+    def get(self, request, file_format):
+        if file_format not in self.CONTENT_TYPES:
+            raise Http404(f"Unsupported export format: {file_format}")
+
+        rows = (
+            self.filter_queryset(self.get_queryset())
+            .values_list("id", "product_id", "product__name", "change_type", "quantity_changed", "new_stock_level", "timestamp")
+            .iterator(chunk_size=settings.STOCK_LOG_EXPORT_CHUNK_SIZE)
+        )
+        lines = self.csv_lines(rows) if file_format == "csv" else self.ndjson_lines(rows)
+
+        response = StreamingHttpResponse(lines, content_type=self.CONTENT_TYPES[file_format])
+        response["Content-Disposition"] = f'attachment; filename="stock_logs.{file_format}"'
+        return response
+
+    def csv_lines(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.FIELDS)
+        for row in rows:
+            yield writer.writerow(row[:-1] + (row[-1].isoformat(),))
+
+    def ndjson_lines(self, rows):
+        for row in rows:
+            yield json.dumps(dict(zip(self.FIELDS, row)), cls=DjangoJSONEncoder) + "\n"
+
+
+class Echo:
+    """File-like object for csv.writer that returns each written line instead of buffering it."""
+    def write(self, value):
+        return value
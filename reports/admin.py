@@ -0,0 +1,27 @@
+from django.contrib import admin
+from .models import DailyCategorySales, DailyCouponSales, DailyProductSales
+
+
+class DailyProductSalesAdmin(admin.ModelAdmin):
+    list_display = ("date", "product", "units_sold", "revenue", "discount", "refunded_units", "refunds")
+    search_fields = ("product__name",)
+    list_filter = ("date",)
+    ordering = ("-date", "-revenue")
+
+
+class DailyCategorySalesAdmin(admin.ModelAdmin):
+    list_display = ("date", "category", "units_sold", "revenue", "discount", "refunded_units", "refunds")
+    list_filter = ("date", "category")
+    ordering = ("-date", "-revenue")
+
+
+class DailyCouponSalesAdmin(admin.ModelAdmin):
+    list_display = ("date", "coupon", "orders", "units_sold", "revenue", "discount", "refunds")
+    search_fields = ("coupon__code",)
+    list_filter = ("date",)
+    ordering = ("-date", "-revenue")
+
+
+admin.site.register(DailyProductSales, DailyProductSalesAdmin)
+admin.site.register(DailyCategorySales, DailyCategorySalesAdmin)
+admin.site.register(DailyCouponSales, DailyCouponSalesAdmin)
@@ -0,0 +1,23 @@
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from reports.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily sales rollups of a range of days from completed and refunded orders."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=date.fromisoformat, help="First day to rebuild (YYYY-MM-DD). Defaults to --days before --end.")
+        parser.add_argument("--end", type=date.fromisoformat, help="Last day to rebuild (YYYY-MM-DD). Defaults to today.")
+        parser.add_argument("--days", type=int, default=30, help="Days to rebuild when --start is not given.")
+
+    def handle(self, *args, **options):
+        end = options["end"] or timezone.localdate()
+        start = options["start"] or end - timedelta(days=options["days"] - 1)
+        if start > end:
+            raise CommandError("--start must not be after --end.")
+
+        rebuild(start, end)
+        self.stdout.write(f"Rebuilt sales rollups from {start} to {end}.")
@@ -0,0 +1,56 @@
+from django.db import models
+from products.models import Category, Product
+from orders.models import Coupon
+
+
+class SalesRollup(models.Model):
+    """Sales of one day, counted when orders are completed and refunded (see reports.rollups)."""
+    date = models.DateField()
+    units_sold = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # After coupon discounts
+    discount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    refunded_units = models.PositiveIntegerField(default=0)
+    refunds = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        abstract = True
+
+
+class DailyProductSales(SalesRollup):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="daily_sales")
+
+    class Meta:
+        verbose_name_plural = "daily product sales"
+        constraints = [
+            models.UniqueConstraint(fields=["date", "product"], name="unique_daily_product_sales"),
+        ]
+
+    def __str__(self):
+        return f"{self.date} | {self.product_id} | {self.units_sold} sold"
+
+
+class DailyCategorySales(SalesRollup):
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="daily_sales")
+
+    class Meta:
+        verbose_name_plural = "daily category sales"
+        constraints = [
+            models.UniqueConstraint(fields=["date", "category"], name="unique_daily_category_sales"),
+        ]
+
+    def __str__(self):
+        return f"{self.date} | {self.category_id} | {self.units_sold} sold"
+
+
+class DailyCouponSales(SalesRollup):
+    coupon = models.ForeignKey(Coupon, on_delete=models.CASCADE, related_name="daily_sales")
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "daily coupon sales"
+        constraints = [
+            models.UniqueConstraint(fields=["date", "coupon"], name="unique_daily_coupon_sales"),
+        ]
+
+    def __str__(self):
+        return f"{self.date} | {self.coupon_id} | {self.orders} orders"
@@ -0,0 +1,125 @@
+"""
+Daily sales rollups.
+
+Reports read DailyProductSales, DailyCategorySales and DailyCouponSales, never
+orders or payments, so a report costs O(days) whatever the order volume. The
+rollups are kept up to date as events happen (see reports.signals): an order's
+lines count as sold on the day the order is completed, and as refunded on the
+day its payment is refunded. Every event costs a fixed number of queries: the
+day's rows are created with one INSERT ... ON CONFLICT DO NOTHING per table and
+incremented with one UPDATE of relative (F expression) changes, so concurrent
+events never lose each other's counts.
+
+A line's discount is what its coupon took off when the order was priced
+(OrderItem.discount), so later price changes don't alter past rollups.
+`manage.py rebuild_sales_rollups` recomputes a range of days from the orders;
+orders don't record when they were completed or refunded, so a rebuild dates
+both by Order.updated, which stops changing once an order is completed.
+"""
+from collections import defaultdict
+from django.db import models, transaction
+from django.db.models import Case, F, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from orders.models import OrderItem
+from .models import DailyCategorySales, DailyCouponSales, DailyProductSales
+
+LINE_FIELDS = ("order_id", "product_id", "product__category_id", "coupon_id", "quantity", "total_price", "discount")
+
+# Rollup model -> (its key field, the line field holding the key)
+ROLLUPS = {
+    DailyProductSales: ("product_id", "product_id"),
+    DailyCategorySales: ("category_id", "product__category_id"),
+    DailyCouponSales: ("coupon_id", "coupon_id"),
+}
+
+
+def sale_amounts(line):
+    charged = line["total_price"]
+    return {"units_sold": line["quantity"], "revenue": charged, "discount": line["discount"]}
+
+
+def refund_amounts(line):
+    return {"refunded_units": line["quantity"], "refunds": line["total_price"]}
+
+
+def collect(lines, amounts):
+    """Sum lines into {rollup model: {key: {field: delta}}} using `amounts(line)`."""
+    totals = {model: defaultdict(lambda: defaultdict(int)) for model in ROLLUPS}
+    coupon_orders = defaultdict(set)
+    for line in lines:
+        line_amounts = amounts(line)
+        for model, (_, line_field) in ROLLUPS.items():
+            key = line[line_field]
+            if key is None:
+                continue
+            for field, amount in line_amounts.items():
+                totals[model][key][field] += amount
+        if line["coupon_id"] and amounts is sale_amounts:
+            coupon_orders[line["coupon_id"]].add(line["order_id"])
+
+    for coupon_id, order_ids in coupon_orders.items():
+        totals[DailyCouponSales][coupon_id]["orders"] += len(order_ids)
+    return totals
+
+
+def add(day, totals):
+    """Add collected totals to the rollups of `day`."""
+    for model, deltas in totals.items():
+        if not deltas:
+            continue
+        key_field = ROLLUPS[model][0]
+        model.objects.bulk_create([model(date=day, **{key_field: key}) for key in deltas], ignore_conflicts=True)
+
+        updates = {}
+        for field in {field for key_deltas in deltas.values() for field in key_deltas}:
+            if isinstance(model._meta.get_field(field), models.DecimalField):
+                output_field = models.DecimalField(max_digits=14, decimal_places=2)
+            else:
+                output_field = models.IntegerField()
+            whens = [When(**{key_field: key}, then=F(field) + key_deltas[field]) for key, key_deltas in deltas.items() if key_deltas[field]]
+            if whens:
+                updates[field] = Case(*whens, default=F(field), output_field=output_field)
+        if updates:
+            model.objects.filter(date=day, **{f"{key_field}__in": deltas.keys()}).update(**updates)
+
+
+def order_lines(order):
+    return list(OrderItem.objects.filter(order=order).values(*LINE_FIELDS))
+
+
+def record_sale(order, day=None):
+    """Count a completed order's lines as sold on `day` (today by default)."""
+    add(day or timezone.localdate(), collect(order_lines(order), sale_amounts))
+
+
+def record_refund(order, day=None):
+    """Count a refunded order's lines as refunded on `day` (today by default)."""
+    add(day or timezone.localdate(), collect(order_lines(order), refund_amounts))
+
+
+def rebuild(start, end):
+    """Recompute the rollups of the days from `start` to `end` (inclusive) from completed and refunded orders."""
+    with transaction.atomic():
+        for model in ROLLUPS:
+            model.objects.filter(date__range=(start, end)).delete()
+
+        lines = OrderItem.objects.filter(order__status="Completed", order__updated__date__range=(start, end))
+        _rebuild_days(lines, sale_amounts)
+        _rebuild_days(lines.filter(order__payment__status="Refunded"), refund_amounts)
+
+
+def _rebuild_days(lines, amounts):
+    """Add `lines` to the rollups one day at a time, in order of their Order.updated."""
+    day, batch = None, []
+    rows = lines.annotate(day=TruncDate("order__updated")).order_by("order__updated", "id").values("day", *LINE_FIELDS)
+    for row in rows.iterator(chunk_size=2000):
+        if row["day"] != day:
+            if batch:
+                add(day, collect(batch, amounts))
+            day, batch = row["day"], []
+        batch.append(row)
+    if batch:
+        add(day, collect(batch, amounts))
+
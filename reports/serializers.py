@@ -0,0 +1,29 @@
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import serializers
+
+
+class ReportRangeSerializer(serializers.Serializer):
+    """Validates a report's date range, defaulting to the last REPORT_DEFAULT_DAYS days."""
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+
+    def validate(self, data):
+        data["end"] = data.get("end") or timezone.localdate()
+        data["start"] = data.get("start") or data["end"] - timedelta(days=settings.REPORT_DEFAULT_DAYS - 1)
+        if data["start"] > data["end"]:
+            raise serializers.ValidationError({"start": "Start date must not be after the end date."})
+        if (data["end"] - data["start"]).days >= settings.REPORT_MAX_DAYS:
+            raise serializers.ValidationError({"detail": f"Reports can cover at most {settings.REPORT_MAX_DAYS} days."})
+        return data
+
+
+class RevenueReportSerializer(ReportRangeSerializer):
+    interval = serializers.ChoiceField(choices=["day", "week", "month"], default="day")
+    category = serializers.IntegerField(min_value=1, required=False)
+
+
+class TopProductsReportSerializer(ReportRangeSerializer):
+    by = serializers.ChoiceField(choices=["revenue", "units_sold"], default="revenue")
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
@@ -0,0 +1,18 @@
+from django.dispatch import receiver
+from orders.signals import order_status_changed
+from payments.signals import payment_refunded
+from . import rollups
+
+
+@receiver(order_status_changed)
+def record_completed_order(sender, order, old_status, **kwargs):
+    """Completed orders count as sold in the daily rollups."""
+    if order.status == "Completed":
+        rollups.record_sale(order)
+
+
+@receiver(payment_refunded)
+def record_refunded_payment(sender, payment, **kwargs):
+    # Payments for orders that were canceled before they were paid were never counted as sold
+    if payment.order.status == "Completed":
+        rollups.record_refund(payment.order)
@@ -0,0 +1,103 @@
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from orders.checkout import place_order
+from orders.models import Coupon
+from payments.models import Payment
+from payments.webhooks import handle_refund
+from products.models import Category, Product
+from .models import DailyCategorySales, DailyCouponSales, DailyProductSales
+from .rollups import rebuild
+
+User = get_user_model()
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = User.objects.create_user(email="buyer@example.com", username="buyer", password="pass12345")
+        admin = User.objects.create_superuser(email="admin@example.com", username="admin", password="pass12345")
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+
+        self.gadgets = Category.objects.create(name="Gadgets")
+        self.books = Category.objects.create(name="Books")
+        self.phone = Product.objects.create(name="Phone", description="-", category=self.gadgets, price=Decimal("100.00"), stock=50)
+        self.book = Product.objects.create(name="Book", description="-", category=self.books, price=Decimal("20.00"), stock=50)
+        self.coupon = Coupon.objects.create(
+            code="PHONE10", discount=Decimal("10.00"), product=self.phone,
+            valid_from=timezone.now() - timezone.timedelta(days=1), valid_to=timezone.now() + timezone.timedelta(days=1),
+        )
+
+    def complete(self, cart):
+        order = place_order(self.customer, cart)
+        order.status = "Completed"
+        order.save()
+        return order
+
+    def sell(self):
+        self.complete([{"product": self.phone.id, "quantity": 2, "coupon": self.coupon.id}, {"product": self.book.id, "quantity": 1}])
+        refunded = self.complete([{"product": self.book.id, "quantity": 3}])
+        Payment.objects.create(order=refunded, amount=refunded.total_amount, status="Completed", stripe_payment_intent="pi_1")
+        handle_refund({"payment_intent": "pi_1"})
+        self.place_order_pending = place_order(self.customer, [{"product": self.book.id, "quantity": 5}])
+
+    def rollup_rows(self):
+        return [
+            list(DailyProductSales.objects.order_by("product_id").values("date", "product_id", "units_sold", "revenue", "discount", "refunded_units", "refunds")),
+            list(DailyCategorySales.objects.order_by("category_id").values("date", "category_id", "units_sold", "revenue", "refunds")),
+            list(DailyCouponSales.objects.values("date", "coupon_id", "orders", "units_sold", "revenue", "discount")),
+        ]
+
+    def test_completed_and_refunded_orders_update_the_rollups(self):
+        self.sell()
+
+        phone = DailyProductSales.objects.get(product=self.phone, date=timezone.localdate())
+        self.assertEqual((phone.units_sold, phone.revenue, phone.discount), (2, Decimal("180.00"), Decimal("20.00")))
+        book = DailyProductSales.objects.get(product=self.book)
+        self.assertEqual((book.units_sold, book.revenue, book.refunded_units, book.refunds), (4, Decimal("80.00"), 3, Decimal("60.00")))
+        coupon = DailyCouponSales.objects.get(coupon=self.coupon)
+        self.assertEqual((coupon.orders, coupon.revenue, coupon.discount), (1, Decimal("180.00"), Decimal("20.00")))
+
+    def test_rebuild_matches_incremental_rollups(self):
+        self.sell()
+        incremental = self.rollup_rows()
+
+        rebuild(timezone.localdate(), timezone.localdate())
+        self.assertEqual(self.rollup_rows(), incremental)
+
+    def test_rebuild_keeps_the_discount_given_at_sale_time(self):
+        self.sell()
+        self.phone.price = Decimal("150.00")
+        self.phone.save()
+
+        rebuild(timezone.localdate(), timezone.localdate())
+        phone = DailyProductSales.objects.get(product=self.phone)
+        self.assertEqual((phone.revenue, phone.discount), (Decimal("180.00"), Decimal("20.00")))
+
+    def test_reports_read_only_the_rollups(self):
+        self.sell()
+
+        with self.assertNumQueries(2):  # Totals and series, both from the category rollups
+            revenue = self.client.get(reverse("report-revenue"), {"interval": "month"})
+        self.assertEqual(revenue.status_code, 200)
+        self.assertEqual(revenue.data["totals"]["revenue"], Decimal("260.00"))
+        self.assertEqual(revenue.data["totals"]["net_revenue"], Decimal("200.00"))
+        self.assertEqual(len(revenue.data["series"]), 1)
+
+        top = self.client.get(reverse("report-top-products"), {"by": "units_sold"})
+        self.assertEqual([row["product"] for row in top.data["results"]], [self.book.id, self.phone.id])
+
+        coupons = self.client.get(reverse("report-coupons"))
+        self.assertEqual(coupons.data["results"][0]["code"], "PHONE10")
+        self.assertEqual(coupons.data["results"][0]["discount_rate"], Decimal("0.1000"))
+
+    def test_report_range_is_validated(self):
+        response = self.client.get(reverse("report-revenue"), {"start": "2025-02-01", "end": "2025-01-01"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(reverse("report-top-products"), {"start": "2000-01-01"}).status_code, 400)
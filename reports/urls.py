@@ -0,0 +1,8 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path("reports/revenue/", views.RevenueReportView.as_view(), name="report-revenue"),
+    path("reports/top-products/", views.TopProductsReportView.as_view(), name="report-top-products"),
+    path("reports/coupons/", views.CouponReportView.as_view(), name="report-coupons"),
+]
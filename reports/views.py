@@ -0,0 +1,113 @@
+from django.db.models import F, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .models import DailyCategorySales, DailyCouponSales, DailyProductSales
+from .serializers import ReportRangeSerializer, RevenueReportSerializer, TopProductsReportSerializer
+from ecommerce.replicas import ReplicaReadMixin
+
+TOTALS = {
+    "units_sold": Sum("units_sold"),
+    "revenue": Sum("revenue"),
+    "discount": Sum("discount"),
+    "refunded_units": Sum("refunded_units"),
+    "refunds": Sum("refunds"),
+}
+PERIODS = {"week": TruncWeek, "month": TruncMonth}
+
+
+def report_params(request, serializer_class):
+    serializer = serializer_class(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data
+
+
+def totals_row(row):
+    """Report row with zero for missing sums and the revenue left after refunds."""
+    row = {key: value or 0 for key, value in row.items()}
+    row["net_revenue"] = row["revenue"] - row["refunds"]
+    return row
+
+
+class RevenueReportView(ReplicaReadMixin, APIView):
+    """
+    Revenue, discounts and refunds per day, week or month between `start` and `end`,
+    optionally for one `category`. Reads only the daily category rollups.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        params = report_params(request, RevenueReportSerializer)
+        rollups = DailyCategorySales.objects.filter(date__range=(params["start"], params["end"]))
+        if "category" in params:
+            rollups = rollups.filter(category_id=params["category"])
+
+        period = PERIODS[params["interval"]]("date") if params["interval"] in PERIODS else F("date")
+        series = rollups.annotate(period=period).values("period").annotate(**TOTALS).order_by("period")
+
+        return Response({
+            "start": params["start"],
+            "end": params["end"],
+            "interval": params["interval"],
+            "totals": totals_row(rollups.aggregate(**TOTALS)),
+            "series": [totals_row(row) for row in series],
+        })
+
+
+class TopProductsReportView(ReplicaReadMixin, APIView):
+    """Best selling products between `start` and `end`, by revenue or units sold. Reads only the daily product rollups."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        params = report_params(request, TopProductsReportSerializer)
+        products = (
+            DailyProductSales.objects.filter(date__range=(params["start"], params["end"]))
+            .values("product_id", "product__name")
+            .annotate(**TOTALS)
+            .order_by(f"-{params['by']}", "product_id")[:params["limit"]]
+        )
+
+        return Response({
+            "start": params["start"],
+            "end": params["end"],
+            "by": params["by"],
+            "results": [
+                {"product": row.pop("product_id"), "product_name": row.pop("product__name"), **totals_row(row)}
+                for row in products
+            ],
+        })
+
+
+class CouponReportView(ReplicaReadMixin, APIView):
+    """
+    How much each coupon sold and gave away between `start` and `end`: orders,
+    revenue, discount, average order value and the share of the list price
+    discounted. Reads only the daily coupon rollups.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        params = report_params(request, ReportRangeSerializer)
+        coupons = (
+            DailyCouponSales.objects.filter(date__range=(params["start"], params["end"]))
+            .values("coupon_id", "coupon__code")
+            .annotate(orders=Sum("orders"), **TOTALS)
+            .order_by("-revenue", "coupon_id")
+        )
+
+        results = []
+        for row in coupons:
+            coupon, code = row.pop("coupon_id"), row.pop("coupon__code")
+            row = totals_row(row)
+            list_price = row["revenue"] + row["discount"]
+            results.append({
+                "coupon": coupon,
+                "code": code,
+                **row,
+                "average_order_value": round(row["revenue"] / row["orders"], 2) if row["orders"] else 0,
+                "discount_rate": round(row["discount"] / list_price, 4) if list_price else 0,
+            })
+
+        return Response({"start": params["start"], "end": params["end"], "results": results})
@@ -3,4 +3,5 @@ from . import views
 
 urlpatterns = [
     path("profile/", views.UserDetailView.as_view(), name="user-detail"),
+    path("profile/order-summary/", views.UserOrderSummaryView.as_view(), name="user-order-summary"),
 ]
\ No newline at end of file
@@ -2,6 +2,9 @@ from django.shortcuts import render
 from rest_framework import generics, permissions
 from django.contrib.auth import get_user_model
 from .serializers import CustomUserSerializer
+from orders.models import OrderSummary
+from orders.serializers import OrderSummarySerializer
+from orders.summaries import rebuild
 
 User = get_user_model()
 
@@ -17,4 +20,17 @@ class UserDetailView(generics.RetrieveUpdateAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
-        return self.request.user
\ No newline at end of file
+        return self.request.user
+
+
+class UserOrderSummaryView(generics.RetrieveAPIView):
+    """The user's order totals for their dashboard, read from a single OrderSummary row."""
+    serializer_class = OrderSummarySerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_object(self):
+        try:
+            return OrderSummary.objects.get(user=self.request.user)
+        except OrderSummary.DoesNotExist:
+            rebuild([self.request.user.pk])
+            return OrderSummary.objects.get(user=self.request.user)
@@ -0,0 +1,61 @@
+"""
+Async API views.
+
+DRF's APIView only runs synchronously, so async endpoints (served without a
+worker thread by ecommerce/asgi.py) are plain Django views wrapped with
+async_api_view. The wrapper authenticates the request with DRF's configured
+DEFAULT_AUTHENTICATION_CLASSES and parses its body in a single thread hop, since
+authentication reads the user table, then passes the DRF Request to the view
+and turns APIExceptions into JSON error responses like DRF does.
+"""
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import APIException, NotAuthenticated
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+
+def authenticate(request):
+    """DRF Request for `request`, with its user authenticated and its body parsed."""
+    api_request = Request(
+        request,
+        parsers=[JSONParser(), FormParser(), MultiPartParser()],
+        authenticators=[authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+    )
+    api_request.user
+    api_request.data
+    return api_request
+
+
+def async_api_view(view):
+    """
+    Decorate an `async def view(request, api_request, ...)` that requires an
+    authenticated user. CSRF is enforced by SessionAuthentication, as in DRF.
+    """
+    @csrf_exempt
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            api_request = await sync_to_async(authenticate)(request)
+            if not api_request.user.is_authenticated:
+                raise NotAuthenticated()
+            return await view(request, api_request, *args, **kwargs)
+        except APIException as exc:
+            detail = exc.detail if isinstance(exc.detail, (dict, list)) else {"detail": exc.detail}
+            return JsonResponse(detail, status=exc.status_code, safe=False)
+    return wrapper
+
+
+def release_connections():
+    """
+    Give pooled database connections back before waiting on another service,
+    so requests waiting on it don't hold connections the pool could lend out.
+    Connections in a transaction are kept.
+    """
+    for connection in connections.all(initialized_only=True):
+        if getattr(connection, "pool", None) is not None and not connection.in_atomic_block:
+            connection.close()
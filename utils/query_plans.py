@@ -0,0 +1,40 @@
+"""
+Query plan checks for tests.
+
+unindexed_steps() asks the database how it would run a queryset and returns
+the plan steps that read a whole table, or that sort rows the query could have
+read in index order, so tests can pin hot queries to their indexes. SQLite
+(EXPLAIN QUERY PLAN) and PostgreSQL plans are understood; on PostgreSQL
+sequential scans are disabled while planning, since the planner prefers them
+on the small tables of a test database whether or not an index exists.
+"""
+import re
+from django.db import connections, transaction
+
+
+def query_plan(queryset):
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return queryset.explain()
+
+    with transaction.atomic(using=queryset.db):
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        return queryset.explain()
+
+
+def unindexed_steps(queryset, allow_sort=False):
+    """Plan lines of `queryset` that scan a table in full (or sort in memory, unless `allow_sort`)."""
+    vendor = connections[queryset.db].vendor
+    steps = []
+    for line in query_plan(queryset).splitlines():
+        if vendor == "sqlite":
+            scan = re.search(r"\bSCAN (\w+)(.*)", line)
+            if scan and scan.group(1) != "CONSTANT" and "USING" not in scan.group(2):
+                steps.append(line.strip())
+            elif not allow_sort and "USE TEMP B-TREE" in line:
+                steps.append(line.strip())
+        elif vendor == "postgresql":
+            if "Seq Scan" in line or (not allow_sort and re.search(r"(^|->)\s*Sort\b", line.strip())):
+                steps.append(line.strip())
+    return steps